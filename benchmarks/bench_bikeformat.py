@@ -0,0 +1,135 @@
+"""
+Benchmarks for bikeformat.
+
+python benchmarks/bench_bikeformat.py
+
+Compares the recursive and iterative etree_to_panflute engines on a deep outline
+(one chain of nested rows) and a wide outline (many sibling rows), the
+panflute route to Pandoc JSON against the direct JSON emitter, and full against
+cached (SubtreeCache) re-conversion after a single-row edit.
+"""
+import json
+import sys
+import time
+from pathlib import Path as P
+
+import lxml.etree as ET
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import (  # noqa: E402
+    NS,
+    SubtreeCache,
+    namespaces,
+    etree_to_panflute,
+    etree_to_pandoc_json,
+)
+
+
+def _bike_skeleton():
+    html = ET.Element(f"{NS}html", nsmap={None: namespaces["ns"]})
+    head = ET.SubElement(html, f"{NS}head")
+    ET.SubElement(head, f"{NS}meta", attrib={"charset": "utf-8"})
+    body = ET.SubElement(html, f"{NS}body")
+    root_ul = ET.SubElement(body, f"{NS}ul", attrib={"id": "root"})
+    return html, root_ul
+
+
+def _add_row(ul, i, data_type=None):
+    attrib = {"id": f"r{i}"}
+    if data_type is not None:
+        attrib["data-type"] = data_type
+    li = ET.SubElement(ul, f"{NS}li", attrib=attrib)
+    p = ET.SubElement(li, f"{NS}p")
+    p.text = f"row {i} with "
+    strong = ET.SubElement(p, f"{NS}strong")
+    strong.text = "bold"
+    strong.tail = " text"
+    return li
+
+
+def deep_outline(depth=1000):
+    """a chain of `depth` nested body rows"""
+    html, ul = _bike_skeleton()
+    for i in range(depth):
+        li = _add_row(ul, i)
+        ul = ET.SubElement(li, f"{NS}ul")
+    return html
+
+
+def wide_outline(width=100_000):
+    """a heading row with `width` child rows, alternating runs of body and task rows"""
+    html, ul = _bike_skeleton()
+    heading = _add_row(ul, "h", "heading")
+    ul = ET.SubElement(heading, f"{NS}ul")
+    for i in range(width):
+        _add_row(ul, i, "task" if (i // 10) % 2 else None)
+    return html
+
+
+def sectioned_outline(sections=500, rows=100):
+    """`sections` heading rows with `rows` child rows each, every tenth with two children"""
+    html, ul = _bike_skeleton()
+    for s in range(sections):
+        heading = _add_row(ul, f"h{s}", "heading")
+        section_ul = ET.SubElement(heading, f"{NS}ul")
+        for i in range(rows):
+            li = _add_row(section_ul, f"{s}.{i}", "task" if (i // 10) % 2 else None)
+            if i % 10 == 0:
+                child_ul = ET.SubElement(li, f"{NS}ul")
+                _add_row(child_ul, f"{s}.{i}.a")
+                _add_row(child_ul, f"{s}.{i}.b", "code")
+    return html
+
+
+def best_of(func, *args, repeat=3, **kwargs):
+    """best wall-clock time of `repeat` calls, in seconds"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    outlines = [
+        ("deep (1000 levels)", deep_outline(1000), 1000),
+        ("deep (5000 levels)", deep_outline(5000), 5000),
+        ("wide (100k siblings)", wide_outline(100_000), 100_000),
+    ]
+    for label, etree, n_rows in outlines:
+        for engine in ("recursive", "iterative"):
+            try:
+                seconds = best_of(etree_to_panflute, etree, engine=engine)
+            except RecursionError:
+                print(f"{label:24} {engine:10} RecursionError")
+                continue
+            print(f"{label:24} {engine:10} {seconds:8.3f}s {n_rows / seconds:10.0f} rows/s")
+
+    etree, n_rows = outlines[-1][1:]
+    for label, func in [
+        ("panflute + to_json", lambda: json.dumps(etree_to_panflute(etree).to_json())),
+        ("etree_to_pandoc_json", lambda: etree_to_pandoc_json(etree)),
+    ]:
+        seconds = best_of(func)
+        print(f"{'pandoc json':24} {label:20} {seconds:8.3f}s {n_rows / seconds:10.0f} rows/s")
+
+    # re-conversion after editing one row, with and without the subtree cache
+    etree = sectioned_outline(500, 100)
+    rows = etree.findall(f".//{NS}li")
+    cache = SubtreeCache()
+    etree_to_pandoc_json(etree, cache=cache)
+    edits = iter(range(10**9))
+
+    def edit_and_convert(cache):
+        rows[len(rows) // 2].find(f"{NS}p").text = f"edit {next(edits)} "
+        return etree_to_pandoc_json(etree, cache=cache)
+
+    for label, c in [("full", None), ("subtree cache", cache)]:
+        seconds = best_of(edit_and_convert, c, repeat=5)
+        print(f"{f'one edit ({len(rows)} rows)':24} {label:20} {seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark for cluster_runs/keep_clusters.
+
+python benchmarks/bench_clusters.py
+
+Compares the original list-building implementation (calling key_func twice per
+element) with the single-pass generators on 100k-item lists.
+"""
+import random
+import sys
+import time
+from pathlib import Path as P
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import (  # noqa: E402
+    LIST_DATA_TYPES,
+    cluster_runs,
+    iter_cluster_runs,
+    iter_keep_clusters,
+    keep_clusters,
+)
+
+
+def cluster_runs_reference(lst, key_func=lambda x: x):
+    current_cluster = []
+    clusters = []
+    for elem in lst:
+        if not current_cluster:
+            current_cluster.append(elem)
+        elif key_func(elem) == key_func(current_cluster[0]):
+            current_cluster.append(elem)
+        else:
+            clusters.append(current_cluster)
+            current_cluster = [elem]
+    if current_cluster:
+        clusters.append(current_cluster)
+    return clusters
+
+
+def keep_clusters_reference(clusters, filter_func=lambda x: True):
+    filtered_clusters = []
+    for cluster in clusters:
+        if filter_func(cluster):
+            filtered_clusters.append(cluster)
+        else:
+            for elem in cluster:
+                filtered_clusters.append([elem])
+    return filtered_clusters
+
+
+def rows(n=100_000, run_length=8, seed=0):
+    """dicts standing in for <li> attributes, in runs of random data-types"""
+    rng = random.Random(seed)
+    types = LIST_DATA_TYPES + ["body", "heading", "code"]
+    out = []
+    while len(out) < n:
+        data_type = rng.choice(types)
+        out.extend({"data-type": data_type} for _ in range(rng.randint(1, run_length)))
+    return out[:n]
+
+
+def best_of(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    def key(e):
+        return e.get("data-type", "body")
+
+    def keep(c):
+        return c[0].get("data-type") in LIST_DATA_TYPES
+
+    for run_length in (1, 8, 64):
+        items = rows(run_length=run_length)
+        cases = [
+            ("reference", lambda: keep_clusters_reference(cluster_runs_reference(items, key), keep)),
+            ("list wrappers", lambda: keep_clusters(cluster_runs(items, key), keep)),
+            ("generators", lambda: list(iter_keep_clusters(iter_cluster_runs(items, key), keep))),
+        ]
+        assert keep_clusters(cluster_runs(items, key), keep) == keep_clusters_reference(
+            cluster_runs_reference(items, key), keep
+        )
+        for label, func in cases:
+            seconds = best_of(func)
+            print(f"100k items, runs <= {run_length:3}  {label:14} {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
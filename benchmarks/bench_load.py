@@ -0,0 +1,56 @@
+"""
+Benchmark for loading .bike files.
+
+python benchmarks/bench_load.py
+
+Parses a directory of synthetic outlines by reading each file into bytes first, with
+ET.parse and a new parser per file, and with load_bike (memory-mapped, whole buffer or fed
+in chunks, reusing one parser). Peak memory is what tracemalloc sees, i.e. Python-side
+copies of the file contents, not libxml2's tree.
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path as P
+
+import lxml.etree as ET
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import load_bike  # noqa: E402
+
+from corpus import OutlineSpec, write_corpus  # noqa: E402
+
+
+def read_and_parse(path):
+    return ET.fromstring(path.read_bytes(), ET.XMLParser(remove_blank_text=True, huge_tree=True))
+
+
+def parse_file(path):
+    return ET.parse(str(path), ET.XMLParser(remove_blank_text=True, huge_tree=True)).getroot()
+
+
+def main(count=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, OutlineSpec(depth=4, fan_out=7), count)
+        size = sum(p.stat().st_size for p in paths)
+        print(f"{count} files, {size / 2**20:.1f} MiB")
+        for label, load in [
+            ("read() + fromstring", read_and_parse),
+            ("ET.parse", parse_file),
+            ("load_bike", load_bike),
+            ("load_bike (64k chunks)", lambda p: load_bike(p, chunk_size=1 << 16)),
+        ]:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            for path in paths:
+                load(path)
+            seconds = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label:24} {seconds:7.3f}s  peak {peak / 2**20:7.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark for the inline rich-text converters.
+
+python benchmarks/bench_rich_text.py
+
+Converts every row of a rich-text-dense outline with rich_text and rich_text_json,
+once with the tag dispatch tables and once with the if/elif chains they replaced.
+"""
+import sys
+import time
+from pathlib import Path as P
+
+import lxml.etree as ET
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import (  # noqa: E402
+    INLINE_CONTAINER_TAGS,
+    NS,
+    Code,
+    Emph,
+    Link,
+    Span,
+    Str,
+    Strikeout,
+    Strong,
+    Para,
+    _NULL_ATTR,
+    _attr_json,
+    _json_str,
+    _str_json,
+    rich_text,
+    rich_text_json,
+    text_content,
+)
+
+from bench_bikeformat import _bike_skeleton, best_of  # noqa: E402
+
+
+def _wrap_inline_chain(xhtml, parts, wrap_para=False):
+    """_wrap_inline before the dispatch table"""
+    if xhtml.tag == f"{NS}p":
+        if wrap_para:
+            return [Para(*parts)]
+        else:
+            return parts
+    elif xhtml.tag == f"{NS}a":
+        return [Link(*parts, url=xhtml.attrib["href"])]
+    elif xhtml.tag == f"{NS}span":
+        return [Span(*parts, attributes=xhtml.attrib)]
+    elif xhtml.tag == f"{NS}code":
+        return [Code(text_content(xhtml))]
+    elif xhtml.tag == f"{NS}strong":
+        return [Strong(*parts)]
+    elif xhtml.tag == f"{NS}em":
+        return [Emph(*parts)]
+    elif xhtml.tag == f"{NS}mark":
+        return [Span(*parts, attributes={"class": "mark"})]
+    elif xhtml.tag == f"{NS}s":
+        return [Strikeout(*parts)]
+    else:
+        return [(Str(text_content(xhtml)))]
+
+
+def _wrap_inline_json_chain(xhtml, parts):
+    """_wrap_inline_json before the dispatch table"""
+    tag = xhtml.tag
+    if tag == f"{NS}p":
+        return parts
+    elif tag == f"{NS}a":
+        return [
+            '{"t":"Link","c":[' + _NULL_ATTR + ",[" + ",".join(parts) + "],["
+            + _json_str(xhtml.attrib["href"]) + ',""]]}'
+        ]
+    elif tag == f"{NS}span":
+        return ['{"t":"Span","c":[' + _attr_json(xhtml.attrib) + ",[" + ",".join(parts) + "]]}"]
+    elif tag == f"{NS}code":
+        return ['{"t":"Code","c":[' + _NULL_ATTR + "," + _json_str(text_content(xhtml)) + "]}"]
+    elif tag == f"{NS}strong":
+        return ['{"t":"Strong","c":[' + ",".join(parts) + "]}"]
+    elif tag == f"{NS}em":
+        return ['{"t":"Emph","c":[' + ",".join(parts) + "]}"]
+    elif tag == f"{NS}mark":
+        return ['{"t":"Span","c":[["",[],[["class","mark"]]],[' + ",".join(parts) + "]]}"]
+    elif tag == f"{NS}s":
+        return ['{"t":"Strikeout","c":[' + ",".join(parts) + "]}"]
+    else:
+        return [_str_json(text_content(xhtml))]
+
+
+def rich_text_chain(xhtml):
+    """rich_text (without flatten/wrap_para) before the dispatch table"""
+    if xhtml.tag not in INLINE_CONTAINER_TAGS:
+        return _wrap_inline_chain(xhtml, [])
+    stack = [(xhtml, [Str(xhtml.text)] if xhtml.text else [], iter(xhtml))]
+    while True:
+        e, parts, children = stack[-1]
+        for child in children:
+            if child.tag in INLINE_CONTAINER_TAGS:
+                stack.append((child, [Str(child.text)] if child.text else [], iter(child)))
+                break
+            parts.extend(_wrap_inline_chain(child, []))
+        else:
+            stack.pop()
+            if e.tail is not None:
+                parts.append(Str(e.tail))
+            if not stack:
+                return _wrap_inline_chain(e, parts)
+            stack[-1][1].extend(_wrap_inline_chain(e, parts))
+
+
+def rich_text_json_chain(xhtml):
+    """rich_text_json before the dispatch table"""
+    if xhtml.tag not in INLINE_CONTAINER_TAGS:
+        return ",".join(_wrap_inline_json_chain(xhtml, []))
+    stack = [(xhtml, [_str_json(xhtml.text)] if xhtml.text else [], iter(xhtml))]
+    while True:
+        e, parts, children = stack[-1]
+        for child in children:
+            if child.tag in INLINE_CONTAINER_TAGS:
+                stack.append((child, [_str_json(child.text)] if child.text else [], iter(child)))
+                break
+            parts.extend(_wrap_inline_json_chain(child, []))
+        else:
+            stack.pop()
+            if e.tail is not None:
+                parts.append(_str_json(e.tail))
+            if not stack:
+                return ",".join(_wrap_inline_json_chain(e, parts))
+            stack[-1][1].extend(_wrap_inline_json_chain(e, parts))
+
+
+def rich_outline(rows=20_000):
+    """rows whose text mixes every inline tag, a few levels deep"""
+    html, ul = _bike_skeleton()
+    markup = (
+        'Row {i} <strong>bold <em>both</em></strong> and <a href="https://example.com/{i}">a '
+        '<mark>link</mark></a>, <code>x = {i}</code> <s>old</s> <span class="c">span '
+        "<em>em <strong>deep</strong></em></span> end"
+    )
+    for i in range(rows):
+        li = ET.SubElement(ul, f"{NS}li", id=f"r{i}")
+        p = ET.fromstring(f'<p xmlns="{NS[1:-1]}">' + markup.format(i=i) + "</p>")
+        li.append(p)
+    return html
+
+
+def main():
+    etree = rich_outline()
+    ps = list(etree.iter(f"{NS}p"))
+    n_inline = sum(1 for p in ps for _ in p.iter()) - len(ps)
+
+    def convert_all(func):
+        for p in ps:
+            func(p)
+
+    cases = [
+        ("rich_text", "if/elif chain", rich_text_chain),
+        ("rich_text", "dispatch table", rich_text),
+        ("rich_text_json", "if/elif chain", rich_text_json_chain),
+        ("rich_text_json", "dispatch table", rich_text_json),
+    ]
+    for name, label, func in cases:
+        seconds = best_of(convert_all, func, repeat=5)
+        print(f"{len(ps)} rows / {n_inline} inline elements  {name:15} {label:15} {seconds:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark for BikeDocument.sort_rows, counting Apple Events.
+
+python benchmarks/bench_sort_rows.py
+
+Sorts the top-level rows of synthetic outlines held by the fake appscript of the tests
+(tests/bike/fake_appscript.py), once from their generated order and again when already
+sorted, with sort_rows and with the previous implementation: reading id and name of each
+row, then looking up and moving every row to the end, one at a time. Against Bike each
+event is an IPC round trip, so the event counts matter more than the times here.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path as P
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+sys.path.insert(0, str(P(__file__).parents[1] / "tests" / "bike"))  # noqa: E402
+
+import rdhyee_utils.bike  # noqa: E402
+from rdhyee_utils.bike import Bike, BikeDocument  # noqa: E402
+
+import fake_appscript  # noqa: E402
+from fake_appscript import FakeBike, its  # noqa: E402
+
+from corpus import OutlineSpec, write_corpus  # noqa: E402
+
+
+def sort_rows_one_by_one(doc, r, row_func=lambda r: r.name, reverse=False):
+    sort_order = sorted(
+        [(x.id, row_func(x)) for x in r.rows],
+        key=lambda x: x[1],
+        reverse=reverse,
+    )
+    for id_, name in sort_order:
+        r_from = doc.rawdoc.rows[its.id == id_].get()[0]
+        r.rawrow.move(r_from, to=r.rawrow.rows.end)
+
+
+def main(sizes=(100, 1000, 3000)):
+    fake = FakeBike()
+    rdhyee_utils.bike.app = lambda app_name: fake
+    rdhyee_utils.bike.applescript = fake_appscript
+    bike = Bike()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            (path,) = write_corpus(P(tmp) / str(n), OutlineSpec(depth=0, fan_out=n))
+            for label, sort in [
+                ("one by one", lambda doc: sort_rows_one_by_one(doc, doc.root_row)),
+                ("sort_rows", lambda doc: doc.sort_rows(doc.root_row)),
+            ]:
+                doc = BikeDocument(bike, fake.load(path))
+                for state in ("unsorted", "sorted"):
+                    fake.events = 0
+                    t0 = time.perf_counter()
+                    sort(doc)
+                    seconds = time.perf_counter() - t0
+                    print(f"{n:6} rows {state:9} {label:11} {fake.events:7} events {seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark suite for bikeformat on synthetic outlines, with results saved as JSON.
+
+python benchmarks/bench_suite.py [--output results.json] [--compare earlier.json] [-k etree]
+
+Runs each benchmark on each corpus of corpus.py and writes the best-of timings to
+benchmarks/results/<time>-<commit>.json (or --output; benchmarks/results/ is gitignored);
+--compare prints the ratio of every timing to the one in an earlier results file. -k runs
+only the benchmarks whose names contain its argument.
+"""
+import argparse
+import datetime
+import io
+import json
+import platform
+import subprocess
+import sys
+from pathlib import Path as P
+
+import lxml.etree as ET
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import (  # noqa: E402
+    NS,
+    IdAllocator,
+    convert_text,
+    etree_to_pandoc_json,
+    etree_to_panflute,
+    get_task_list_items,
+    iter_rows,
+    rich_text,
+)
+
+from bench_bikeformat import best_of  # noqa: E402
+from corpus import OutlineSpec, generate_bike  # noqa: E402
+
+RESULTS_DIR = P(__file__).parent / "results"
+
+CORPORA = {
+    "default": OutlineSpec(),
+    "rich": OutlineSpec(depth=3, fan_out=6, rich_text=0.8),
+    "wide": OutlineSpec(depth=1, fan_out=150),
+}
+
+
+def _parse(source):
+    return ET.fromstring(source, ET.XMLParser(remove_blank_text=True, huge_tree=True))
+
+
+def _rich_text_all(etree):
+    for p in etree.iter(f"{NS}p"):
+        rich_text(p)
+
+
+def _allocate_ids(etree, n=10_000):
+    allocator = IdAllocator.from_etree(etree, seed=0)
+    for _ in range(n):
+        allocator.allocate()
+
+
+# name -> function(source bytes, parsed etree)
+BENCHMARKS = {
+    "parse": lambda source, etree: _parse(source),
+    "iter_rows": lambda source, etree: sum(1 for _ in iter_rows(io.BytesIO(source))),
+    "etree_to_panflute": lambda source, etree: etree_to_panflute(etree),
+    "etree_to_pandoc_json": lambda source, etree: etree_to_pandoc_json(etree),
+    "rich_text": lambda source, etree: _rich_text_all(etree),
+    "get_task_list_items": lambda source, etree: get_task_list_items(etree),
+    "id_allocation": lambda source, etree: _allocate_ids(etree),
+    "pandoc_markdown": lambda source, etree: convert_text(
+        etree_to_pandoc_json(etree), to_="markdown", from_="json"
+    ),
+}
+
+
+def _metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=P(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import pypandoc
+
+        pandoc = pypandoc.get_pandoc_version()
+    except OSError:
+        pandoc = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "lxml": ".".join(map(str, ET.LXML_VERSION)),
+        "pandoc": pandoc,
+    }
+
+
+def run(names=None, corpora=None, repeat=3) -> dict:
+    """
+    Time the benchmarks (all by default) on the corpora (all by default).
+
+    :return: {"meta": ..., "results": [{"benchmark", "corpus", "rows", "seconds"}, ...]};
+        seconds is None where the benchmark couldn't run (e.g. no pandoc)
+    """
+    results = []
+    for corpus in corpora or CORPORA:
+        source = generate_bike(CORPORA[corpus])
+        etree = _parse(source)
+        n_rows = sum(1 for _ in etree.iter(f"{NS}li"))
+        for name in names or BENCHMARKS:
+            try:
+                seconds = best_of(BENCHMARKS[name], source, etree, repeat=repeat)
+            except OSError as e:
+                print(f"{name:22} {corpus:8} skipped: {e}", file=sys.stderr)
+                seconds = None
+            else:
+                print(f"{name:22} {corpus:8} {n_rows:7} rows {seconds:8.3f}s")
+            results.append({"benchmark": name, "corpus": corpus, "rows": n_rows, "seconds": seconds})
+    return {"meta": _metadata(), "results": results}
+
+
+def compare(old: dict, new: dict) -> None:
+    """print new/old timing ratios of the benchmarks both results have"""
+    old_seconds = {(r["benchmark"], r["corpus"]): r["seconds"] for r in old["results"]}
+    print(f"compared with {old['meta'].get('commit')} of {old['meta'].get('timestamp')}")
+    for r in new["results"]:
+        before = old_seconds.get((r["benchmark"], r["corpus"]))
+        if before and r["seconds"] is not None:
+            print(f"{r['benchmark']:22} {r['corpus']:8} {r['seconds'] / before:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bikeformat benchmark suite.")
+    parser.add_argument("-o", "--output", type=P, help="results file")
+    parser.add_argument("--compare", type=P, help="earlier results file to compare with")
+    parser.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        help="only benchmarks whose names contain this (repeatable)",
+    )
+    parser.add_argument("--corpus", dest="corpora", action="append", choices=CORPORA)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    names = None
+    if args.patterns:
+        names = [name for name in BENCHMARKS if any(p in name for p in args.patterns)]
+        if not names:
+            parser.error(f"no benchmark name contains {' or '.join(args.patterns)}")
+
+    results = run(names, args.corpora, args.repeat)
+    output = args.output
+    if output is None:
+        stamp = results["meta"]["timestamp"].replace(":", "").replace("+0000", "Z")
+        output = RESULTS_DIR / f"{stamp}-{results['meta']['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1) + "\n")
+    print(f"results written to {output}")
+
+    if args.compare is not None:
+        compare(json.loads(args.compare.read_text()), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark for repeated queries against the same outline.
+
+python benchmarks/bench_xpath.py
+
+Runs each query of bikeformat.XPATH_QUERIES many times on one synthetic outline, with the
+compiled XPath registry (query) and as get_task_list_items and ids did before: parsing
+the expression, written with //, on every call (etree.xpath).
+"""
+import sys
+from pathlib import Path as P
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import XPATH_QUERIES, namespaces, query  # noqa: E402
+
+from bench_bikeformat import best_of  # noqa: E402
+from corpus import OutlineSpec, generate_outline  # noqa: E402
+
+# variables for the parameterized queries
+VARIABLES = {"rows_of_type": {"data_type": "task"}, "row_by_id": {"id": "missing"}}
+
+
+def main(repeat_queries=200):
+    for label, spec in [("small", OutlineSpec(depth=2, fan_out=4)), ("default", OutlineSpec())]:
+        etree = generate_outline(spec)
+        n_rows = len(query(etree, "rows"))
+        for name, expr in XPATH_QUERIES.items():
+            variables = VARIABLES.get(name, {})
+            old_expr = expr.replace("/descendant::", "//")
+
+            def parsed_each_time():
+                for _ in range(repeat_queries):
+                    etree.xpath(old_expr, namespaces=namespaces, **variables)
+
+            def compiled():
+                for _ in range(repeat_queries):
+                    query(etree, name, **variables)
+
+            before = best_of(parsed_each_time)
+            after = best_of(compiled)
+            print(
+                f"{label:8} {n_rows:6} rows  {name:16} x{repeat_queries}"
+                f"  etree.xpath {before:7.3f}s  compiled {after:7.3f}s  {before / after:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
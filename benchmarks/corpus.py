@@ -0,0 +1,166 @@
+"""
+Reproducible synthetic .bike outlines for the benchmarks.
+
+python benchmarks/corpus.py OUT_DIR [--seed 0] [--depth 4] [--fan-out 6] [--rich-text 0.3] [--count 1]
+
+The same OutlineSpec always gives the same bytes: rows, ids, text and markup are all
+drawn from a random.Random seeded by the spec.
+"""
+import argparse
+import random
+import sys
+from pathlib import Path as P
+from typing import List, NamedTuple, Tuple
+
+import lxml.etree as ET
+
+sys.path.insert(0, str(P(__file__).parents[1]))  # noqa: E402
+
+from rdhyee_utils.bike.bikeformat import LIST_DATA_TYPES, IdAllocator, namespaces  # noqa: E402
+
+# relative weights of the row data-types
+DEFAULT_DATA_TYPES = (
+    ("body", 50),
+    ("heading", 8),
+    ("task", 15),
+    ("unordered", 8),
+    ("ordered", 5),
+    ("code", 4),
+    ("quote", 4),
+    ("note", 1),
+    ("hr", 1),
+)
+
+WORDS = (
+    "outline row task note plan draft review ship idea meeting follow up call email read "
+    "write test build deploy fix bug design doc spec chart list item alpha beta gamma"
+).split()
+
+# inline markup, with the format of its opening tag
+MARKUP = (
+    ("strong", "<strong>"),
+    ("em", "<em>"),
+    ("code", "<code>"),
+    ("a", '<a href="https://example.com/{n}">'),
+    ("mark", "<mark>"),
+    ("s", "<s>"),
+    ("span", '<span class="c{n}">'),
+)
+
+
+class OutlineSpec(NamedTuple):
+    # levels of rows below the top level
+    depth: int = 4
+    # mean number of child rows of a row (and number of top-level rows)
+    fan_out: int = 6
+    # probability that a word starts a marked-up span of text
+    rich_text: float = 0.3
+    data_types: Tuple[Tuple[str, float], ...] = DEFAULT_DATA_TYPES
+    seed: int = 0
+
+
+def _rich_text(rng: random.Random, density: float, nested: bool = True) -> str:
+    words = rng.choices(WORDS, k=rng.randint(3, 12))
+    out = []
+    i = 0
+    while i < len(words):
+        if rng.random() >= density:
+            out.append(words[i])
+            i += 1
+            continue
+        tag, opener = rng.choice(MARKUP)
+        span = words[i : i + rng.randint(1, 3)]
+        i += len(span)
+        inner = " ".join(span)
+        if nested and tag != "code" and rng.random() < density:
+            inner += " " + _rich_text(rng, density, nested=False)
+        out.append(opener.format(n=rng.randrange(100)) + inner + f"</{tag}>")
+    return " ".join(out)
+
+
+def generate_bike(spec: OutlineSpec = OutlineSpec()) -> bytes:
+    """
+    The XHTML of a synthetic .bike outline. Top-level rows are never list rows, so the
+    outline converts with only_doc_children=True too.
+    """
+    rng = random.Random(repr(spec))
+    ids = IdAllocator(rng=rng)
+    types, weights = zip(*spec.data_types)
+    top_types = [(t, w) for t, w in spec.data_types if t not in LIST_DATA_TYPES]
+    parts = [
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="{namespaces["ns"]}">'
+        '<head><meta charset="utf-8"/></head><body><ul id="root">'
+    ]
+
+    # explicit stack of remaining child counts per open level
+    stack = [spec.fan_out]
+    while stack:
+        if stack[-1] == 0:
+            stack.pop()
+            if stack:
+                parts.append("</ul></li>")
+            continue
+        stack[-1] -= 1
+        level = len(stack)
+        if level == 1:
+            data_type = rng.choices(*zip(*top_types))[0]
+        else:
+            data_type = rng.choices(types, weights)[0]
+
+        attrs = f' id="{ids.allocate()}"'
+        if data_type != "body":
+            attrs += f' data-type="{data_type}"'
+        if data_type == "task" and rng.random() < 0.3:
+            attrs += ' data-done="2024-01-01T00:00:00Z"'
+        if data_type == "hr":
+            text = ""
+        elif data_type == "code":
+            text = " ".join(rng.choices(WORDS, k=rng.randint(1, 6)))
+        else:
+            text = _rich_text(rng, spec.rich_text)
+        parts.append(f"<li{attrs}><p>{text}</p>")
+
+        children = rng.randint(0, 2 * spec.fan_out) if level <= spec.depth else 0
+        if children:
+            parts.append("<ul>")
+            stack.append(children)
+        else:
+            parts.append("</li>")
+    parts.append("</ul></body></html>\n")
+    return "".join(parts).encode("utf-8")
+
+
+def generate_outline(spec: OutlineSpec = OutlineSpec()) -> ET.Element:
+    """generate_bike, parsed"""
+    return ET.fromstring(generate_bike(spec), ET.XMLParser(remove_blank_text=True, huge_tree=True))
+
+
+def write_corpus(out_dir, spec: OutlineSpec = OutlineSpec(), count: int = 1) -> List[P]:
+    """write `count` outlines (seeds spec.seed, spec.seed + 1, ...) to out_dir"""
+    out_dir = P(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = out_dir / f"synthetic-{spec.seed + i}.bike"
+        path.write_bytes(generate_bike(spec._replace(seed=spec.seed + i)))
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic .bike outlines.")
+    parser.add_argument("out_dir", type=P)
+    defaults = OutlineSpec()
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fan-out", type=int, default=defaults.fan_out)
+    parser.add_argument("--rich-text", type=float, default=defaults.rich_text)
+    parser.add_argument("--count", type=int, default=1)
+    args = parser.parse_args(argv)
+    spec = OutlineSpec(args.depth, args.fan_out, args.rich_text, seed=args.seed)
+    for path in write_corpus(args.out_dir, spec, args.count):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,23 @@ for bike
 """
 
 from pathlib import Path as P
-from typing import Union
+from typing import List, NamedTuple, Optional, Tuple, Union
 
-import applescript
-from appscript import app, k, its, mactypes
+try:
+    import applescript
+    from appscript import app, k, mactypes
+except ImportError:
+    # not on macOS: the Apple Events classes below can't reach Bike, but FileBikeDocument
+    # (rdhyee_utils.bike.filedoc) and bikeformat work. Keywords become their names.
+    applescript = app = mactypes = None
+
+    class _Keywords(object):
+        def __getattr__(self, name):
+            if name.startswith("__"):
+                raise AttributeError(name)
+            return name
+
+    k = _Keywords()
 
 import lxml
 import lxml.etree as ET
@@ -32,6 +45,52 @@ def _to_raw(obj):
         return obj
 
 
+class RowSnapshot(NamedTuple):
+    """
+    The properties of one row, as fetched by BikeDocument.row_snapshot and
+    BikeRow.row_snapshot.
+    """
+
+    id: str
+    name: str
+    level: int
+    # "body", "heading", "task", ... as in the data-type attribute of .bike files
+    data_type: str
+
+
+def _snapshot_rows(rawrows) -> List[RowSnapshot]:
+    """
+    Fetch ids, names, levels and types of a collection of rows with one Apple Event per
+    property, instead of one per property and row. (The rows can change between the four
+    events if Bike is being edited meanwhile.)
+    """
+    ids = rawrows.id()
+    names = rawrows.name()
+    levels = rawrows.level()
+    # types come back as keywords (k.body, ...)
+    types = [getattr(t, "name", t) for t in rawrows.type()]
+    return [RowSnapshot(*values) for values in zip(ids, names, levels, types)]
+
+
+def _sorting_moves(current: List[str], target: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    The fewest moves that reorder the ids `current` into `target`: every id outside a
+    longest run already in target order moves once. Returns (id, id to move it before)
+    pairs, None meaning to the end, to apply in order.
+    """
+    from rdhyee_utils.bike.bikeformat import _longest_increasing
+
+    position = {id_: i for i, id_ in enumerate(target)}
+    staying = {current[i] for i in _longest_increasing([position[id_] for id_ in current])}
+
+    # back to front, so the row each one moves before is already in place
+    moves = []
+    for i in range(len(target) - 1, -1, -1):
+        if target[i] not in staying:
+            moves.append((target[i], target[i + 1] if i + 1 < len(target) else None))
+    return moves
+
+
 class BikeRow(object):
     def __init__(self, bike, rawrow):
         self.bike = bike
@@ -65,6 +124,39 @@ class BikeRow(object):
     def rows(self):
         return [BikeRow(self.bike, r) for r in self.rawrow.rows()]
 
+    def row_snapshot(self) -> List[RowSnapshot]:
+        """
+        id, name, level and type of the child rows, in four Apple Events
+        """
+        return _snapshot_rows(self.rawrow.rows)
+
+
+class _SnapshotRow(BikeRow):
+    """
+    A BikeRow whose id, name and level come from a RowSnapshot, without Apple Events;
+    everything else (text_content, rows, rawrow, ...) goes to Bike as usual.
+    """
+
+    def __init__(self, bike, rawrow, snapshot: RowSnapshot):
+        super().__init__(bike, rawrow)
+        self.snapshot = snapshot
+
+    @property
+    def id(self):
+        return self.snapshot.id
+
+    @property
+    def level(self):
+        return self.snapshot.level
+
+    @property
+    def name(self):
+        return self.snapshot.name
+
+    @name.setter
+    def name(self, name):
+        self.rawrow.name.set(name)
+
 
 class BikeRichText(object):
     def __init__(self, bike, rawrichtext):
@@ -125,6 +217,13 @@ class BikeDocument(object):
     def rows(self):
         return [BikeRow(self.bike, r) for r in self.rawdoc.rows()]
 
+    def row_snapshot(self) -> List[RowSnapshot]:
+        """
+        id, name, level and type of every row, in document order, in four Apple Events
+        (rather than the four per row of reading them off .rows)
+        """
+        return _snapshot_rows(self.rawdoc.rows)
+
     @property
     def selection_row(self):
         return BikeRow(self.bike, self.rawdoc.selection_row())
@@ -193,6 +292,15 @@ class BikeDocument(object):
         etree = self.lxml_etree()
         return [e.attrib["id"] for e in etree.xpath("//*[@id]")]
 
+    def outline_index(self, from_=None, all: bool = True):
+        """
+        Export the document once and index it (see bikeformat.OutlineIndex), for running
+        many queries against the same snapshot of the outline.
+        """
+        from rdhyee_utils.bike.bikeformat import OutlineIndex
+
+        return OutlineIndex(self.lxml_etree(from_=from_, all=all))
+
     def sort_rows(
         self,
         r: BikeRow,
@@ -201,18 +309,18 @@ class BikeDocument(object):
     ) -> None:
         """
         r: the row whose children to sort
-        row_func: a function that takes a row and returns a value to sort on
+        row_func: a function that takes a row and returns a value to sort on; the id, name
+            and level of the rows it gets are read for all children at once (row_snapshot),
+            so sorting on them costs four Apple Events plus one per row moved
         reverse: whether to sort in reverse order
         """
-        sort_order = sorted(
-            [(x.id, row_func(x)) for x in r.rows],
-            key=lambda x: x[1],
-            reverse=reverse,
-        )
-
-        for id_, name in sort_order:
-            r_from = self.rawdoc.rows[its.id == id_].get()[0]
-            r.rawrow.move(r_from, to=r.rawrow.rows.end)
+        rows = r.rawrow.rows
+        children = [_SnapshotRow(self.bike, rows.ID(s.id), s) for s in r.row_snapshot()]
+        current = [row.id for row in children]
+        target = [row.id for row in sorted(children, key=row_func, reverse=reverse)]
+
+        for id_, before in _sorting_moves(current, target):
+            rows.ID(id_).move(to=rows.end if before is None else rows.ID(before).before)
 
     def swap_rows(self, r: BikeRow, i: int, j: int):
         """swap the child rows i and j of parent row r"""
@@ -0,0 +1,285 @@
+"""
+batch conversion of directories of .bike files
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path as P
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import pypandoc
+
+from rdhyee_utils.bike.bikeformat import (
+    CONVERTER_VERSION,
+    ONLY_DOC_CHILDREN,
+    convert_text,
+    etree_to_pandoc_json,
+    load_bike,
+)
+from rdhyee_utils.bike.incremental import file_hash
+from rdhyee_utils.bike.xslt import (
+    XSLT_EXTRA_ARGS,
+    XSLT_FORMATS,
+    XSLT_VERSION,
+    UnsupportedBikeContent,
+    xslt_convert,
+)
+
+MANIFEST_NAME = ".bike-convert-manifest.json"
+
+# output file suffix per pandoc output format
+SUFFIXES = {
+    "markdown": ".md",
+    "gfm": ".md",
+    "commonmark": ".md",
+    "html": ".html",
+    "docx": ".docx",
+    "odt": ".odt",
+    "latex": ".tex",
+    "plain": ".txt",
+}
+BINARY_FORMATS = {"docx", "odt", "epub", "pdf"}
+
+# "pandoc" always goes through etree_to_pandoc_json and pandoc; "xslt" uses the
+# stylesheets of rdhyee_utils.bike.xslt where they apply and pandoc otherwise
+ENGINES = ("pandoc", "xslt")
+
+
+class ConversionResult(NamedTuple):
+    path: P
+    output: P
+    # "converted", "skipped" or "failed"
+    status: str
+    seconds: float
+    error: Optional[str] = None
+
+
+def converter_signature(
+    to: str, extra_args: Sequence[str], only_doc_children: bool, engine: str = "pandoc"
+) -> str:
+    """
+    Everything besides the source file that determines the output of a conversion.
+
+    engine: the engine that writes the output; for "xslt" that is the version of the
+        stylesheets rather than of pandoc, which isn't asked for (or needed)
+    """
+    if engine == "xslt" and _xslt_applies(to, extra_args, only_doc_children):
+        converter = [XSLT_VERSION, engine]
+    else:
+        converter = [pypandoc.get_pandoc_version()]
+    return json.dumps([CONVERTER_VERSION, *converter, to, list(extra_args), only_doc_children])
+
+
+def _xslt_applies(to: str, extra_args: Sequence[str], only_doc_children: bool) -> bool:
+    return to in XSLT_FORMATS and tuple(extra_args) == XSLT_EXTRA_ARGS and only_doc_children
+
+
+def convert_file(
+    path: Union[str, P],
+    output: Union[str, P],
+    to: str = "markdown",
+    extra_args: Sequence[str] = ("--wrap=none",),
+    only_doc_children: bool = ONLY_DOC_CHILDREN,
+    engine: str = "pandoc",
+) -> float:
+    """
+    Convert one .bike file to output in format `to`; return the seconds it took.
+
+    engine: "pandoc", or "xslt" to skip pandoc for html and commonmark output (with the
+        default extra_args) when the document is within what the stylesheets reproduce
+    """
+    return _convert_file(path, output, to, extra_args, only_doc_children, engine)[0]
+
+
+def _convert_file(
+    path, output, to, extra_args, only_doc_children, engine
+) -> Tuple[float, str]:
+    # convert_file, also returning the engine that wrote the output
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}")
+    t0 = time.perf_counter()
+    etree = load_bike(path)
+    output = P(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    if engine == "xslt" and _xslt_applies(to, extra_args, only_doc_children):
+        try:
+            text = xslt_convert(etree, to=to, only_doc_children=only_doc_children)
+        except UnsupportedBikeContent:
+            pass
+        else:
+            output.write_text(text, encoding="utf-8")
+            return time.perf_counter() - t0, "xslt"
+
+    source = etree_to_pandoc_json(etree, only_doc_children=only_doc_children)
+    if to in BINARY_FORMATS:
+        convert_text(source, to_=to, from_="json", extra_args=extra_args, outputfile=str(output))
+    else:
+        text = convert_text(source, to_=to, from_="json", extra_args=extra_args)
+        output.write_text(text, encoding="utf-8")
+    return time.perf_counter() - t0, "pandoc"
+
+
+def _convert_job(job):
+    path, output, to, extra_args, only_doc_children, engine = job
+    try:
+        return _convert_file(path, output, to, extra_args, only_doc_children, engine), None
+    except Exception as e:
+        return (None, None), f"{type(e).__name__}: {e}"
+
+
+def load_manifest(out_dir: Union[str, P]) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(P(out_dir) / MANIFEST_NAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(out_dir: Union[str, P], manifest: Dict[str, Dict[str, str]]) -> None:
+    path = P(out_dir) / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def convert_directory(
+    src_dir: Union[str, P],
+    out_dir: Union[str, P],
+    to: str = "markdown",
+    extra_args: Sequence[str] = ("--wrap=none",),
+    only_doc_children: bool = ONLY_DOC_CHILDREN,
+    max_workers: Optional[int] = None,
+    force: bool = False,
+    engine: str = "pandoc",
+) -> List[ConversionResult]:
+    """
+    Convert every .bike file under src_dir to out_dir, mirroring the directory tree.
+
+    Files whose content hash and converter signature match the manifest in out_dir
+    (and whose output still exists) are skipped unless force is True.
+
+    max_workers: size of the process pool (default: number of CPUs); 1 converts in this process
+    engine: see convert_file. Files the xslt engine leaves to pandoc get pandoc's signature,
+        and pandoc's version is only asked for when pandoc's signature is needed
+    """
+    src_dir, out_dir = P(src_dir), P(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    suffix = SUFFIXES.get(to, f".{to}")
+
+    signatures = {}
+
+    def signature(engine_used):
+        if engine_used not in signatures:
+            signatures[engine_used] = converter_signature(
+                to, extra_args, only_doc_children, engine_used
+            )
+        return signatures[engine_used]
+
+    def up_to_date(entry_signature):
+        if entry_signature == signature(engine):
+            return True
+        if engine == "pandoc":
+            return False
+        # output the xslt engine left to pandoc; without pandoc it can't be up to date
+        try:
+            return entry_signature == signature("pandoc")
+        except OSError:
+            return False
+
+    if engine == "pandoc":
+        # fail early without pandoc
+        signature(engine)
+
+    old_manifest = load_manifest(out_dir)
+    manifest = {}
+    results = []
+    jobs = []
+    hashes = {}
+    for path in sorted(src_dir.rglob("*.bike")):
+        rel = path.relative_to(src_dir).as_posix()
+        output = (out_dir / rel).with_suffix(suffix)
+        digest = hashes[rel] = file_hash(path)
+        entry = old_manifest.get(rel)
+        if (
+            not force
+            and entry is not None
+            and entry["hash"] == digest
+            and up_to_date(entry["signature"])
+            and output.exists()
+        ):
+            manifest[rel] = entry
+            results.append(ConversionResult(path, output, "skipped", 0.0))
+        else:
+            jobs.append((path, output, to, tuple(extra_args), only_doc_children, engine))
+
+    if max_workers == 1:
+        converted = list(map(_convert_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            converted = list(executor.map(_convert_job, jobs))
+
+    for (path, output, *_), ((seconds, engine_used), error) in zip(jobs, converted):
+        rel = path.relative_to(src_dir).as_posix()
+        if error is None:
+            manifest[rel] = {"hash": hashes[rel], "signature": signature(engine_used)}
+            results.append(ConversionResult(path, output, "converted", seconds))
+        else:
+            results.append(ConversionResult(path, output, "failed", 0.0, error))
+
+    save_manifest(out_dir, manifest)
+    return sorted(results, key=lambda r: r.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a directory tree of .bike files, skipping unchanged ones."
+    )
+    parser.add_argument("src_dir", type=P)
+    parser.add_argument("out_dir", type=P)
+    parser.add_argument("-t", "--to", default="markdown", help="pandoc output format")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("-f", "--force", action="store_true", help="convert unchanged files too")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="pandoc",
+        help="xslt: convert html/commonmark without pandoc where possible",
+    )
+    parser.add_argument(
+        "--extra-arg",
+        action="append",
+        dest="extra_args",
+        default=None,
+        help="extra pandoc argument (repeatable; default --wrap=none)",
+    )
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    results = convert_directory(
+        args.src_dir,
+        args.out_dir,
+        to=args.to,
+        extra_args=args.extra_args if args.extra_args is not None else ("--wrap=none",),
+        max_workers=args.jobs,
+        force=args.force,
+        engine=args.engine,
+    )
+    for r in results:
+        detail = r.error if r.status == "failed" else f"{r.seconds:.3f}s"
+        print(f"{r.status:9} {r.path.relative_to(args.src_dir)}  {detail}")
+
+    counts = {s: sum(r.status == s for r in results) for s in ("converted", "skipped", "failed")}
+    print(
+        f"{counts['converted']} converted, {counts['skipped']} skipped, "
+        f"{counts['failed']} failed in {time.perf_counter() - t0:.2f}s"
+    )
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,12 +5,26 @@ from lxml import etree
 
 from pathlib import Path as P
 
-from typing import List, Union
-
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+import bisect
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
 import random
 import string
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
 
 from rdhyee_utils.bike import Bike
+from rdhyee_utils.pandoc.cache import ConversionCache
+from rdhyee_utils.pandoc.server import PandocServer, PandocServerPool, try_server_convert
 
 # import json
 import panflute as pf
@@ -47,9 +61,28 @@ BALLOT_BOX_WITH_X = "\u2612"
 
 namespaces = {"ns": "http://www.w3.org/1999/xhtml"}
 NS = f"{{{namespaces['ns']}}}"
+LI = f"{NS}li"
+P_TAG = f"{NS}p"
+UL = f"{NS}ul"
+
+A_TAG = f"{NS}a"
+SPAN_TAG = f"{NS}span"
+CODE_TAG = f"{NS}code"
+STRONG_TAG = f"{NS}strong"
+EM_TAG = f"{NS}em"
+MARK_TAG = f"{NS}mark"
+S_TAG = f"{NS}s"
+
+LIST_DATA_TYPES = ["ordered", "unordered", "quote", "task"]
+# inline tags whose children are converted (rather than flattened to text) by rich_text
+INLINE_CONTAINER_TAGS = {P_TAG, A_TAG, SPAN_TAG, STRONG_TAG, EM_TAG, MARK_TAG, S_TAG}
 
 OVERALL_PATH = P.home() / "obsidian" / "MainRY" / "bike" / "overall.bike"
 ONLY_DOC_CHILDREN = True
+# "iterative" (explicit stack) or "recursive"
+ENGINE = "iterative"
+# bump whenever a change alters conversion output, so incremental rebuilds redo every file
+CONVERTER_VERSION = "1"
 
 
 def convert_text(
@@ -63,35 +96,83 @@ def convert_text(
     verify_format=True,
     sandbox=False,
     cworkdir=None,
+    cache: Optional[ConversionCache] = None,
+    server: Union[PandocServer, PandocServerPool, None] = None,
 ) -> str:
+    """
+    cache: if given, reuse the result of an identical earlier conversion instead of running pandoc
+        (not used when writing to outputfile)
+    server: if given, convert with this long-lived pandoc server, falling back to running
+        pandoc directly for outputfile/filters, options the server lacks, or server failures.
+        The server is always sandboxed and has no working directory, so it is only used with
+        sandbox=True and no cworkdir
+    """
+    key = None
+    if cache is not None and outputfile is None:
+        key = cache.key(
+            source,
+            to_,
+            from_,
+            extra_args=extra_args,
+            filters=filters,
+            encoding=encoding,
+            sandbox=sandbox,
+            cworkdir=cworkdir,
+        )
+        doc = cache.get(key)
+        if doc is not None:
+            return doc
+
+    doc = None
+    if outputfile is None and not filters and sandbox and cworkdir is None:
+        doc = try_server_convert(server, source, to_, from_, extra_args, encoding)
+
     # https://github.com/JessicaTegner/pypandoc/blob/5848968bda24335b4bf3dbf4a56eafa1bf88e0cd/pypandoc/__init__.py#L54
-    doc = pypandoc.convert_text(
-        source,
-        to=to_,
-        format=from_,
-        extra_args=extra_args,
-        encoding=encoding,
-        outputfile=outputfile,
-        filters=filters,
-        verify_format=verify_format,
-        sandbox=sandbox,
-        cworkdir=cworkdir,
-    )
+    if doc is None:
+        doc = pypandoc.convert_text(
+            source,
+            to=to_,
+            format=from_,
+            extra_args=extra_args,
+            encoding=encoding,
+            outputfile=outputfile,
+            filters=filters,
+            verify_format=verify_format,
+            sandbox=sandbox,
+            cworkdir=cworkdir,
+        )
+    if key is not None:
+        cache.put(key, doc)
     return doc
 
 
 # write out string representation of bike document
 
 
-def text_content(element, include_tail=True, strip=False):
+def _text_content_walk(element, include_tail=True, strip=False):
+    """text_content by walking the tree; used for subtrees with comments or processing instructions"""
     parts = []
     if element.text:
         if strip:
             parts.append(element.text.strip())
         else:
             parts.append(element.text)
-    for e in element:
-        parts.append(text_content(e))
+
+    # explicit stack instead of recursion so deeply nested markup can't hit the recursion limit
+    stack = [iter(element)]
+    tails = []
+    while stack:
+        e = next(stack[-1], None)
+        if e is None:
+            stack.pop()
+            if tails:
+                parts.append(tails.pop())
+            continue
+        if e.text:
+            parts.append(e.text)
+        stack.append(iter(e))
+        tails.append(e.tail or "")
+
     if include_tail and element.tail is not None:
         if strip:
             parts.append(element.tail.strip())
@@ -100,6 +181,33 @@ def text_content(element, include_tail=True, strip=False):
     return "".join(parts)
 
 
+# the concatenated text of a subtree, gathered in C (excludes the element's tail)
+_STRING_VALUE = etree.XPath("string()", smart_strings=False)
+_NOT_TEXT = (etree.Comment, etree.ProcessingInstruction, etree.Entity)
+
+
+def text_content(element, include_tail=True, strip=False):
+    """
+    The text of element and all its descendants, followed by its tail if include_tail.
+
+    strip: strip whitespace from the element's own text and tail (not from its descendants)
+    """
+    if len(element):
+        # XPath's string value leaves out the text of comments and processing instructions
+        if not isinstance(element.tag, str) or next(element.iter(*_NOT_TEXT), None) is not None:
+            return _text_content_walk(element, include_tail, strip)
+        text = _STRING_VALUE(element)
+        if strip and element.text:
+            text = element.text.strip() + text[len(element.text) :]
+    elif element.text:
+        text = element.text.strip() if strip else element.text
+    else:
+        text = ""
+    if include_tail and element.tail is not None:
+        text += element.tail.strip() if strip else element.tail
+    return text
+
+
 def walk_element(e, level=0):
     print("  " * level, e.tag)
     try:
@@ -114,36 +222,185 @@ def walk_element(e, level=0):
 
 
 def innerhtml(element):
-    parts = []
-    if element.text:
-        parts.append(element.text)
+    """
+    The markup inside element: its text and each child serialized on its own (carrying the
+    namespace declarations it needs, so every fragment parses by itself), with tails once
+    each and text escaped.
+    """
+    parts = [escape(element.text or "")]
     for e in element:
-        parts.append(etree.tostring(e).decode("utf-8"))
+        parts.append(etree.tostring(e, encoding="unicode", with_tail=False))
         if e.tail:
-            parts.append(e.tail)
+            parts.append(escape(e.tail))
     return "".join(parts)
 
 
+# queries on Bike documents, written for the namespaced XHTML; $name marks a parameter,
+# passed to query() as a keyword argument. /descendant:: is //'s meaning without its
+# descendant-or-self::node() step, which libxml2 evaluates about half as fast
+XPATH_QUERIES = {
+    "ids": "/descendant::*/@id",
+    "top_level_rows": "ns:body/ns:ul/*",
+    "rows": "/descendant::ns:li",
+    "rows_of_type": "/descendant::ns:li[@data-type = $data_type or not(@data-type) and $data_type = 'body']",
+    "task_rows": "/descendant::ns:li[@data-type = 'task']",
+    "done_task_rows": "/descendant::ns:li[@data-type = 'task'][@data-done]",
+    "open_task_rows": "/descendant::ns:li[@data-type = 'task'][not(@data-done)]",
+    "row_by_id": "/descendant::ns:li[@id = $id]",
+}
+# compiled once: for namespaced trees, and without the prefix for lxml.html trees
+XPATHS = {
+    name: etree.XPath(expr, namespaces=namespaces, smart_strings=False)
+    for name, expr in XPATH_QUERIES.items()
+}
+HTML_XPATHS = {
+    name: etree.XPath(expr.replace("ns:", ""), smart_strings=False)
+    for name, expr in XPATH_QUERIES.items()
+}
+
+
+def query(html: Union[Element, HtmlElement], name: str, **variables) -> list:
+    """
+    Run the compiled XPATH_QUERIES[name] on html, e.g. query(etree, "row_by_id", id="t3").
+    """
+    xpaths = HTML_XPATHS if isinstance(html, HtmlElement) else XPATHS
+    return xpaths[name](html, **variables)
+
+
 # html can be lxml.etree.Element or lxml.html.HtmlElement
 def get_task_list_items(html: Union[Element, HtmlElement]) -> List[Element]:
     if isinstance(html, HtmlElement):
-        return html.xpath("//li[@data-type='task']")
+        return HTML_XPATHS["task_rows"](html)
     elif isinstance(html, etree._Element):
-        return html.xpath("//ns:li[@data-type='task']", namespaces=namespaces)
+        return XPATHS["task_rows"](html)
 
 
-def generate_id_attribute(length):
-    if length < 1:
-        raise ValueError("Length must be a positive integer")
+_parsers = threading.local()
+
+
+def bike_parser() -> ET.XMLParser:
+    """
+    The XMLParser for .bike files (blank text removed, huge trees allowed), created once per
+    thread and reused: lxml parsers can be reused but not shared between threads.
+    """
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = ET.XMLParser(remove_blank_text=True, huge_tree=True)
+    return parser
+
+
+def load_bike(path: Union[str, P], chunk_size: Optional[int] = None) -> Element:
+    """
+    Parse a .bike file into its root element with bike_parser(), reading it through a
+    memory map instead of copying the file into a bytes object first.
+
+    chunk_size: feed the parser this many bytes at a time (copying one chunk at a time)
+        rather than parsing the whole mapped buffer in one go
+    """
+    parser = bike_parser()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # an empty file can't be mapped; let the parser report it
+            return ET.fromstring(b"", parser)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if chunk_size is None:
+                return ET.fromstring(buf, parser, base_url=str(path))
+            try:
+                for start in range(0, len(buf), chunk_size):
+                    parser.feed(buf[start : start + chunk_size])
+            except ET.XMLSyntaxError:
+                # reset the parser for the next file
+                try:
+                    parser.close()
+                except ET.XMLSyntaxError:
+                    pass
+                raise
+            return parser.close()
+
+
+class StreamedRow(NamedTuple):
+    """
+    One row of a .bike outline as produced by iter_rows.
+    `p` is the rich-text paragraph of the row; it is cleared once the next row is read.
+    """
 
-    # Start with a random letter (A-Za-z)
-    first_char = random.choice(string.ascii_letters)
+    id: Optional[str]
+    level: int
+    data_type: str
+    data_done: Optional[str]
+    p: Element
 
-    # Generate the remaining characters (A-Za-z0-9-_)
-    valid_chars = string.ascii_letters + string.digits + "-_"
-    remaining_chars = "".join(random.choice(valid_chars) for _ in range(length - 1))
 
-    return first_char + remaining_chars
+def iter_rows(source: Union[str, P, IO]) -> Iterator[StreamedRow]:
+    """
+    Stream the rows of a .bike file in document order without building the whole tree.
+
+    source: path or binary file-like object containing Bike XHTML
+    Top-level rows have level 1. Processed elements are cleared as the parse advances,
+    so memory use depends on outline depth rather than outline size.
+    """
+    if isinstance(source, P):
+        source = str(source)
+
+    level = 0
+    for event, elem in ET.iterparse(
+        source,
+        events=("start", "end"),
+        tag=(LI, P_TAG),
+        remove_blank_text=True,
+        huge_tree=True,
+    ):
+        if elem.tag == LI:
+            if event == "start":
+                level += 1
+            else:
+                level -= 1
+                # drop the finished row along with any finished siblings before it
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        elif event == "end":
+            li = elem.getparent()
+            if li is None or li.tag != LI:
+                continue
+            yield StreamedRow(
+                li.attrib.get("id"),
+                level,
+                li.attrib.get("data-type", "body"),
+                li.attrib.get("data-done"),
+                elem,
+            )
+            elem.clear(keep_tail=True)
+
+
+def iter_task_rows(
+    source: Union[str, P, IO], done: Optional[bool] = None
+) -> Iterator[StreamedRow]:
+    """
+    Stream the task rows of a .bike file -- the streaming counterpart of get_task_list_items.
+
+    done: if True only completed tasks, if False only open tasks, if None all tasks
+    """
+    for row in iter_rows(source):
+        if row.data_type != "task":
+            continue
+        if done is None or done == (row.data_done is not None):
+            yield row
+
+
+ID_FIRST_CHARS = string.ascii_letters
+ID_CHARS = string.ascii_letters + string.digits + "-_"
+
+
+def generate_id_attribute(length, rng=random):
+    """
+    rng: random.Random instance (or the random module) to draw characters from
+    """
+    if length < 1:
+        raise ValueError("Length must be a positive integer")
+
+    # Start with a random letter (A-Za-z), then the remaining characters (A-Za-z0-9-_)
+    return rng.choice(ID_FIRST_CHARS) + "".join(rng.choices(ID_CHARS, k=length - 1))
 
 
 def generate_unique_id_attribute(length, existing_ids, max_tries=100):
@@ -153,6 +410,99 @@ def generate_unique_id_attribute(length, existing_ids, max_tries=100):
         if id_ not in existing_ids:
             return id_
         try_count += 1
+    raise ValueError(f"no unique id of length {length} found in {max_tries} tries")
+
+
+class IdAllocator(object):
+    """
+    Hands out row ids that are unique within a document.
+
+    Existing ids are indexed once, so each allocation is O(1). When random ids keep
+    colliding with taken ones, the id length grows instead of giving up.
+    """
+
+    def __init__(self, existing_ids=(), length=8, seed=None, rng=None, max_tries=4):
+        """
+        existing_ids: ids already in use
+        length: initial length of allocated ids
+        seed: seed for a private random.Random, for reproducible ids
+        rng: random.Random instance to use instead (takes precedence over seed)
+        max_tries: collisions in a row at one length before the length grows
+        """
+        self.ids = set(existing_ids)
+        self.length = length
+        self.rng = rng if rng is not None else random.Random(seed)
+        self.max_tries = max_tries
+
+    @classmethod
+    def from_etree(cls, etree: ET.Element, **kwargs) -> "IdAllocator":
+        """
+        Allocator for a Bike etree, seeded with every id already in it.
+        """
+        return cls(ids(etree), **kwargs)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return id_ in self.ids
+
+    def add(self, id_: str) -> str:
+        """
+        Record an id created elsewhere.
+        """
+        if id_ in self.ids:
+            raise ValueError(f"id {id_} is already in use")
+        self.ids.add(id_)
+        return id_
+
+    def allocate(self) -> str:
+        """
+        Return a new id and mark it as used.
+        """
+        while True:
+            for _ in range(self.max_tries):
+                id_ = generate_id_attribute(self.length, self.rng)
+                if id_ not in self.ids:
+                    self.ids.add(id_)
+                    return id_
+            self.length += 1
+
+
+def iter_cluster_runs(iterable, key_func=lambda x: x) -> Iterator[list]:
+    """
+    Lazily cluster runs of consecutive elements with equal keys.
+
+    Args:
+    - iterable: The elements to cluster.
+    - key_func (function): A function to transform each element for comparison;
+      called exactly once per element.
+
+    Yields:
+    - list: The clusters, in order.
+    """
+    for _, run in itertools.groupby(iterable, key_func):
+        yield list(run)
+
+
+def iter_keep_clusters(clusters, filter_func=lambda x: True) -> Iterator[list]:
+    """
+    Lazily filter clusters based on a filter function, breaking up the other clusters
+    into length 1 lists.
+
+    Args:
+    - clusters: An iterable of clusters.
+    - filter_func (function): A function to filter each cluster.
+
+    Yields:
+    - list: The kept clusters and the pieces of the others, in order.
+    """
+    for cluster in clusters:
+        if filter_func(cluster):
+            yield cluster
+        else:
+            for elem in cluster:
+                yield [elem]
 
 
 def cluster_runs(lst, key_func=lambda x: x):
@@ -166,22 +516,7 @@ def cluster_runs(lst, key_func=lambda x: x):
     Returns:
     - list: A list of clustered elements.
     """
-    current_cluster = []
-    clusters = []
-
-    for elem in lst:
-        if not current_cluster:
-            current_cluster.append(elem)
-        elif key_func(elem) == key_func(current_cluster[0]):
-            current_cluster.append(elem)
-        else:
-            clusters.append(current_cluster)
-            current_cluster = [elem]
-
-    if current_cluster:
-        clusters.append(current_cluster)
-
-    return clusters
+    return list(iter_cluster_runs(lst, key_func))
 
 
 def keep_clusters(clusters, filter_func=lambda x: True):
@@ -195,61 +530,190 @@ def keep_clusters(clusters, filter_func=lambda x: True):
     Returns:
     - list: A filtered list of clusters.
     """
-    filtered_clusters = []
-
-    for cluster in clusters:
-        if filter_func(cluster):
-            filtered_clusters.append(cluster)
-        else:
-            for elem in cluster:
-                filtered_clusters.append([elem])
-
-    return filtered_clusters
+    return list(iter_keep_clusters(clusters, filter_func))
 
 
 def wrap_in_list_item(lst):
     return [e if isinstance(e, ListItem) else ListItem(e) for e in lst]
 
 
+# Clark tag -> function(element, converted children) -> panflute inlines; see register_inline_tag
+INLINE_HANDLERS = {
+    P_TAG: lambda xhtml, parts: parts,
+    A_TAG: lambda xhtml, parts: [Link(*parts, url=xhtml.attrib["href"])],
+    SPAN_TAG: lambda xhtml, parts: [Span(*parts, attributes=xhtml.attrib)],
+    # TO DO: think this part through more carefully -- am I flattening too much here?
+    CODE_TAG: lambda xhtml, parts: [Code(text_content(xhtml))],
+    STRONG_TAG: lambda xhtml, parts: [Strong(*parts)],
+    EM_TAG: lambda xhtml, parts: [Emph(*parts)],
+    MARK_TAG: lambda xhtml, parts: [Span(*parts, attributes={"class": "mark"})],
+    S_TAG: lambda xhtml, parts: [Strikeout(*parts)],
+}
+# as shipped, before any register_inline_tag calls
+_BUILTIN_INLINE_HANDLERS = dict(INLINE_HANDLERS)
+_BUILTIN_INLINE_CONTAINER_TAGS = frozenset(INLINE_CONTAINER_TAGS)
+
+
+def _flatten_inline(xhtml, parts):
+    return [Str(text_content(xhtml))]
+
+
+def register_inline_tag(tag: str, to_panflute, to_json=None, container: bool = True) -> None:
+    """
+    Teach rich_text (and rich_text_json) how to convert an inline tag, e.g. a custom span.
+
+    tag: a local name in the XHTML namespace ("sup") or a Clark-notation tag
+    to_panflute: function(element, parts) -> list of panflute inlines, where parts are the
+        converted children (the text and tail of the element and the tails of its children
+        included)
+    to_json: function(element, parts) -> list of Pandoc JSON strings, parts being JSON too;
+        without it the JSON emitter converts the element through to_panflute
+    container: whether the children are converted into parts; if False, parts is empty
+        and to_panflute flattens the element, tail included, itself (as code does)
+    """
+    if not tag.startswith("{"):
+        tag = f"{NS}{tag}"
+    INLINE_HANDLERS[tag] = to_panflute
+    if to_json is not None:
+        INLINE_JSON_HANDLERS[tag] = to_json
+    else:
+        INLINE_JSON_HANDLERS.pop(tag, None)
+    if container:
+        INLINE_CONTAINER_TAGS.add(tag)
+    else:
+        INLINE_CONTAINER_TAGS.discard(tag)
+
+
+def _wrap_inline(xhtml, parts, wrap_para=False) -> list["panflute.Element"]:
+    """wrap the converted children `parts` of the inline element xhtml"""
+    if wrap_para and xhtml.tag == P_TAG:
+        return [Para(*parts)]
+    return INLINE_HANDLERS.get(xhtml.tag, _flatten_inline)(xhtml, parts)
+
+
 def rich_text(xhtml, flatten=False, wrap_para=False) -> list["panflute.Element"]:
     # p, a, span, code, strong, em
 
     if flatten:
         xhtml_text = text_content(xhtml)
         xhtml_elem = Span(Str(xhtml_text), attributes=xhtml.attrib)
-        parts = [xhtml_elem]
+        return _wrap_inline(xhtml, [xhtml_elem], wrap_para)
+
+    if xhtml.tag not in INLINE_CONTAINER_TAGS:
+        return _wrap_inline(xhtml, [], wrap_para)
+
+    # TO DO: figure out where to stick in id attribute of parent li
+    # walk the inline markup with an explicit stack of (element, parts, children)
+    handlers, containers = INLINE_HANDLERS, INLINE_CONTAINER_TAGS
+    stack = [(xhtml, [Str(xhtml.text)] if xhtml.text else [], iter(xhtml))]
+    while True:
+        e, parts, children = stack[-1]
+        for child in children:
+            tag = child.tag
+            if tag in containers:
+                stack.append((child, [Str(child.text)] if child.text else [], iter(child)))
+                break
+            parts.extend(handlers.get(tag, _flatten_inline)(child, []))
+        else:
+            stack.pop()
+            if e.tail is not None:
+                parts.append(Str(e.tail))
+            if not stack:
+                return _wrap_inline(e, parts, wrap_para)
+            stack[-1][1].extend(handlers.get(e.tag, _flatten_inline)(e, parts))
+
+
+def _li_clusters(ul) -> Iterator[List[Element]]:
+    """group the li children of ul into runs of list-like rows; every other row is its own cluster"""
+    # one pass: each row's data-type is read once, and decides whether its run is kept whole
+    runs = itertools.groupby((e for e in ul if e.tag == LI), lambda e: e.get("data-type", "body"))
+    for data_type, run in runs:
+        if data_type in LIST_DATA_TYPES:
+            yield list(run)
+        else:
+            for li in run:
+                yield [li]
+
+
+def _merge_code_blocks(blocks) -> list:
+    """
+    Merge the runs of consecutive CodeBlocks in the block list blocks, as
+    merge_consecutive_codeblocks does; blocks that will become list items each stay apart.
+    """
+    merged = []
+    for block in blocks:
+        if isinstance(block, CodeBlock) and merged and isinstance(merged[-1], CodeBlock):
+            merged[-1].text += "\n" + block.text
+        else:
+            merged.append(block)
+    return merged
+
+
+def _cluster_to_panflute(cluster, _content):
+    """
+    cluster: a cluster from _li_clusters
+    _content: the converted rows of the cluster (each row followed by its converted children)
+    """
+    data_type = cluster[0].attrib.get("data-type", "body")
+    if data_type in ("unordered", "task"):
+        return [BulletList(*wrap_in_list_item(_content))]
+    elif data_type == "ordered":
+        return [OrderedList(*wrap_in_list_item(_content))]
+    elif data_type == "quote":
+        return [BlockQuote(*_merge_code_blocks(_content))]
+    # elif data_type == "code":
+    #     content = [CodeBlock("".join(_content))]
     else:
-        # TO DO: figure out where to stick in id attribute of parent li
-        parts = []
-        if xhtml.text:
-            parts.append(Str(xhtml.text))
-        for e in xhtml:
-            parts.extend(rich_text(e, flatten=flatten))
-        if xhtml.tail is not None:
-            parts.append(Str(xhtml.tail))
-
-    if xhtml.tag == f"{NS}p":
-        if wrap_para:
-            return [Para(*parts)]
+        return _content
+
+
+def _li_to_panflute(xhtml, heading_level=1):
+    """
+    Convert the row xhtml itself, leaving out its child rows.
+
+    Returns the converted contents and the heading level to use for the child rows.
+    """
+    contents = []
+    data_type = xhtml.attrib.get("data-type", "body")
+    p = xhtml.find(P_TAG)
+
+    # integrate rich_text_elements and replace p_text, p_elem
+
+    if data_type == "body":
+        # contents.append(Para(p_elem))
+        contents.extend(rich_text(p, flatten=False, wrap_para=True))
+    elif data_type == "heading":
+        rich_text_elements = rich_text(p)
+        if heading_level <= 6:
+            contents.append(Header(*rich_text_elements, level=heading_level))
         else:
-            return parts
-    elif xhtml.tag == f"{NS}a":
-        return [Link(*parts, url=xhtml.attrib["href"])]
-    elif xhtml.tag == f"{NS}span":
-        return [Span(*parts, attributes=xhtml.attrib)]
-    elif xhtml.tag == f"{NS}code":
-        # TO DO: think this part through more carefully -- am I flattening too much here?
-        return [Code(text_content(xhtml))]
-    elif xhtml.tag == f"{NS}strong":
-        return [Strong(*parts)]
-    elif xhtml.tag == f"{NS}em":
-        return [Emph(*parts)]
-    elif xhtml.tag == f"{NS}mark":
-        return [Span(*parts, attributes={"class": "mark"})]
-    elif xhtml.tag == f"{NS}s":
-        return [Strikeout(*parts)]
+            contents.append(Para(*rich_text_elements))
+
+        if heading_level < 6:
+            heading_level += 1
+
+    elif data_type == "hr":
+        contents.append(HorizontalRule())
+    elif data_type == "note":
+        # TODO: handle span
+        # contents.append( Para(Note(Plain(Str(p_text)))))
+        contents.append(Para(Note(Plain(*rich_text(p)))))
+    elif data_type == "quote":
+        # contents.append((BlockQuote(Para(*rich_text_elements))))
+        contents.append(((Para(*rich_text(p)))))
+    elif data_type == "task":
+        task_done = xhtml.attrib.get("data-done", False)
+        task_marker = BALLOT_BOX if not task_done else BALLOT_BOX_WITH_X
+        contents.append(ListItem(Plain(Str(task_marker), Space, *rich_text(p))))
+    elif data_type == "code":
+        contents.append(CodeBlock(text_content(p)))
+    elif data_type in ("ordered", "unordered"):
+        # contents.append(ListItem(Plain(p_elem)))
+        contents.append(ListItem(Plain(*rich_text(p))))
     else:
-        return [(Str(text_content(xhtml)))]
+        raise ValueError(f"unknown data-type {data_type}")
+
+    return contents, heading_level
 
 
 def bike_etree_list_to_panflute(xhtml_list, heading_level=1, meta=None):
@@ -271,107 +735,26 @@ def bike_etree_to_panflute(xhtml, heading_level=1, meta=None):
     elif xhtml.tag == f"{NS}body":
         id_ = xhtml.find(f"{NS}ul").attrib["id"]
         return [
-            Div(*bike_etree_to_panflute(xhtml.find(f"{NS}ul")), attributes={"id": id_})
+            Div(
+                *_merge_code_blocks(bike_etree_to_panflute(xhtml.find(f"{NS}ul"))),
+                attributes={"id": id_},
+            )
         ]
         # return bike_etree_to_panflute(xhtml.find(f'{NS}ul'))
     elif xhtml.tag == f"{NS}ul":
-        li_elements = xhtml.findall(f"{NS}li")
-
-        clusters = cluster_runs(
-            li_elements, lambda e: e.attrib.get("data-type", "body")
-        )
-        clusters = keep_clusters(
-            clusters,
-            lambda c: c[0].attrib.get("data-type")
-            in ["ordered", "unordered", "quote", "task"],
-        )
-
         contents = []
-        for cluster in clusters:
-            data_type = cluster[0].attrib.get("data-type", "body")
-            if data_type in ("unordered", "task"):
-                _content = []
-                for c in cluster:
-                    _content.extend(bike_etree_to_panflute(c, heading_level))
-                content = [BulletList(*wrap_in_list_item(_content))]
-            elif data_type == "ordered":
-                _content = []
-                for c in cluster:
-                    _content.extend(bike_etree_to_panflute(c, heading_level))
-                content = [OrderedList(*wrap_in_list_item(_content))]
-            elif data_type == "quote":
-                _content = []
-                for c in cluster:
-                    _content.extend(bike_etree_to_panflute(c, heading_level))
-                content = [BlockQuote(*_content)]
-            # elif data_type == "code":
-            #     _content = []
-            #     for c in cluster:
-            #         _content.extend(bike_etree_to_panflute(c, heading_level))
-            #     content = [CodeBlock("".join(_content))]
-            else:
-                content = bike_etree_to_panflute(cluster[0], heading_level)
-
-            contents.extend(content)
+        for cluster in _li_clusters(xhtml):
+            _content = []
+            for c in cluster:
+                _content.extend(bike_etree_to_panflute(c, heading_level))
+            contents.extend(_cluster_to_panflute(cluster, _content))
 
         return contents
     elif xhtml.tag == f"{NS}li":
-        contents = []
-        data_type = xhtml.attrib.get("data-type", "body")
-        id_ = xhtml.attrib.get("id")
-
-        # for now just grab text of p
-        # TODO: handle rich text
-        p_text = text_content(xhtml.find(f"{NS}p", namespaces=namespaces))
-        # p_elem = Span(Str(p_text), attributes=xhtml.attrib)
-        wrap_para = True if data_type == "body" else False
-
-        rich_text_elements = rich_text(
-            xhtml.find(f"{NS}p", namespaces=namespaces),
-            flatten=False,
-            wrap_para=wrap_para,
-        )
-
-        # integrate rich_text_elements and replace p_text, p_elem
-
-        if data_type == "body":
-            # contents.append(Para(p_elem))
-            contents.extend(rich_text_elements)
-        elif data_type == "heading":
-            if heading_level <= 6:
-                contents.append(Header(*rich_text_elements, level=heading_level))
-            else:
-                contents.append(Para(*rich_text_elements))
-
-            if heading_level < 6:
-                heading_level += 1
-
-        elif data_type == "hr":
-            contents.append(HorizontalRule())
-        elif data_type == "note":
-            # TODO: handle span
-            # contents.append( Para(Note(Plain(Str(p_text)))))
-            contents.append(Para(Note(Plain(*rich_text_elements))))
-        elif data_type == "quote":
-            # contents.append((BlockQuote(Para(*rich_text_elements))))
-            contents.append(((Para(*rich_text_elements))))
-        elif data_type == "task":
-            task_done = xhtml.attrib.get("data-done", False)
-            task_marker = BALLOT_BOX if not task_done else BALLOT_BOX_WITH_X
-            contents.append(
-                ListItem(Plain(Str(task_marker), Space, *rich_text_elements))
-            )
-        elif data_type == "code":
-            contents.append(CodeBlock(p_text))
-            # contents.append(p_text)
-        elif data_type in ("ordered", "unordered"):
-            # contents.append(ListItem(Plain(p_elem)))
-            contents.append(ListItem(Plain(*rich_text_elements)))
-        else:
-            raise ValueError(f"unknown data-type {data_type}")
+        contents, heading_level = _li_to_panflute(xhtml, heading_level)
 
         # now handle ul
-        if True and xhtml.find(f"{NS}ul") is not None:
+        if xhtml.find(f"{NS}ul") is not None:
             contents.extend(
                 bike_etree_to_panflute(xhtml.find(f"{NS}ul"), heading_level)
             )
@@ -383,6 +766,87 @@ def bike_etree_to_panflute(xhtml, heading_level=1, meta=None):
         raise ValueError(f"unknown tag {xhtml.tag}")
 
 
+def _child_heading_level(li, heading_level):
+    if li.attrib.get("data-type", "body") == "heading" and heading_level < 6:
+        return heading_level + 1
+    return heading_level
+
+
+def _bike_subtrees_to_panflute(roots):
+    """
+    Explicit-stack counterpart of bike_etree_to_panflute for ul and li elements.
+
+    roots: list of (ul or li element, heading_level)
+    Returns one list of panflute elements per root.
+    """
+    # first pass: collect every ul in document order along with its heading level
+    uls = []
+    stack = list(reversed(roots))
+    while stack:
+        xhtml, heading_level = stack.pop()
+        if xhtml.tag == UL:
+            uls.append((xhtml, heading_level))
+            lis = xhtml.findall(LI)
+        elif xhtml.tag == LI:
+            lis = [xhtml]
+        else:
+            raise ValueError(f"unknown tag {xhtml.tag}")
+        for li in reversed(lis):
+            ul = li.find(UL)
+            if ul is not None:
+                stack.append((ul, _child_heading_level(li, heading_level)))
+
+    # second pass: convert in reverse document order so every ul's child lists are ready
+    converted = {}
+
+    def convert_li(li, heading_level):
+        contents, heading_level = _li_to_panflute(li, heading_level)
+        ul = li.find(UL)
+        if ul is not None:
+            contents.extend(converted.pop(ul))
+        return contents
+
+    for ul, heading_level in reversed(uls):
+        contents = []
+        for cluster in _li_clusters(ul):
+            _content = []
+            for c in cluster:
+                _content.extend(convert_li(c, heading_level))
+            contents.extend(_cluster_to_panflute(cluster, _content))
+        converted[ul] = contents
+
+    return [
+        converted.pop(xhtml) if xhtml.tag == UL else convert_li(xhtml, heading_level)
+        for xhtml, heading_level in roots
+    ]
+
+
+def bike_etree_list_to_panflute_iterative(xhtml_list, heading_level=1, meta=None):
+    content = []
+    for contents in _bike_subtrees_to_panflute([(x, heading_level) for x in xhtml_list]):
+        content.extend(contents)
+    return content
+
+
+def bike_etree_to_panflute_iterative(xhtml, heading_level=1, meta=None):
+    """
+    Same output as bike_etree_to_panflute, without recursing once per nesting level.
+    """
+    if xhtml.tag == f"{NS}html":
+        body = xhtml.find(f"{NS}body")
+        if meta is None:
+            meta = {}
+        content = bike_etree_to_panflute_iterative(body, heading_level, meta=meta)
+        return Doc(*content, metadata=meta, format="html")
+    elif xhtml.tag == f"{NS}body":
+        ul = xhtml.find(f"{NS}ul")
+        (content,) = _bike_subtrees_to_panflute([(ul, 1)])
+        return [Div(*_merge_code_blocks(content), attributes={"id": ul.attrib["id"]})]
+    else:
+        (content,) = _bike_subtrees_to_panflute([(xhtml, heading_level)])
+        return content
+
+
 def get_bike_doc(path=OVERALL_PATH):
 
     for d in Bike().documents:
@@ -395,35 +859,623 @@ def ids(etree:ET.Element) -> List[str]:
     """
     Return a list of ids of the rows
     """
-    return [e.attrib["id"] for e in etree.xpath("//*[@id]")]
+    return XPATHS["ids"](etree)
+
 
+def _local_name(tag) -> str:
+    # works for namespaced etrees and for lxml.html trees alike
+    return tag.rpartition("}")[2] if isinstance(tag, str) else ""
 
-def panflute_to_bike_etree(pfdoc) -> Element:
+
+class OutlineIndex(object):
     """
-    At this point: generate an empty etree
+    Index of the rows of a parsed Bike document, built in one pass.
+
+    Lookups by id, parent/children, levels, subtrees and the rows of a data-type
+    (or tasks by done state) then cost O(1)/O(k) instead of an XPath scan per query.
+    The index is a snapshot: rebuild it after changing the tree.
     """
 
-    etree = ET.Element("html", nsmap=namespaces)
+    def __init__(self, etree: Union[Element, HtmlElement]):
+        # rows in document order, and per row: its level (1 = top), parent position (-1 for top
+        # level rows), child positions and the position just past its last descendant
+        self.rows = []
+        self.levels = []
+        self.parents = []
+        self.children_of = []
+        self.ends = []
+        self.positions = {}
+        # data-type ("body" if absent) -> positions; positions of open and of done tasks
+        self.by_type = {}
+        self.open_tasks = []
+        self.done_tasks = []
+        self.roots = []
+
+        root = etree.getroot() if hasattr(etree, "getroot") else etree
+        top_ul = next((e for e in root.iter() if _local_name(e.tag) == "ul"), None)
+        if top_ul is None:
+            return
+
+        # (remaining rows of a list, position of the row owning the list, level of its rows)
+        stack = [(iter(top_ul), -1, 1)]
+        while stack:
+            lis, parent, level = stack[-1]
+            li = next(lis, None)
+            if li is None:
+                stack.pop()
+                if parent != -1:
+                    self.ends[parent] = len(self.rows)
+                continue
+            if _local_name(li.tag) != "li":
+                continue
+
+            position = len(self.rows)
+            self.rows.append(li)
+            self.levels.append(level)
+            self.parents.append(parent)
+            self.children_of.append([])
+            self.ends.append(position + 1)
+            (self.roots if parent == -1 else self.children_of[parent]).append(position)
+            id_ = li.get("id")
+            if id_ is not None:
+                self.positions[id_] = position
+            data_type = li.get("data-type", "body")
+            self.by_type.setdefault(data_type, []).append(position)
+            if data_type == "task":
+                done = li.get("data-done") is not None
+                (self.done_tasks if done else self.open_tasks).append(position)
+
+            for child in li:
+                if _local_name(child.tag) == "ul":
+                    stack.append((iter(child), position, level + 1))
+                    break
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, id_):
+        return id_ in self.positions
+
+    @property
+    def ids(self) -> List[str]:
+        """
+        Ids of the rows, in document order (unlike ids(), without the ids of the lists).
+        """
+        return [li.get("id") for li in self.rows if li.get("id") is not None]
+
+    def row(self, id_: str) -> Element:
+        """
+        The li of the row with id_ (KeyError if there is none).
+        """
+        return self.rows[self.positions[id_]]
+
+    def level(self, id_: str) -> int:
+        return self.levels[self.positions[id_]]
+
+    def parent(self, id_: str) -> Optional[Element]:
+        parent = self.parents[self.positions[id_]]
+        return self.rows[parent] if parent != -1 else None
+
+    def children(self, id_: Optional[str] = None) -> List[Element]:
+        """
+        The child rows of id_, or the top level rows if id_ is None.
+        """
+        positions = self.roots if id_ is None else self.children_of[self.positions[id_]]
+        return [self.rows[i] for i in positions]
+
+    def subtree(self, id_: str) -> List[Element]:
+        """
+        The row with id_ followed by all of its descendants, in document order.
+        """
+        position = self.positions[id_]
+        return self.rows[position : self.ends[position]]
+
+    def rows_of_type(self, data_type: str) -> List[Element]:
+        """
+        Rows with the given data-type; "body" for rows without one.
+        """
+        return [self.rows[i] for i in self.by_type.get(data_type, [])]
+
+    def task_rows(self, done: Optional[bool] = None) -> List[Element]:
+        """
+        Task rows, optionally only the done (True) or not done (False) ones.
+        """
+        if done is None:
+            tasks = self.by_type.get("task", [])
+        else:
+            tasks = self.done_tasks if done else self.open_tasks
+        return [self.rows[i] for i in tasks]
 
-    # add a head
-    head = ET.SubElement(etree, "head")
-    meta = ET.SubElement(head, "meta", attrib={"charset": "utf-8"})
 
-    # add a body
-    body = ET.SubElement(etree, "body")
+class RowChange(NamedTuple):
+    """
+    One difference between two versions of an outline, as reported by diff_outlines.
+
+    kind      old / new
+    insert    - / parent id (None for top level rows)
+    delete    parent id / -
+    reparent  old parent id / new parent id
+    move      old / new index among the siblings (same parent, order changed)
+    text      old / new text of the row (any change to its rich text)
+    type      old / new data-type
+    done      old / new data-done (None when not done)
+    """
 
-    # add a root ul to body
-    root_ul = ET.SubElement(
-        body, "ul", attrib={"id": generate_unique_id_attribute(8, ids(etree))}
-    )
+    kind: str
+    id: str
+    old: Optional[Union[str, int]] = None
+    new: Optional[Union[str, int]] = None
+
+
+def _longest_increasing(seq: List[int]) -> set:
+    """positions of a longest strictly increasing subsequence of seq, in O(n log n)"""
+    # tails[k]: smallest value ending an increasing run of length k + 1, ends[k]: its position
+    tails, ends = [], []
+    previous = [-1] * len(seq)
+    for i, value in enumerate(seq):
+        k = bisect.bisect_left(tails, value)
+        if k:
+            previous[i] = ends[k - 1]
+        if k == len(tails):
+            tails.append(value)
+            ends.append(i)
+        else:
+            tails[k] = value
+            ends[k] = i
+    keep = set()
+    i = ends[-1] if ends else -1
+    while i != -1:
+        keep.add(i)
+        i = previous[i]
+    return keep
+
+
+def _row_p(li) -> Optional[Element]:
+    return next((e for e in li if _local_name(e.tag) == "p"), None)
+
+
+def diff_outlines(
+    old: Union[Element, HtmlElement, OutlineIndex], new: Union[Element, HtmlElement, OutlineIndex]
+) -> List[RowChange]:
+    """
+    Compare two versions of a Bike outline, matching rows by id.
+
+    Each version is indexed once (pass an OutlineIndex to reuse one), so the comparison
+    needs no pairwise matching: linear apart from the O(k log k) move detection over
+    the k siblings that kept their parent. Rows without an id are ignored.
+
+    :return: the changes (see RowChange) in the document order of new, followed by the
+        deletions in the document order of old
+    """
+    if not isinstance(old, OutlineIndex):
+        old = OutlineIndex(old)
+    if not isinstance(new, OutlineIndex):
+        new = OutlineIndex(new)
+
+    def parent_id(index, position):
+        parent = index.parents[position]
+        return index.rows[parent].get("id") if parent != -1 else None
+
+    def sibling_positions(index):
+        # id -> index among its siblings
+        positions = {}
+        for siblings in [index.roots] + index.children_of:
+            for i, position in enumerate(siblings):
+                id_ = index.rows[position].get("id")
+                if id_ is not None:
+                    positions[id_] = i
+        return positions
+
+    old_siblings = sibling_positions(old)
+    # the changes of each row of new, in document order
+    row_changes = []
+    # parent id -> (rows that stayed under it in new order, their old sibling indices)
+    kept = {}
+    for position, li in enumerate(new.rows):
+        id_ = li.get("id")
+        if id_ is None:
+            continue
+        changes = []
+        row_changes.append(changes)
+        new_parent = parent_id(new, position)
+        old_position = old.positions.get(id_)
+        if old_position is None:
+            changes.append(RowChange("insert", id_, None, new_parent))
+            continue
+
+        old_li = old.rows[old_position]
+        old_parent = parent_id(old, old_position)
+        if old_parent != new_parent:
+            changes.append(RowChange("reparent", id_, old_parent, new_parent))
+        else:
+            rows, indices = kept.setdefault(new_parent, ([], []))
+            rows.append((id_, changes))
+            indices.append(old_siblings[id_])
+
+        old_p, new_p = _row_p(old_li), _row_p(li)
+        if old_p is None or new_p is None:
+            text_changed = old_p is not new_p
+        elif len(old_p) == 0 and len(new_p) == 0 and not old_p.attrib and not new_p.attrib:
+            # plain text rows (the common case) need no serialization
+            text_changed = old_p.text != new_p.text
+        else:
+            text_changed = ET.tostring(old_p, with_tail=False) != ET.tostring(new_p, with_tail=False)
+        if text_changed:
+            changes.append(
+                RowChange(
+                    "text",
+                    id_,
+                    text_content(old_p, include_tail=False) if old_p is not None else None,
+                    text_content(new_p, include_tail=False) if new_p is not None else None,
+                )
+            )
+        old_type, new_type = old_li.get("data-type", "body"), li.get("data-type", "body")
+        if old_type != new_type:
+            changes.append(RowChange("type", id_, old_type, new_type))
+        old_done, new_done = old_li.get("data-done"), li.get("data-done")
+        if old_done != new_done:
+            changes.append(RowChange("done", id_, old_done, new_done))
+
+    # rows that kept their parent moved if they fall outside the longest run whose old order
+    # is preserved -- the fewest moves that explain the new order
+    new_siblings = sibling_positions(new)
+    for rows, indices in kept.values():
+        in_order = _longest_increasing(indices)
+        for i, (id_, changes) in enumerate(rows):
+            if i not in in_order:
+                changes.insert(0, RowChange("move", id_, old_siblings[id_], new_siblings[id_]))
+
+    result = [change for changes in row_changes for change in changes]
+    for position, li in enumerate(old.rows):
+        id_ = li.get("id")
+        if id_ is not None and id_ not in new.positions:
+            result.append(RowChange("delete", id_, parent_id(old, position), None))
+    return result
+
+
+def diff_bike_files(old_path: Union[str, P], new_path: Union[str, P]) -> List[RowChange]:
+    """
+    diff_outlines for two .bike files
+    """
+    return diff_outlines(load_bike(old_path), load_bike(new_path))
+
+
+# panflute -> Bike: flatten the panflute document into rows, then write them out as Bike XHTML
+
+# panflute inline containers and the Bike tag (and class, for spans) they become
+_PANFLUTE_INLINE_TAGS = {
+    pf.Emph: ("em", None),
+    pf.Strong: ("strong", None),
+    pf.Strikeout: ("s", None),
+    pf.Underline: ("span", "underline"),
+    pf.Superscript: ("span", "superscript"),
+    pf.Subscript: ("span", "subscript"),
+    pf.SmallCaps: ("span", "smallcaps"),
+}
+_QUOTES = {"SingleQuote": ("\u2018", "\u2019"), "DoubleQuote": ("\u201c", "\u201d")}
+
+
+def _append_text(parent, text):
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or "") + text
+    else:
+        parent.text = (parent.text or "") + text
+
+
+def panflute_inlines_to_p(inlines, notes: Optional[list] = None) -> Element:
+    """
+    Build the rich-text <p> of a Bike row from panflute inlines.
+
+    notes: if given, inline Notes are appended to it (Bike has no inline notes)
+    """
+    p = ET.Element(P_TAG)
+    stack = [(p, iter(inlines))]
+    while stack:
+        parent, inlines_ = stack[-1]
+        inline = next(inlines_, None)
+        if inline is None:
+            stack.pop()
+            continue
+
+        if isinstance(inline, Str):
+            _append_text(parent, inline.text)
+        elif isinstance(inline, (pf.Space, pf.SoftBreak, pf.LineBreak)) or inline in (
+            pf.Space,
+            pf.SoftBreak,
+            pf.LineBreak,
+        ):
+            _append_text(parent, " ")
+        elif isinstance(inline, Code):
+            ET.SubElement(parent, f"{NS}code").text = inline.text
+        elif isinstance(inline, (pf.Math, pf.RawInline)):
+            _append_text(parent, inline.text)
+        elif isinstance(inline, Note):
+            if notes is not None:
+                notes.append(inline)
+        elif isinstance(inline, (Link, pf.Image)):
+            a = ET.SubElement(parent, f"{NS}a", href=inline.url)
+            stack.append((a, iter(inline.content)))
+        elif isinstance(inline, Span):
+            if "mark" in inline.classes or inline.attributes.get("class") == "mark":
+                e = ET.SubElement(parent, f"{NS}mark")
+            else:
+                e = ET.SubElement(parent, f"{NS}span")
+                if inline.identifier:
+                    e.set("id", inline.identifier)
+                if inline.classes:
+                    e.set("class", " ".join(inline.classes))
+                for k, v in inline.attributes.items():
+                    e.set(k, v)
+            stack.append((e, iter(inline.content)))
+        elif isinstance(inline, pf.Quoted):
+            open_quote, close_quote = _QUOTES.get(inline.quote_type, ('"', '"'))
+            _append_text(parent, open_quote)
+            stack.append((parent, itertools.chain(inline.content, [Str(close_quote)])))
+        elif isinstance(inline, pf.Cite):
+            stack.append((parent, iter(inline.content)))
+        elif type(inline) in _PANFLUTE_INLINE_TAGS:
+            tag, class_ = _PANFLUTE_INLINE_TAGS[type(inline)]
+            e = ET.SubElement(parent, f"{NS}{tag}")
+            if class_ is not None:
+                e.set("class", class_)
+            stack.append((e, iter(inline.content)))
+        else:
+            _append_text(parent, pf.stringify(inline))
+    return p
+
+
+def _block_inlines(block) -> list:
+    if isinstance(block, (Plain, Para)):
+        return list(block.content)
+    return [Str(pf.stringify(block).strip())]
 
-    return etree
-    # print(ET.tostring(etree, pretty_print=True, encoding="utf-8", xml_declaration=True).decode('utf-8'))
+
+def iter_panflute_rows(pfdoc, done_timestamp: Optional[str] = None) -> Iterator[StreamedRow]:
+    """
+    Flatten a panflute Doc (or list of blocks) into Bike rows, in document order.
+
+    Headers nest the blocks that follow them; list items become ordered/unordered/task rows
+    (pandoc task list markers become tasks) with their remaining blocks as child rows;
+    block quote paragraphs become quote rows; every line of a code block becomes a code row;
+    a paragraph holding just a footnote becomes a note row, other footnotes become note rows
+    under the row they appear in. Other blocks become body rows of their text.
+
+    done_timestamp: data-done value for completed tasks (default: now)
+    Rows have no id; write_bike_rows allocates them.
+    """
+    if done_timestamp is None:
+        done_timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def rows(level, data_type, inlines, data_done=None):
+        notes = []
+        yield StreamedRow(None, level, data_type, data_done, panflute_inlines_to_p(inlines, notes))
+        # notes found along the way become child rows (notes within notes included)
+        pending = [(level + 1, note) for note in notes]
+        while pending:
+            note_level, note = pending.pop(0)
+            blocks = list(note.content)
+            inner_notes = []
+            p = panflute_inlines_to_p(_block_inlines(blocks[0]) if blocks else [], inner_notes)
+            yield StreamedRow(None, note_level, "note", None, p)
+            for block in blocks[1:]:
+                p = panflute_inlines_to_p(_block_inlines(block), inner_notes)
+                yield StreamedRow(None, note_level + 1, "body", None, p)
+            pending.extend((note_level + 1, n) for n in inner_notes)
+
+    blocks = pfdoc.content if isinstance(pfdoc, Doc) else pfdoc
+    # frames: ["blocks", blocks, base level, open heading levels]
+    #         ["items", list items, level, data-type]
+    #         ["quote", blocks, level, whether a quote row was written]
+    stack = [["blocks", iter(blocks), 1, []]]
+    while stack:
+        frame = stack[-1]
+        block = next(frame[1], None)
+        if block is None:
+            stack.pop()
+            continue
+
+        kind = frame[0]
+        if kind == "items":
+            level, data_type = frame[2], frame[3]
+            item_blocks = list(block.content)
+            if item_blocks and isinstance(item_blocks[0], (Plain, Para)):
+                inlines, item_blocks = list(item_blocks[0].content), item_blocks[1:]
+            else:
+                inlines = []
+            data_done = None
+            if inlines and isinstance(inlines[0], Str) and inlines[0].text in (
+                BALLOT_BOX,
+                BALLOT_BOX_WITH_X,
+            ):
+                data_type = "task"
+                if inlines[0].text == BALLOT_BOX_WITH_X:
+                    data_done = done_timestamp
+                inlines = inlines[1:]
+                if inlines and (isinstance(inlines[0], pf.Space) or inlines[0] is pf.Space):
+                    inlines = inlines[1:]
+            yield from rows(level, data_type, inlines, data_done)
+            if item_blocks:
+                stack.append(["blocks", iter(item_blocks), level + 1, []])
+            continue
+        elif kind == "quote":
+            level = frame[2]
+            if isinstance(block, (Plain, Para)):
+                yield from rows(level, "quote", block.content)
+                frame[3] = True
+            else:
+                stack.append(["blocks", iter([block]), level + 1 if frame[3] else level, []])
+            continue
+
+        base_level, headings = frame[2], frame[3]
+        if isinstance(block, Header):
+            while headings and headings[-1] >= block.level:
+                headings.pop()
+            yield from rows(base_level + len(headings), "heading", block.content)
+            headings.append(block.level)
+            continue
+
+        level = base_level + len(headings)
+        if isinstance(block, (Plain, Para)):
+            if len(block.content) == 1 and isinstance(block.content[0], Note):
+                note_blocks = list(block.content[0].content)
+                yield from rows(level, "note", _block_inlines(note_blocks[0]) if note_blocks else [])
+                if note_blocks[1:]:
+                    stack.append(["blocks", iter(note_blocks[1:]), level + 1, []])
+            else:
+                yield from rows(level, "body", block.content)
+        elif isinstance(block, BulletList):
+            stack.append(["items", iter(block.content), level, "unordered"])
+        elif isinstance(block, OrderedList):
+            stack.append(["items", iter(block.content), level, "ordered"])
+        elif isinstance(block, BlockQuote):
+            stack.append(["quote", iter(block.content), level, False])
+        elif isinstance(block, CodeBlock):
+            for line in block.text.split("\n"):
+                yield from rows(level, "code", [Str(line)] if line else [])
+        elif isinstance(block, HorizontalRule) or block is HorizontalRule:
+            yield from rows(level, "hr", [])
+        elif isinstance(block, Div):
+            stack.append(["blocks", iter(block.content), level, []])
+        elif isinstance(block, pf.LineBlock):
+            for line in block.content:
+                yield from rows(level, "body", line.content)
+        elif isinstance(block, pf.Null):
+            pass
+        else:
+            yield from rows(level, "body", _block_inlines(block))
+
+
+def _write_element(xf, element):
+    """write element and its content through xf (avoids xmlns declarations on standalone writes)"""
+    stack = []
+    cm = xf.element(element.tag, dict(element.attrib))
+    cm.__enter__()
+    if element.text:
+        xf.write(element.text)
+    stack.append((cm, iter(element), None))
+    while stack:
+        cm, children, tail = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            cm.__exit__(None, None, None)
+            if tail:
+                xf.write(tail)
+        elif isinstance(child.tag, str):
+            child_cm = xf.element(child.tag, dict(child.attrib))
+            child_cm.__enter__()
+            if child.text:
+                xf.write(child.text)
+            stack.append((child_cm, iter(child), child.tail))
+        elif child.tail:
+            # comments and processing instructions: keep the text that follows them
+            xf.write(child.tail)
+
+
+def write_bike_rows(
+    rows: Iterable[StreamedRow],
+    out: Union[str, P, IO[bytes]],
+    id_allocator: Optional[IdAllocator] = None,
+) -> None:
+    """
+    Write rows (e.g. from iter_panflute_rows or iter_rows) as a Bike XHTML document,
+    incrementally, so the document is never held in memory.
+
+    Row levels start at 1; a row deeper than one below its predecessor is attached as its child.
+    Rows keep their id when it is unused, otherwise they get one from id_allocator.
+    """
+    if id_allocator is None:
+        id_allocator = IdAllocator()
+    if isinstance(out, P):
+        out = str(out)
+
+    with ET.xmlfile(out, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(f"{NS}html", nsmap={None: namespaces["ns"]}):
+            with xf.element(f"{NS}head"):
+                with xf.element(f"{NS}meta", charset="utf-8"):
+                    pass
+            with xf.element(f"{NS}body"):
+                with xf.element(f"{NS}ul", id=id_allocator.allocate()):
+                    # open rows, outermost first: [li context, ul context for its children]
+                    open_rows = []
+                    for row in rows:
+                        level = min(max(row.level, 1), len(open_rows) + 1)
+                        while len(open_rows) >= level:
+                            li_cm, ul_cm = open_rows.pop()
+                            if ul_cm is not None:
+                                ul_cm.__exit__(None, None, None)
+                            li_cm.__exit__(None, None, None)
+                        if open_rows and open_rows[-1][1] is None:
+                            open_rows[-1][1] = xf.element(f"{NS}ul")
+                            open_rows[-1][1].__enter__()
+
+                        if row.id is not None and row.id not in id_allocator:
+                            attrib = {"id": id_allocator.add(row.id)}
+                        else:
+                            attrib = {"id": id_allocator.allocate()}
+                        if row.data_done is not None:
+                            attrib["data-done"] = row.data_done
+                        if row.data_type not in (None, "body"):
+                            attrib["data-type"] = row.data_type
+
+                        li_cm = xf.element(f"{NS}li", attrib)
+                        li_cm.__enter__()
+                        _write_element(xf, row.p)
+                        open_rows.append([li_cm, None])
+
+                    while open_rows:
+                        li_cm, ul_cm = open_rows.pop()
+                        if ul_cm is not None:
+                            ul_cm.__exit__(None, None, None)
+                        li_cm.__exit__(None, None, None)
+
+
+def write_panflute_as_bike(
+    pfdoc,
+    out: Union[str, P, IO[bytes]],
+    id_allocator: Optional[IdAllocator] = None,
+    done_timestamp: Optional[str] = None,
+) -> None:
+    """
+    Write a panflute Doc to out (path or binary stream) as a Bike outline.
+    """
+    write_bike_rows(iter_panflute_rows(pfdoc, done_timestamp), out, id_allocator)
+
+
+def panflute_to_bike_etree(
+    pfdoc, id_allocator: Optional[IdAllocator] = None, done_timestamp: Optional[str] = None
+) -> Element:
+    """
+    Convert a panflute Doc to a Bike etree (see iter_panflute_rows for the mapping).
+
+    id_allocator: allocator for the row ids (a fresh one by default)
+    """
+    out = io.BytesIO()
+    write_panflute_as_bike(pfdoc, out, id_allocator, done_timestamp)
+    return ET.fromstring(out.getvalue(), ET.XMLParser(remove_blank_text=True, huge_tree=True))
+
+
+def text_to_bike(
+    source,
+    out: Union[str, P, IO[bytes]],
+    from_="markdown",
+    id_allocator: Optional[IdAllocator] = None,
+    **convert_kwargs,
+) -> None:
+    """
+    Convert source (e.g. markdown) to a Bike outline written to out.
+    """
+    pfdoc = pf.load(io.StringIO(convert_text(source, to_="json", from_=from_, **convert_kwargs)))
+    write_panflute_as_bike(pfdoc, out, id_allocator)
 
 
 # https://www.perplexity.ai/search/Write-me-a-MFQekCRfQSyjfylvmBlUng?s=c
 def merge_consecutive_codeblocks(elem, doc):
-    """Merge consecutive code blocks"""
+    """
+    Merge consecutive code blocks (a panflute filter, for documents from elsewhere;
+    etree_to_panflute merges them while converting)
+    """
     if (
         isinstance(elem, pf.CodeBlock)
         and doc.prev_elem
@@ -434,19 +1486,662 @@ def merge_consecutive_codeblocks(elem, doc):
     doc.prev_elem = elem
 
 
-def etree_to_panflute(etree, only_doc_children=ONLY_DOC_CHILDREN):
+def etree_to_panflute(etree, only_doc_children=ONLY_DOC_CHILDREN, engine=ENGINE, max_workers=1):
+    """
+    engine: "iterative" (explicit stack, no recursion limit on outline depth) or "recursive"
+    max_workers: with more than 1, convert the top-level rows in a process pool instead
+        (see write_pandoc_json), loading the document from the stitched JSON
+    """
+    if engine == "iterative":
+        list_to_panflute, to_panflute = (
+            bike_etree_list_to_panflute_iterative,
+            bike_etree_to_panflute_iterative,
+        )
+    elif engine == "recursive":
+        list_to_panflute, to_panflute = bike_etree_list_to_panflute, bike_etree_to_panflute
+    else:
+        raise ValueError(f"unknown engine {engine}")
+
+    if max_workers > 1:
+        source = etree_to_pandoc_json(etree, only_doc_children, max_workers=max_workers)
+        return json.loads(source, object_hook=pf.elements.from_json)
+
     if only_doc_children:
-        etree2 = etree.findall("ns:body/ns:ul/*", namespaces=namespaces)
-        pfd = bike_etree_list_to_panflute(etree2)
+        etree2 = XPATHS["top_level_rows"](etree)
+        pfd = list_to_panflute(etree2)
         # TO DO: fancier wrapping of items -- for example, there might be ListItems that are not wrapped in a List type of some sort
-        pfd = pf.Doc(*pfd)
+        pfd = pf.Doc(*_merge_code_blocks(pfd))
     else:
-        pfd = bike_etree_to_panflute(etree)
+        pfd = to_panflute(etree)
 
-    pf.run_filter(merge_consecutive_codeblocks, doc=pfd)
     return pfd
 
 
+# Pandoc JSON AST written directly from the Bike XHTML, without building panflute objects
+
+PANDOC_API_VERSION = pf.Doc().api_version
+
+_json_str = json.JSONEncoder(ensure_ascii=False).encode
+_NULL_ATTR = '["",[],[]]'
+# opener, closer and whether the children are list items, per list-like data-type
+_CLUSTER_JSON = {
+    "unordered": ('{"t":"BulletList","c":[', "]}", True),
+    "task": ('{"t":"BulletList","c":[', "]}", True),
+    "ordered": ('{"t":"OrderedList","c":[[1,{"t":"Decimal"},{"t":"Period"}],[', "]]}", True),
+    "quote": ('{"t":"BlockQuote","c":[', "]}", False),
+}
+
+
+def _attr_json(attributes) -> str:
+    return '["",[],[' + ",".join(
+        f"[{_json_str(k)},{_json_str(v)}]" for k, v in attributes.items()
+    ) + "]]"
+
+
+def _str_json(text) -> str:
+    return '{"t":"Str","c":' + _json_str(text) + "}"
+
+
+# JSON counterparts of INLINE_HANDLERS
+INLINE_JSON_HANDLERS = {
+    P_TAG: lambda xhtml, parts: parts,
+    A_TAG: lambda xhtml, parts: [
+        '{"t":"Link","c":[' + _NULL_ATTR + ",[" + ",".join(parts) + "],["
+        + _json_str(xhtml.attrib["href"]) + ',""]]}'
+    ],
+    SPAN_TAG: lambda xhtml, parts: [
+        '{"t":"Span","c":[' + _attr_json(xhtml.attrib) + ",[" + ",".join(parts) + "]]}"
+    ],
+    CODE_TAG: lambda xhtml, parts: [
+        '{"t":"Code","c":[' + _NULL_ATTR + "," + _json_str(text_content(xhtml)) + "]}"
+    ],
+    STRONG_TAG: lambda xhtml, parts: ['{"t":"Strong","c":[' + ",".join(parts) + "]}"],
+    EM_TAG: lambda xhtml, parts: ['{"t":"Emph","c":[' + ",".join(parts) + "]}"],
+    MARK_TAG: lambda xhtml, parts: [
+        '{"t":"Span","c":[["",[],[["class","mark"]]],[' + ",".join(parts) + "]]}"
+    ],
+    S_TAG: lambda xhtml, parts: ['{"t":"Strikeout","c":[' + ",".join(parts) + "]}"],
+}
+_compact_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def _wrap_inline_json(xhtml, parts) -> List[str]:
+    """JSON counterpart of _wrap_inline (without wrap_para)"""
+    handler = INLINE_JSON_HANDLERS.get(xhtml.tag)
+    if handler is not None:
+        return handler(xhtml, parts)
+    if xhtml.tag in INLINE_HANDLERS:
+        # registered without a JSON handler: go through panflute (rich_text walks the children)
+        return [_compact_json(e.to_json()) for e in rich_text(xhtml)]
+    return [_str_json(text_content(xhtml))]
+
+
+def rich_text_json(xhtml) -> str:
+    """
+    The inlines of rich_text(xhtml) as comma-separated Pandoc JSON.
+    """
+    handlers, containers = INLINE_JSON_HANDLERS, INLINE_CONTAINER_TAGS
+    handler = handlers.get(xhtml.tag)
+    # tags registered without a JSON handler are converted whole by _wrap_inline_json
+    if handler is None or xhtml.tag not in containers:
+        return ",".join(_wrap_inline_json(xhtml, []))
+
+    stack = [(xhtml, handler, [_str_json(xhtml.text)] if xhtml.text else [], iter(xhtml))]
+    while True:
+        e, handler, parts, children = stack[-1]
+        for child in children:
+            child_handler = handlers.get(child.tag)
+            if child_handler is None:
+                parts.extend(_wrap_inline_json(child, []))
+            elif child.tag in containers:
+                text = child.text
+                stack.append((child, child_handler, [_str_json(text)] if text else [], iter(child)))
+                break
+            else:
+                parts.extend(child_handler(child, []))
+        else:
+            stack.pop()
+            if e.tail is not None:
+                parts.append(_str_json(e.tail))
+            if not stack:
+                return ",".join(handler(e, parts))
+            stack[-1][2].extend(handler(e, parts))
+
+
+class _PandocJSONWriter(object):
+    """
+    Buffered writer of Pandoc JSON block lists.
+
+    Keeps a stack of open block lists; consecutive code blocks in the same block list
+    are merged, as merge_consecutive_codeblocks does for panflute documents.
+    """
+
+    def __init__(self, out, buffer_size=1 << 16):
+        self.out = out
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        # each open block list: [children are list items, is empty, pending code lines, closer]
+        self.lists = []
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.size += len(s)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.buffer).encode("utf-8"))
+        self.buffer = []
+        self.size = 0
+
+    def _flush_code(self, lst):
+        code, lst[2] = lst[2], None
+        if code is not None:
+            self._write_block(
+                lst, '{"t":"CodeBlock","c":[' + _NULL_ATTR + "," + _json_str("\n".join(code)) + "]}"
+            )
+
+    def _write_block(self, lst, block, closer=""):
+        """write block as the next element of lst, opening a list item for it if needed"""
+        if not lst[1]:
+            self.write(",")
+        lst[1] = False
+        if lst[0]:
+            self.write("[")
+            closer += "]"
+        self.write(block)
+        return closer
+
+    def block(self, block):
+        lst = self.lists[-1]
+        self._flush_code(lst)
+        self.write(self._write_block(lst, block))
+
+    def code_block(self, text):
+        lst = self.lists[-1]
+        if lst[0]:
+            self.block('{"t":"CodeBlock","c":[' + _NULL_ATTR + "," + _json_str(text) + "]}")
+        elif lst[2] is None:
+            lst[2] = [text]
+        else:
+            lst[2].append(text)
+
+    def list_item(self, blocks):
+        lst = self.lists[-1]
+        if not lst[0]:
+            raise TypeError("ListItem outside of a list")
+        if not lst[1]:
+            self.write(",")
+        lst[1] = False
+        self.write("[" + blocks + "]")
+
+    def splice(self, fragment):
+        """write a _Fragment recorded by _FragmentRecorder into the current block list"""
+        lst = self.lists[-1]
+        for text in fragment.lead:
+            self.code_block(text)
+        if fragment.body:
+            self._flush_code(lst)
+            if not lst[1]:
+                self.write(",")
+            lst[1] = False
+            self.write(fragment.body)
+            if fragment.trail:
+                lst[2] = list(fragment.trail)
+
+    def open(self, opener, closer, items=False):
+        """open a block containing a block list (items=False) or a list of list items"""
+        parent = self.lists[-1] if self.lists else None
+        if parent is not None:
+            self._flush_code(parent)
+            closer = self._write_block(parent, opener, closer)
+        else:
+            self.write(opener)
+        self.lists.append([items, True, None, closer])
+
+    def close(self):
+        lst = self.lists[-1]
+        self._flush_code(lst)
+        self.lists.pop()
+        self.write(lst[3])
+
+
+def _li_to_pandoc_json(writer, xhtml, heading_level=1):
+    """JSON counterpart of _li_to_panflute"""
+    data_type = xhtml.attrib.get("data-type", "body")
+    p = xhtml.find(P_TAG)
+
+    if data_type == "body":
+        writer.block('{"t":"Para","c":[' + rich_text_json(p) + "]}")
+    elif data_type == "heading":
+        if heading_level <= 6:
+            writer.block(
+                f'{{"t":"Header","c":[{heading_level},{_NULL_ATTR},[' + rich_text_json(p) + "]]}"
+            )
+        else:
+            writer.block('{"t":"Para","c":[' + rich_text_json(p) + "]}")
+    elif data_type == "hr":
+        writer.block('{"t":"HorizontalRule"}')
+    elif data_type == "note":
+        writer.block('{"t":"Para","c":[{"t":"Note","c":[{"t":"Plain","c":[' + rich_text_json(p) + "]}]}]}")
+    elif data_type == "quote":
+        writer.block('{"t":"Para","c":[' + rich_text_json(p) + "]}")
+    elif data_type == "task":
+        task_done = xhtml.attrib.get("data-done", False)
+        task_marker = BALLOT_BOX if not task_done else BALLOT_BOX_WITH_X
+        inlines = rich_text_json(p)
+        writer.list_item(
+            '{"t":"Plain","c":[' + _str_json(task_marker) + ',{"t":"Space"}'
+            + ("," + inlines if inlines else "") + "]}"
+        )
+    elif data_type == "code":
+        writer.code_block(text_content(p))
+    elif data_type in ("ordered", "unordered"):
+        writer.list_item('{"t":"Plain","c":[' + rich_text_json(p) + "]}")
+    else:
+        raise ValueError(f"unknown data-type {data_type}")
+
+
+def _write_subtrees_json(writer, roots):
+    """
+    Write the blocks for roots -- a list of (ul or li element, heading_level) -- in document order.
+    """
+    tasks = [("convert", xhtml, heading_level) for xhtml, heading_level in reversed(roots)]
+    while tasks:
+        task = tasks.pop()
+        if task[0] == "open":
+            writer.open(*_CLUSTER_JSON[task[1]])
+            continue
+        elif task[0] == "close":
+            writer.close()
+            continue
+
+        _, xhtml, heading_level = task
+        if xhtml.tag == UL:
+            expanded = []
+            for cluster in _li_clusters(xhtml):
+                data_type = cluster[0].attrib.get("data-type", "body")
+                is_list = data_type in _CLUSTER_JSON
+                if is_list:
+                    expanded.append(("open", data_type))
+                expanded.extend(("convert", li, heading_level) for li in cluster)
+                if is_list:
+                    expanded.append(("close",))
+            tasks.extend(reversed(expanded))
+        elif xhtml.tag == LI:
+            _li_to_pandoc_json(writer, xhtml, heading_level)
+            ul = xhtml.find(UL)
+            if ul is not None:
+                tasks.append(("convert", ul, _child_heading_level(xhtml, heading_level)))
+        else:
+            raise ValueError(f"unknown tag {xhtml.tag}")
+
+
+# incremental conversion: the JSON of each <li> subtree is cached under a Merkle hash of the
+# subtree, so reconverting an edited outline only redoes the rows on the path to the edits
+
+
+class _Fragment(NamedTuple):
+    """
+    The Pandoc JSON of one <li> subtree as spliced into its parent's block list:
+    code lines that may merge with a preceding code block, the complete blocks,
+    and code lines that may merge with a following one.
+    """
+
+    lead: tuple
+    body: str
+    trail: tuple
+
+
+class _FragmentRecorder(_PandocJSONWriter):
+    """_PandocJSONWriter that records into a _Fragment instead of a stream"""
+
+    def __init__(self, items):
+        super().__init__(None, buffer_size=float("inf"))
+        self.lists = [[items, True, None, ""]]
+        self.lead = ()
+
+    def flush(self):
+        pass
+
+    def _flush_code(self, lst):
+        if lst is self.lists[0] and lst[1]:
+            # code before the first block stays open to merge with the preceding code
+            self.lead, lst[2] = tuple(lst[2] or ()), None
+        else:
+            super()._flush_code(lst)
+
+    def fragment(self) -> _Fragment:
+        lst = self.lists[0]
+        if lst[1]:
+            return _Fragment(tuple(lst[2] or ()), "", ())
+        return _Fragment(self.lead, "".join(self.buffer), tuple(lst[2] or ()))
+
+
+class SubtreeCache(object):
+    """
+    In-memory cache of the Pandoc JSON of Bike subtrees, for write_pandoc_json(cache=...).
+
+    Entries are keyed by a hash of the subtree's content (not its ids), so unchanged and
+    moved subtrees are reused; least recently used entries go first past max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        """
+        max_bytes: the maximum total size of the cached JSON
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(fragment: _Fragment) -> int:
+        return len(fragment.body) + sum(len(t) for t in fragment.lead + fragment.trail)
+
+    def get(self, key) -> Optional[_Fragment]:
+        fragment = self._entries.get(key)
+        if fragment is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return fragment
+
+    def put(self, key, fragment: _Fragment) -> None:
+        size = self._size(fragment)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.total_bytes -= self._size(self._entries.pop(key))
+        self._entries[key] = fragment
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.total_bytes -= self._size(old)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+def subtree_hashes(ul) -> dict:
+    """
+    Merkle hashes of the <li> subtrees under ul: li -> (digest, contains a heading row).
+
+    A digest covers what the conversion depends on -- the data-type, whether the row is done,
+    the <p> and the digests of the child rows -- so it changes exactly when the output may.
+    """
+    hashes = {}
+    prefixes = {}
+    # open rows: [li, hash so far, remaining child rows, contains a heading row]
+    stack = [[None, None, iter(ul), False]]
+    while stack:
+        frame = stack[-1]
+        child = next(frame[2], None)
+        if child is None:
+            stack.pop()
+            li, h, _, has_heading = frame
+            if li is not None:
+                digest = h.digest()
+                parent = stack[-1]
+                if parent[0] is not None:
+                    parent[1].update(digest)
+                    parent[3] = parent[3] or has_heading
+                hashes[li] = (digest, has_heading)
+            continue
+        if child.tag != LI:
+            continue
+
+        data_type = child.get("data-type", "body")
+        row_kind = (data_type, child.get("data-done") is not None)
+        prefix = prefixes.get(row_kind)
+        if prefix is None:
+            prefix = prefixes[row_kind] = f"{data_type}\0{row_kind[1]:d}\0".encode("utf-8")
+        h = hashlib.blake2b(prefix, digest_size=16)
+        rows = iter(())
+        for e in child:
+            if e.tag == P_TAG:
+                if len(e):
+                    h.update(b"x" + ET.tostring(e, with_tail=False))
+                else:
+                    # plain text: no need to serialize
+                    h.update(b"t" + (e.text or "").encode("utf-8"))
+            elif e.tag == UL:
+                rows = iter(e)
+        stack.append([child, h, rows, data_type == "heading"])
+    return hashes
+
+
+def _cluster_items(cluster, items) -> bool:
+    """whether the rows of cluster are written as list items, given whether the list it's in is"""
+    data_type = cluster[0].attrib.get("data-type", "body")
+    return _CLUSTER_JSON[data_type][2] if data_type in _CLUSTER_JSON else items
+
+
+def _write_pandoc_json_cached(writer, etree, only_doc_children, cache):
+    """the body of write_pandoc_json, reusing the cached JSON of unchanged subtrees"""
+    top_ul = etree.find(f"{NS}body/{NS}ul")
+    hashes = subtree_hashes(top_ul)
+
+    def key(li, heading_level, items):
+        digest, has_heading = hashes[li]
+        # heading levels past 6 all render as paragraphs; without headings the level is moot
+        return (digest, min(heading_level, 7) if has_heading else 0, items)
+
+    def children(li, heading_level, items):
+        ul = li.find(UL)
+        if ul is None:
+            return []
+        child_level = _child_heading_level(li, heading_level)
+        return [
+            [(child, child_level, _cluster_items(cluster, items)) for child in cluster]
+            for cluster in _li_clusters(ul)
+        ]
+
+    top = _top_rows(top_ul, only_doc_children)
+
+    # find the subtrees missing from the cache, top down
+    fragments = {}
+    missing = []
+    stack = [row for cluster in top for row in cluster]
+    while stack:
+        li, heading_level, items = row = stack.pop()
+        k = key(*row)
+        if k in fragments:
+            continue
+        fragment = cache.get(k)
+        if fragment is not None:
+            fragments[k] = fragment
+            continue
+        missing.append(row)
+        stack.extend(child for cluster in children(*row) for child in cluster)
+
+    # convert them bottom up, splicing in the JSON of their child rows
+    for li, heading_level, items in reversed(missing):
+        recorder = _FragmentRecorder(items)
+        _li_to_pandoc_json(recorder, li, heading_level)
+        for cluster in children(li, heading_level, items):
+            data_type = cluster[0][0].attrib.get("data-type", "body")
+            if data_type in _CLUSTER_JSON:
+                recorder.open(*_CLUSTER_JSON[data_type])
+            for child in cluster:
+                recorder.splice(fragments[key(*child)])
+            if data_type in _CLUSTER_JSON:
+                recorder.close()
+        k = key(li, heading_level, items)
+        fragments[k] = recorder.fragment()
+        cache.put(k, fragments[k])
+
+    _splice_top_rows(
+        writer, top_ul, top, [[fragments[key(*row)] for row in cluster] for cluster in top],
+        only_doc_children,
+    )
+
+
+def _top_rows(top_ul, only_doc_children) -> List[list]:
+    """the top-level rows as clusters of (li, heading level, written as list items)"""
+    if only_doc_children:
+        return [[(li, 1, False)] for li in top_ul if li.tag == LI]
+    return [
+        [(li, 1, _cluster_items(cluster, False)) for li in cluster]
+        for cluster in _li_clusters(top_ul)
+    ]
+
+
+def _splice_top_rows(writer, top_ul, top, fragments, only_doc_children):
+    """write the _Fragments of the top-level rows, cluster by cluster as _top_rows gives them"""
+    if not only_doc_children:
+        writer.open('{"t":"Div","c":[' + _attr_json({"id": top_ul.attrib["id"]}) + ",[", "]]}")
+    for cluster, cluster_fragments in zip(top, fragments):
+        data_type = cluster[0][0].attrib.get("data-type", "body")
+        is_list = not only_doc_children and data_type in _CLUSTER_JSON
+        if is_list:
+            writer.open(*_CLUSTER_JSON[data_type])
+        for fragment in cluster_fragments:
+            writer.splice(fragment)
+        if is_list:
+            writer.close()
+    if not only_doc_children:
+        writer.close()
+
+
+# multi-core conversion: the top-level rows are split into contiguous chunks of about equal
+# size, each converted in a worker process from its serialized rows into one _Fragment per
+# row; the parent splices them in order, so list clusters and runs of code blocks that
+# cross chunk boundaries come out as in a sequential conversion
+
+
+def balanced_chunks(weights: List[int], n: int) -> List[range]:
+    """
+    Split range(len(weights)) into at most n contiguous, non-empty ranges of about equal
+    total weight.
+    """
+    total = sum(weights)
+    chunks = []
+    start = 0
+    cumulative = 0
+    for i, weight in enumerate(weights):
+        cumulative += weight
+        # cut once this chunk reaches its share of the total
+        if cumulative * n >= total * (len(chunks) + 1) and len(chunks) < n - 1:
+            chunks.append(range(start, i + 1))
+            start = i + 1
+    if start < len(weights):
+        chunks.append(range(start, len(weights)))
+    return chunks
+
+
+def _convert_rows_json(rows) -> List[_Fragment]:
+    """
+    rows: (serialized li, written as list items) for rows converted at heading level 1
+    """
+    fragments = []
+    for xml, items in rows:
+        recorder = _FragmentRecorder(items)
+        _write_subtrees_json(recorder, [(ET.fromstring(xml), 1)])
+        fragments.append(recorder.fragment())
+    return fragments
+
+
+def _write_pandoc_json_parallel(writer, etree, only_doc_children, max_workers):
+    """the body of write_pandoc_json, converting the top-level rows in a process pool"""
+    top_ul = etree.find(f"{NS}body/{NS}ul")
+    if only_doc_children:
+        for e in top_ul:
+            if e.tag != LI:
+                raise ValueError(f"unknown tag {e.tag}")
+    top = _top_rows(top_ul, only_doc_children)
+    rows = [row for cluster in top for row in cluster]
+
+    weights = [sum(1 for _ in li.iter(LI)) for li, _, _ in rows]
+    jobs = [
+        [(ET.tostring(rows[i][0]), rows[i][2]) for i in chunk]
+        for chunk in balanced_chunks(weights, max_workers)
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        converted = iter(
+            fragment for fragments in executor.map(_convert_rows_json, jobs) for fragment in fragments
+        )
+        fragments = [[next(converted) for _ in cluster] for cluster in top]
+    _splice_top_rows(writer, top_ul, top, fragments, only_doc_children)
+
+
+def write_pandoc_json(
+    etree,
+    out: IO[bytes],
+    only_doc_children=ONLY_DOC_CHILDREN,
+    cache: Optional[SubtreeCache] = None,
+    max_workers: int = 1,
+) -> None:
+    """
+    Write the Pandoc JSON AST of the Bike document etree to the binary stream out.
+
+    Produces the same AST as etree_to_panflute(etree, only_doc_children).to_json(),
+    but streams it out without constructing panflute elements.
+
+    cache: a SubtreeCache to reuse the JSON of subtrees unchanged since an earlier call
+    max_workers: with more than 1, the top-level rows are split into that many chunks of
+        about as many rows each, converted in a process pool (not combinable with cache).
+        Inline tags registered with register_inline_tag only reach the workers if they
+        are forked or register them on import.
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    if cache is not None and max_workers > 1:
+        raise ValueError("cache can't be combined with max_workers > 1")
+    writer = _PandocJSONWriter(out)
+    writer.open(
+        '{"pandoc-api-version":' + json.dumps(list(PANDOC_API_VERSION)) + ',"meta":{},"blocks":[',
+        "]}",
+    )
+    if cache is not None:
+        _write_pandoc_json_cached(writer, etree, only_doc_children, cache)
+    elif max_workers > 1:
+        _write_pandoc_json_parallel(writer, etree, only_doc_children, max_workers)
+    elif only_doc_children:
+        roots = [(e, 1) for e in XPATHS["top_level_rows"](etree)]
+        _write_subtrees_json(writer, roots)
+    else:
+        ul = etree.find(f"{NS}body/{NS}ul")
+        writer.open('{"t":"Div","c":[' + _attr_json({"id": ul.attrib["id"]}) + ",[", "]]}")
+        _write_subtrees_json(writer, [(ul, 1)])
+        writer.close()
+    writer.close()
+    writer.flush()
+
+
+def etree_to_pandoc_json(
+    etree,
+    only_doc_children=ONLY_DOC_CHILDREN,
+    cache: Optional[SubtreeCache] = None,
+    max_workers: int = 1,
+) -> bytes:
+    """
+    Pandoc JSON for etree, ready for convert_text(..., from_="json")
+    """
+    out = io.BytesIO()
+    write_pandoc_json(
+        etree, out, only_doc_children=only_doc_children, cache=cache, max_workers=max_workers
+    )
+    return out.getvalue()
+
 
 # pytest tests
 def test_cluster_runs():
@@ -477,3 +2172,20 @@ def test_keep_clusters():
         [1, 1],
     ]
     assert keep_clusters([], lambda x: True) == []
+
+
+def test_iter_cluster_runs():
+    calls = []
+
+    def key(x):
+        calls.append(x)
+        return x
+
+    items = [1, 1, 2, 3, 2, 3, 3, 5]
+    assert list(iter_cluster_runs(items, key)) == cluster_runs(items)
+    # one key per element
+    assert calls == items
+
+    # lazy: works on an endless stream
+    runs = iter_keep_clusters(iter_cluster_runs(itertools.cycle([1, 1, 2])), lambda c: c[0] == 1)
+    assert list(itertools.islice(runs, 4)) == [[1, 1], [2], [1, 1], [2]]
@@ -0,0 +1,280 @@
+"""
+Bike documents edited as .bike (XHTML) files with lxml, without the Bike app
+
+FileBikeDocument and FileBikeRow mirror BikeDocument and BikeRow, so code written against
+the Apple Events classes runs on the file directly: in memory, on any platform, and
+testable headlessly. Nothing touches the file until save().
+"""
+
+import copy
+import os
+from pathlib import Path as P
+from typing import List, Optional, Union
+
+import lxml.etree as ET
+import lxml.html
+
+from rdhyee_utils.bike import k
+from rdhyee_utils.bike.bikeformat import (
+    LI,
+    NS,
+    P_TAG,
+    UL,
+    OutlineIndex,
+    ids,
+    load_bike,
+    text_content,
+)
+
+
+class FileBikeRow(object):
+    """
+    A row of a FileBikeDocument: an <li> element, or the document's root <ul>.
+    """
+
+    def __init__(self, doc: "FileBikeDocument", element: ET.Element):
+        self.doc = doc
+        self.element = element
+
+    def __repr__(self):
+        return "<FileBikeRow: {}>".format(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, FileBikeRow) and other.element is self.element
+
+    def __hash__(self):
+        return hash(self.element)
+
+    @property
+    def id(self) -> str:
+        return self.element.get("id")
+
+    @property
+    def level(self) -> int:
+        """0 for the root row, 1 for top-level rows"""
+        level = 0
+        e = self.element
+        while e.tag == LI:
+            level += 1
+            e = e.getparent().getparent()
+        return level
+
+    @property
+    def name(self) -> str:
+        p = self.element.find(P_TAG)
+        return "" if p is None else text_content(p, include_tail=False)
+
+    @name.setter
+    def name(self, name: str):
+        if self.element.tag != LI:
+            raise AttributeError("the root row has no text")
+        p = self.element.find(P_TAG)
+        if p is None:
+            p = ET.Element(P_TAG)
+            self.element.insert(0, p)
+        # plain text replaces any rich text
+        for child in list(p):
+            p.remove(child)
+        p.text = name
+        self.doc.modified = True
+
+    # Bike's text content is the row's (rich) text; as a string it is the name
+    text_content = name
+
+    @property
+    def data_type(self) -> str:
+        return self.element.get("data-type", "body")
+
+    def _ul(self) -> Optional[ET.Element]:
+        return self.element if self.element.tag == UL else self.element.find(UL)
+
+    @property
+    def rows(self) -> List["FileBikeRow"]:
+        ul = self._ul()
+        if ul is None:
+            return []
+        return [FileBikeRow(self.doc, li) for li in ul if li.tag == LI]
+
+
+class FileBikeDocument(object):
+    """
+    A .bike file loaded into memory, with the surface of BikeDocument.
+    """
+
+    def __init__(self, path: Union[str, P]):
+        self.path = P(path)
+        self.etree = load_bike(self.path)
+        self.modified = False
+
+    def __repr__(self):
+        return "<FileBikeDocument: {}>".format(self.name)
+
+    @property
+    def _root_ul(self) -> ET.Element:
+        return self.etree.find(f"{NS}body/{UL}")
+
+    @property
+    def id(self) -> str:
+        return self._root_ul.get("id")
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def url(self) -> str:
+        return self.path.resolve().as_uri()
+
+    @property
+    def file(self) -> P:
+        return self.path
+
+    @property
+    def root_row(self) -> FileBikeRow:
+        return FileBikeRow(self, self._root_ul)
+
+    @property
+    def rows(self) -> List[FileBikeRow]:
+        """every row of the document, in document order"""
+        return [FileBikeRow(self, li) for li in self._root_ul.iter(LI)]
+
+    def row(self, id_: str) -> Optional[FileBikeRow]:
+        for li in self._root_ul.iter(LI):
+            if li.get("id") == id_:
+                return FileBikeRow(self, li)
+        return None
+
+    @property
+    def ids(self) -> List[str]:
+        """
+        Return a list of ids of the rows
+        """
+        return ids(self.etree)
+
+    def _export_etree(self, from_=None, all: bool = True) -> ET.Element:
+        """a copy of the document, or of the given rows (with their descendants if all)"""
+        if from_ is None:
+            return copy.deepcopy(self.etree)
+        assert isinstance(from_, list)
+        etree = copy.deepcopy(self.etree)
+        ul = etree.find(f"{NS}body/{UL}")
+        for li in list(ul):
+            ul.remove(li)
+        for row in from_:
+            li = copy.deepcopy(row.element)
+            li.tail = None
+            if not all:
+                for child_ul in li.findall(UL):
+                    li.remove(child_ul)
+            ul.append(li)
+        return etree
+
+    def export(self, as_=k.plain_text_format, from_=None, all: bool = True) -> str:
+        """
+        all: Export all contained rows (true) or only the given rows (false). Defaults to true
+        """
+        assert as_ in (k.plain_text_format, k.OPML_format, k.bike_format)
+        etree = self._export_etree(from_, all)
+        if as_ == k.bike_format:
+            return ET.tostring(
+                etree, xml_declaration=True, encoding="UTF-8", pretty_print=True
+            ).decode("utf-8")
+
+        rows = [
+            (FileBikeRow(self, li).level, FileBikeRow(self, li).name)
+            for li in etree.find(f"{NS}body/{UL}").iter(LI)
+        ]
+        if as_ == k.plain_text_format:
+            return "".join("\t" * (level - 1) + name + "\n" for level, name in rows)
+
+        opml = ET.Element("opml", version="2.0")
+        ET.SubElement(ET.SubElement(opml, "head"), "title").text = self.path.stem
+        parents = [ET.SubElement(opml, "body")]
+        for level, name in rows:
+            del parents[level:]
+            parents.append(ET.SubElement(parents[-1], "outline", text=name))
+        return ET.tostring(
+            opml, xml_declaration=True, encoding="UTF-8", pretty_print=True
+        ).decode("utf-8")
+
+    def lxml_html(self, from_=None, all: bool = True) -> lxml.html.HtmlElement:
+        """
+
+        all: Export all contained rows (true) or only the given rows (false). Defaults to true
+        """
+        return lxml.html.fromstring(ET.tostring(self._export_etree(from_, all)))
+
+    def lxml_etree(self, from_=None, all: bool = True) -> ET.Element:
+        """
+        A copy of the document (like BikeDocument's export, changing it leaves the document
+        alone; use .etree to edit in place)
+
+        all: Export all contained rows (true) or only the given rows (false). Defaults to true
+        """
+        return self._export_etree(from_, all)
+
+    def outline_index(self, from_=None, all: bool = True) -> OutlineIndex:
+        """
+        Index the document (see bikeformat.OutlineIndex), for running many queries against
+        the same snapshot of the outline.
+        """
+        if from_ is None:
+            return OutlineIndex(self.etree)
+        return OutlineIndex(self._export_etree(from_, all))
+
+    def sort_rows(
+        self,
+        r: FileBikeRow,
+        row_func=lambda r: r.name,
+        reverse: bool = False,
+    ) -> None:
+        """
+        r: the row whose children to sort
+        row_func: a function that takes a row and returns a value to sort on
+        reverse: whether to sort in reverse order
+        """
+        ul = r._ul()
+        if ul is None:
+            return
+        rows = r.rows
+        ordered = sorted(rows, key=row_func, reverse=reverse)
+        if ordered != rows:
+            ul[:] = [row.element for row in ordered]
+            self.modified = True
+
+    def swap_rows(self, r: FileBikeRow, i: int, j: int):
+        """swap the child rows i and j of parent row r"""
+        # make sure i not smaller than j
+        if j < i:
+            (i, j) = (j, i)
+        if i == j:
+            return
+
+        ul = r._ul()
+        row_i, row_j = ul[i], ul[j]
+        before_j = row_j.getprevious()
+        row_i.addprevious(row_j)
+        if before_j is not row_i:
+            before_j.addnext(row_i)
+        self.modified = True
+
+    def save(self, in_: Union[str, P, None] = None, as_=None):
+        """
+        Write the document to in_ (default: its own file) as a .bike file, or as the export
+        format as_ (k.plain_text_format or k.OPML_format).
+        """
+        path = self.path if in_ is None else P(in_)
+        if as_ is None or as_ == k.bike_format:
+            data = self.export(as_=k.bike_format).encode("utf-8")
+        else:
+            data = self.export(as_=as_).encode("utf-8")
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        if as_ is None or as_ == k.bike_format:
+            self.path = path
+            self.modified = False
+
+    def close(self, saving=k.yes, saving_in=None):
+        if saving == k.yes and (self.modified or saving_in is not None):
+            self.save(in_=saving_in)
@@ -0,0 +1,73 @@
+"""
+bookkeeping shared by the incremental tools (batch conversion, TaskIndex, SearchIndex):
+content hashes and refreshing per changed file
+"""
+
+import hashlib
+import os
+from pathlib import Path as P
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+
+def file_hash(path: Union[str, P]) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def refresh_files(
+    paths: Iterable[Union[str, P]],
+    known: Dict[str, Tuple],
+    index_file: Callable[[P, Optional[str]], object],
+    remove_file: Callable[[str], None],
+    touch_file: Optional[Callable[[P, os.stat_result], None]] = None,
+) -> Dict[str, int]:
+    """
+    Bring an index up to date with the given .bike files and directories (searched
+    recursively). Files with unchanged mtime and size aren't read; indexed files under a
+    given directory that no longer exist are removed.
+
+    known: (mtime_ns, size) of the indexed files by resolved path, or (mtime_ns, size, hash)
+        when touch_file is given
+    index_file: called with the path and content hash (None without touch_file) of every
+        new or changed file
+    remove_file: called with the path of every indexed file that is gone
+    touch_file: called with the path and stat of files that were touched but whose content
+        hash is unchanged, instead of index_file
+
+    :return: counts of "indexed", "unchanged" and "removed" files
+    """
+    counts = {"indexed": 0, "unchanged": 0, "removed": 0}
+    seen = set()
+    dirs = []
+    for path in paths:
+        path = P(path).resolve()
+        if path.is_dir():
+            dirs.append(path)
+            files = sorted(path.rglob("*.bike"))
+        else:
+            files = [path]
+        for f in files:
+            seen.add(str(f))
+            stat = f.stat()
+            entry = known.get(str(f))
+            if entry is not None and tuple(entry[:2]) == (stat.st_mtime_ns, stat.st_size):
+                counts["unchanged"] += 1
+                continue
+            digest = None
+            if touch_file is not None:
+                digest = file_hash(f)
+                if entry is not None and entry[2] == digest:
+                    touch_file(f, stat)
+                    counts["unchanged"] += 1
+                    continue
+            index_file(f, digest)
+            counts["indexed"] += 1
+
+    for path in known:
+        if path not in seen and any(os.path.commonpath([path, str(d)]) == str(d) for d in dirs):
+            remove_file(path)
+            counts["removed"] += 1
+    return counts
@@ -0,0 +1,208 @@
+"""
+full-text search over the rows of many .bike files (SQLite FTS5)
+"""
+
+import re
+import sqlite3
+from pathlib import Path as P
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from rdhyee_utils.bike.bikeformat import iter_rows, text_content
+from rdhyee_utils.bike.incremental import file_hash, refresh_files
+
+BREADCRUMB_SEPARATOR = "\n"
+
+# rows holds the data; rows_fts indexes its text columns (external content table kept
+# in sync by triggers), so a file's rows can be dropped through the index on rows.file
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    rowid INTEGER PRIMARY KEY,
+    file TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    id TEXT,
+    data_type TEXT NOT NULL,
+    text TEXT NOT NULL,
+    breadcrumbs TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rows_file ON rows(file);
+CREATE VIRTUAL TABLE IF NOT EXISTS rows_fts USING fts5(
+    text, breadcrumbs, content='rows', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS rows_ai AFTER INSERT ON rows BEGIN
+    INSERT INTO rows_fts (rowid, text, breadcrumbs)
+    VALUES (new.rowid, new.text, new.breadcrumbs);
+END;
+CREATE TRIGGER IF NOT EXISTS rows_ad AFTER DELETE ON rows BEGIN
+    INSERT INTO rows_fts (rows_fts, rowid, text, breadcrumbs)
+    VALUES ('delete', old.rowid, old.text, old.breadcrumbs);
+END;
+"""
+
+
+class SearchHit(NamedTuple):
+    file: str
+    id: Optional[str]
+    data_type: str
+    text: str
+    # texts of the enclosing rows, outermost first
+    breadcrumbs: Tuple[str, ...]
+    # bm25 rank; lower is better
+    score: float
+
+
+def scan_rows(path: Union[str, P]) -> List[tuple]:
+    """
+    Stream a .bike file and return (position, id, data-type, text, breadcrumbs) for every row.
+    """
+    rows = []
+    breadcrumbs = []
+    for position, row in enumerate(iter_rows(path)):
+        del breadcrumbs[row.level - 1 :]
+        text = text_content(row.p, include_tail=False)
+        rows.append((position, row.id, row.data_type, text, BREADCRUMB_SEPARATOR.join(breadcrumbs)))
+        breadcrumbs.append(text)
+    return rows
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query matching rows that contain all of its words.
+    """
+    words = re.findall(r"\w+", text)
+    return " AND ".join(f'"{word}"' for word in words)
+
+
+class SearchIndex(object):
+    """
+    Full-text index of the rows of many .bike files, kept in SQLite and refreshed per changed file.
+    """
+
+    def __init__(self, db_path: Union[str, P] = ":memory:"):
+        """
+        db_path: the SQLite database file (created if needed)
+        """
+        self.db = sqlite3.connect(str(db_path))
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def index_file(self, path: Union[str, P], digest: Optional[str] = None) -> int:
+        """
+        (Re)index one .bike file; return the number of rows found.
+        """
+        path = P(path).resolve()
+        stat = path.stat()
+        if digest is None:
+            digest = file_hash(path)
+        rows = scan_rows(path)
+        with self.db:
+            self.db.execute("DELETE FROM rows WHERE file = ?", (str(path),))
+            self.db.execute("DELETE FROM files WHERE path = ?", (str(path),))
+            self.db.execute(
+                "INSERT INTO files (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?)",
+                (str(path), stat.st_mtime_ns, stat.st_size, digest),
+            )
+            self.db.executemany(
+                "INSERT INTO rows (file, position, id, data_type, text, breadcrumbs)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(str(path),) + row for row in rows],
+            )
+        return len(rows)
+
+    def remove_file(self, path: Union[str, P]) -> None:
+        path = str(P(path).resolve())
+        with self.db:
+            self.db.execute("DELETE FROM rows WHERE file = ?", (path,))
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def refresh(self, paths: Iterable[Union[str, P]]) -> Dict[str, int]:
+        """
+        Bring the index up to date with the given .bike files and directories (searched
+        recursively). Files with unchanged mtime and size aren't read; files that were
+        touched but whose content hash is unchanged aren't re-parsed. Indexed files under
+        a given directory that no longer exist are dropped.
+
+        :return: counts of "indexed", "unchanged" and "removed" files
+        """
+        known = {
+            path: (mtime_ns, size, digest)
+            for path, mtime_ns, size, digest in self.db.execute(
+                "SELECT path, mtime_ns, size, hash FROM files"
+            )
+        }
+
+        def touch_file(path, stat):
+            with self.db:
+                self.db.execute(
+                    "UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?",
+                    (stat.st_mtime_ns, stat.st_size, str(path)),
+                )
+
+        return refresh_files(paths, known, self.index_file, self.remove_file, touch_file)
+
+    def search(
+        self,
+        query: str,
+        limit: Optional[int] = 20,
+        raw: bool = False,
+        data_type: Optional[str] = None,
+        file: Union[str, P, None] = None,
+    ) -> List[SearchHit]:
+        """
+        Rows matching query, best first. Matches in the row text weigh more than matches
+        in the breadcrumbs.
+
+        query: words that must all occur, or FTS5 query syntax if raw is True
+        limit: maximum number of hits (None for all)
+        data_type: only rows of this data-type ("body" for plain rows)
+        file: only rows of this file
+        """
+        if not raw:
+            query = fts_query(query)
+            if not query:
+                return []
+        sql = (
+            "SELECT rows.file, rows.id, rows.data_type, rows.text, rows.breadcrumbs,"
+            " bm25(rows_fts, 10.0, 1.0) AS score"
+            " FROM rows_fts JOIN rows ON rows.rowid = rows_fts.rowid"
+            " WHERE rows_fts MATCH ?"
+        )
+        params = [query]
+        if data_type is not None:
+            sql += " AND rows.data_type = ?"
+            params.append(data_type)
+        if file is not None:
+            sql += " AND rows.file = ?"
+            params.append(str(P(file).resolve()))
+        sql += " ORDER BY score, rows.file, rows.position"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [
+            SearchHit(
+                file,
+                id_,
+                data_type_,
+                text,
+                tuple(breadcrumbs.split(BREADCRUMB_SEPARATOR)) if breadcrumbs else (),
+                score,
+            )
+            for file, id_, data_type_, text, breadcrumbs, score in self.db.execute(sql, params)
+        ]
+
+    def files(self) -> List[str]:
+        return [path for (path,) in self.db.execute("SELECT path FROM files ORDER BY path")]
@@ -0,0 +1,208 @@
+"""
+persistent SQLite index of the task rows of many .bike files
+"""
+
+import datetime
+import json
+import sqlite3
+from pathlib import Path as P
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from rdhyee_utils.bike.bikeformat import iter_rows, text_content
+from rdhyee_utils.bike.incremental import refresh_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    file TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    id TEXT,
+    text TEXT NOT NULL,
+    done TEXT,
+    ancestors TEXT NOT NULL,
+    PRIMARY KEY (file, position)
+);
+CREATE INDEX IF NOT EXISTS tasks_done ON tasks(done);
+CREATE TABLE IF NOT EXISTS ancestors (
+    file TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    data_type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ancestors_text ON ancestors(text);
+"""
+
+
+class TaskRecord(NamedTuple):
+    file: str
+    id: Optional[str]
+    text: str
+    # data-done timestamp, None for open tasks
+    done: Optional[str]
+    # texts of the enclosing rows, outermost first
+    ancestors: Tuple[str, ...]
+
+
+def _timestamp(value: Union[str, datetime.datetime, datetime.date]) -> str:
+    # the format of Bike's data-done attribute, so timestamps compare as strings
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def scan_tasks(path: Union[str, P]) -> List[tuple]:
+    """
+    Stream a .bike file and return (position, id, text, done, ancestors) for its task rows;
+    ancestors are the (text, data-type) of the enclosing rows, outermost first.
+    """
+    tasks = []
+    # (text, data-type) of the rows enclosing the current one
+    open_rows = []
+    for position, row in enumerate(iter_rows(path)):
+        del open_rows[row.level - 1 :]
+        text = text_content(row.p, include_tail=False)
+        if row.data_type == "task":
+            tasks.append((position, row.id, text, row.data_done, list(open_rows)))
+        open_rows.append((text, row.data_type))
+    return tasks
+
+
+class TaskIndex(object):
+    """
+    Task rows of many .bike files, kept in SQLite and refreshed per changed file.
+    """
+
+    def __init__(self, db_path: Union[str, P] = ":memory:"):
+        """
+        db_path: the SQLite database file (created if needed)
+        """
+        self.db = sqlite3.connect(str(db_path))
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def index_file(self, path: Union[str, P]) -> int:
+        """
+        (Re)index one .bike file; return the number of tasks found.
+        """
+        path = P(path).resolve()
+        stat = path.stat()
+        tasks = scan_tasks(path)
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (str(path),))
+            self.db.execute(
+                "INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                (str(path), stat.st_mtime_ns, stat.st_size),
+            )
+            self.db.executemany(
+                "INSERT INTO tasks (file, position, id, text, done, ancestors)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (str(path), position, id_, text, done, json.dumps([a for a, _ in ancestors]))
+                    for position, id_, text, done, ancestors in tasks
+                ],
+            )
+            self.db.executemany(
+                "INSERT INTO ancestors (file, position, text, data_type) VALUES (?, ?, ?, ?)",
+                [
+                    (str(path), position, text, data_type)
+                    for position, _, _, _, ancestors in tasks
+                    for text, data_type in ancestors
+                ],
+            )
+        return len(tasks)
+
+    def remove_file(self, path: Union[str, P]) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (str(P(path).resolve()),))
+
+    def refresh(self, paths: Iterable[Union[str, P]]) -> Dict[str, int]:
+        """
+        Bring the index up to date with the given .bike files and directories (searched
+        recursively). Files whose mtime and size are unchanged aren't read; indexed files
+        under a given directory that no longer exist are dropped.
+
+        :return: counts of "indexed", "unchanged" and "removed" files
+        """
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute("SELECT path, mtime_ns, size FROM files")
+        }
+        return refresh_files(
+            paths, known, lambda path, digest: self.index_file(path), self.remove_file
+        )
+
+    def tasks(
+        self,
+        done: Optional[bool] = None,
+        done_since: Union[str, datetime.datetime, datetime.date, None] = None,
+        done_before: Union[str, datetime.datetime, datetime.date, None] = None,
+        under: Optional[str] = None,
+        under_type: Optional[str] = "heading",
+        text: Optional[str] = None,
+        file: Union[str, P, None] = None,
+    ) -> List[TaskRecord]:
+        """
+        Query the indexed tasks, in file and document order.
+
+        done: only done (True) or open (False) tasks
+        done_since, done_before: bounds on the done timestamp (UTC datetimes, dates or Bike timestamps)
+        under: only tasks with an enclosing row with exactly this text ...
+        under_type: ... and this data-type (None for any)
+        text: only tasks whose text contains this (case-insensitive for ASCII)
+        file: only tasks of this file
+        """
+        where, params = [], []
+        if done is not None:
+            where.append("done IS NOT NULL" if done else "done IS NULL")
+        if done_since is not None:
+            where.append("done >= ?")
+            params.append(_timestamp(done_since))
+        if done_before is not None:
+            where.append("done < ?")
+            params.append(_timestamp(done_before))
+        if under is not None:
+            clause = (
+                "EXISTS (SELECT 1 FROM ancestors a"
+                " WHERE a.file = tasks.file AND a.position = tasks.position AND a.text = ?"
+            )
+            params.append(under)
+            if under_type is not None:
+                clause += " AND a.data_type = ?"
+                params.append(under_type)
+            where.append(clause + ")")
+        if text is not None:
+            where.append("text LIKE ? ESCAPE '\\'")
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if file is not None:
+            where.append("file = ?")
+            params.append(str(P(file).resolve()))
+
+        sql = "SELECT file, id, text, done, ancestors FROM tasks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY file, position"
+        return [
+            TaskRecord(file, id_, text_, done_, tuple(json.loads(ancestors)))
+            for file, id_, text_, done_, ancestors in self.db.execute(sql, params)
+        ]
+
+    def files(self) -> List[str]:
+        return [path for (path,) in self.db.execute("SELECT path FROM files ORDER BY path")]
@@ -0,0 +1,720 @@
+"""
+XSLT fast path from Bike XHTML to HTML and CommonMark, bypassing panflute and pandoc
+
+For the common subset of Bike (body, heading, task/ordered/unordered, quote, code and hr
+rows; strong, em, code, a, span, mark and s markup) the stylesheets reproduce what pandoc
+PANDOC_VERSION (3.9) writes for the AST of etree_to_pandoc_json, writer quirks included:
+blank lines around sections, <!-- --> separators between adjacent lists, autolinks and
+escaped list markers. Other pandoc versions can differ in those details.
+
+The transform is done in two passes, both in libxslt: BIKE_TO_BLOCKS_XSL builds a small
+block tree mirroring that AST (list runs, flattened child rows, tails inside their inline
+element), which BLOCKS_TO_HTML_XSL or BLOCKS_TO_COMMONMARK_XSL serializes. Anything outside the subset stops the transform with
+UnsupportedBikeContent, so callers can fall back to the pandoc path.
+"""
+
+import functools
+import re
+
+import lxml.etree as ET
+
+from rdhyee_utils.bike import bikeformat
+from rdhyee_utils.bike.bikeformat import ONLY_DOC_CHILDREN
+
+XSLT_FORMATS = ("html", "commonmark")
+
+# the pandoc version whose html and commonmark writers the stylesheets emulate
+PANDOC_VERSION = "3.9"
+# the pandoc arguments the stylesheets emulate
+XSLT_EXTRA_ARGS = ("--wrap=none",)
+# bump whenever a change to the stylesheets alters their output (batch keys its incremental
+# rebuilds on it instead of on the pandoc version)
+XSLT_VERSION = "1"
+
+
+class UnsupportedBikeContent(ValueError):
+    """
+    Raised when a Bike document uses something the XSLT fast path doesn't reproduce.
+    """
+
+
+# list runs (sibling rows of the same list data-type) and runs of code blocks are walked
+# RUN_CHUNK siblings per template call, so a run only costs len(run) / RUN_CHUNK of
+# libxslt's 3000 nested template calls. libxml2 only finds following-sibling::*[n] without
+# walking the whole axis when n is a literal, hence the window spelled out as a union
+RUN_CHUNK = 32
+
+
+def _window(step: str) -> str:
+    return " | ".join(f"following-sibling::{step}[{i}]" for i in range(1, RUN_CHUNK))
+
+
+BIKE_TO_BLOCKS_XSL = """\
+<xsl:stylesheet version="1.0"
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:h="http://www.w3.org/1999/xhtml"
+    xmlns:set="http://exslt.org/sets"
+    exclude-result-prefixes="h set">
+  <xsl:output method="xml" encoding="UTF-8"/>
+
+  <xsl:template match="/">
+    <xsl:if test="h:html/h:body/h:ul/*[not(self::h:li)]">
+      <xsl:message terminate="yes">top-level element that isn't a row</xsl:message>
+    </xsl:if>
+    <doc>
+      <xsl:for-each select="h:html/h:body/h:ul/h:li">
+        <xsl:variable name="type" select="string(@data-type)"/>
+        <xsl:if test="$type = 'task' or $type = 'ordered' or $type = 'unordered'">
+          <xsl:message terminate="yes">top-level list row</xsl:message>
+        </xsl:if>
+        <xsl:apply-templates select="." mode="row">
+          <xsl:with-param name="level" select="1"/>
+        </xsl:apply-templates>
+      </xsl:for-each>
+    </doc>
+  </xsl:template>
+
+  <!-- the child rows of a row: runs of list rows become lists, other rows are flattened -->
+  <xsl:template match="h:ul" mode="rows">
+    <xsl:param name="level"/>
+    <xsl:for-each select="h:li">
+      <xsl:variable name="type" select="string(@data-type)"/>
+      <xsl:choose>
+        <xsl:when test="$type = 'task' or $type = 'ordered' or $type = 'unordered'
+                        or $type = 'quote'">
+          <xsl:if test="not(preceding-sibling::h:li[1]/self::h:li[@data-type = $type])">
+            <!-- the list element is named after the data-type of its rows -->
+            <xsl:element name="{$type}">
+              <xsl:apply-templates select="." mode="run">
+                <xsl:with-param name="type" select="$type"/>
+                <xsl:with-param name="level" select="$level"/>
+              </xsl:apply-templates>
+            </xsl:element>
+          </xsl:if>
+        </xsl:when>
+        <xsl:otherwise>
+          <xsl:apply-templates select="." mode="row">
+            <xsl:with-param name="level" select="$level"/>
+          </xsl:apply-templates>
+        </xsl:otherwise>
+      </xsl:choose>
+    </xsl:for-each>
+  </xsl:template>
+
+  <!-- the rows of the run starting at this row, RUN_CHUNK at a time -->
+  <xsl:template match="h:li" mode="run">
+    <xsl:param name="type"/>
+    <xsl:param name="level"/>
+    <xsl:variable name="window" select="@WINDOW@"/>
+    <xsl:variable name="stop" select="$window[not(@data-type = $type)][1]"/>
+    <xsl:apply-templates select=". | set:leading($window, $stop)" mode="row">
+      <xsl:with-param name="level" select="$level"/>
+    </xsl:apply-templates>
+    <xsl:if test="not($stop) and count($window) = @CHUNK@ - 1">
+      <xsl:apply-templates select="following-sibling::h:li[@CHUNK@]/self::h:li[@data-type = $type]"
+                           mode="run">
+        <xsl:with-param name="type" select="$type"/>
+        <xsl:with-param name="level" select="$level"/>
+      </xsl:apply-templates>
+    </xsl:if>
+  </xsl:template>
+
+  <!-- a row's own block, followed by the blocks of its child rows -->
+  <xsl:template match="h:li" mode="row">
+    <xsl:param name="level"/>
+    <xsl:variable name="type">
+      <xsl:choose>
+        <xsl:when test="@data-type"><xsl:value-of select="@data-type"/></xsl:when>
+        <xsl:otherwise>body</xsl:otherwise>
+      </xsl:choose>
+    </xsl:variable>
+    <xsl:variable name="p" select="h:p[1]"/>
+    <xsl:if test="$type != 'hr' and not($p)">
+      <xsl:message terminate="yes">row without text</xsl:message>
+    </xsl:if>
+    <xsl:if test="$p[.//comment() or .//processing-instruction()]">
+      <xsl:message terminate="yes">comment in row text</xsl:message>
+    </xsl:if>
+    <xsl:if test="contains($p, '&#13;')">
+      <xsl:message terminate="yes">carriage return in row text</xsl:message>
+    </xsl:if>
+    <xsl:choose>
+      <xsl:when test="$type = 'body' or $type = 'quote'">
+        <para><xsl:apply-templates select="$p" mode="inline"/></para>
+      </xsl:when>
+      <xsl:when test="$type = 'heading'">
+        <header level="{$level}"><xsl:apply-templates select="$p" mode="inline"/></header>
+      </xsl:when>
+      <xsl:when test="$type = 'task'">
+        <plain task="{string(@data-done) != ''}"><xsl:apply-templates select="$p" mode="inline"/></plain>
+      </xsl:when>
+      <xsl:when test="$type = 'ordered' or $type = 'unordered'">
+        <plain><xsl:apply-templates select="$p" mode="inline"/></plain>
+      </xsl:when>
+      <xsl:when test="$type = 'code'">
+        <!-- text_content(p): the tail is included -->
+        <code><xsl:value-of select="$p"/><xsl:value-of select="$p/following-sibling::node()[1][self::text()]"/></code>
+      </xsl:when>
+      <xsl:when test="$type = 'hr'"><hr/></xsl:when>
+      <xsl:otherwise>
+        <xsl:message terminate="yes">unsupported data-type</xsl:message>
+      </xsl:otherwise>
+    </xsl:choose>
+    <xsl:apply-templates select="h:ul[1]" mode="rows">
+      <xsl:with-param name="level" select="$level + ($type = 'heading' and $level &lt; 6)"/>
+    </xsl:apply-templates>
+  </xsl:template>
+
+  <!-- inlines, as rich_text builds them: one str per text node, tails inside their element -->
+  <xsl:template match="text()" mode="inline">
+    <xsl:if test="not(preceding-sibling::node())"><str><xsl:value-of select="."/></str></xsl:if>
+  </xsl:template>
+
+  <xsl:template name="tail">
+    <xsl:for-each select="following-sibling::node()[1][self::text()]">
+      <str><xsl:value-of select="."/></str>
+    </xsl:for-each>
+  </xsl:template>
+
+  <xsl:template match="h:p" mode="inline">
+    <xsl:apply-templates mode="inline"/>
+    <xsl:call-template name="tail"/>
+  </xsl:template>
+
+  <xsl:template match="h:strong" mode="inline">
+    <strong><xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/></strong>
+  </xsl:template>
+
+  <xsl:template match="h:em" mode="inline">
+    <emph><xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/></emph>
+  </xsl:template>
+
+  <xsl:template match="h:s" mode="inline">
+    <strike><xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/></strike>
+  </xsl:template>
+
+  <xsl:template match="h:mark" mode="inline">
+    <span class="mark"><xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/></span>
+  </xsl:template>
+
+  <xsl:template match="h:span" mode="inline">
+    <xsl:if test="@*[not(local-name() = 'class' or local-name() = 'id'
+                         or starts-with(local-name(), 'data-'))
+                     or namespace-uri() != ''
+                     or contains(., '&quot;') or contains(., '&amp;') or contains(., '&lt;')]">
+      <xsl:message terminate="yes">unsupported span attribute</xsl:message>
+    </xsl:if>
+    <span>
+      <xsl:copy-of select="@*"/>
+      <xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/>
+    </span>
+  </xsl:template>
+
+  <xsl:template match="h:a" mode="inline">
+    <xsl:if test="not(@href)">
+      <xsl:message terminate="yes">link without href</xsl:message>
+    </xsl:if>
+    <link href="{@href}"><xsl:apply-templates mode="inline"/><xsl:call-template name="tail"/></link>
+  </xsl:template>
+
+  <!-- code and unknown tags are flattened, tail included -->
+  <xsl:template match="h:code" mode="inline">
+    <icode><xsl:value-of select="."/><xsl:value-of select="following-sibling::node()[1][self::text()]"/></icode>
+  </xsl:template>
+
+  <xsl:template match="*" mode="inline">
+    <str><xsl:value-of select="."/><xsl:value-of select="following-sibling::node()[1][self::text()]"/></str>
+  </xsl:template>
+</xsl:stylesheet>
+""".replace("@WINDOW@", _window("h:li")).replace("@CHUNK@", str(RUN_CHUNK))
+
+# the text of the run of code blocks starting at this one, merged as _PandocJSONWriter does;
+# shared by the serializing stylesheets
+_CODE_RUN_XSL = """\
+  <xsl:template name="code-text">
+    <xsl:choose>
+      <xsl:when test="parent::task or parent::unordered or parent::ordered">
+        <xsl:value-of select="."/>
+      </xsl:when>
+      <xsl:otherwise><xsl:apply-templates select="." mode="run"/></xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <xsl:template match="code" mode="run">
+    <xsl:variable name="window" select="@WINDOW@"/>
+    <xsl:variable name="stop" select="$window[not(self::code)][1]"/>
+    <xsl:for-each select=". | set:leading($window, $stop)">
+      <xsl:if test="position() &gt; 1"><xsl:text>&#10;</xsl:text></xsl:if>
+      <xsl:value-of select="."/>
+    </xsl:for-each>
+    <xsl:if test="not($stop) and count($window) = @CHUNK@ - 1">
+      <xsl:for-each select="following-sibling::*[@CHUNK@]/self::code">
+        <xsl:text>&#10;</xsl:text>
+        <xsl:apply-templates select="." mode="run"/>
+      </xsl:for-each>
+    </xsl:if>
+  </xsl:template>
+""".replace("@WINDOW@", _window("*")).replace("@CHUNK@", str(RUN_CHUNK))
+
+BLOCKS_TO_HTML_XSL = """\
+<xsl:stylesheet version="1.0"
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:set="http://exslt.org/sets"
+    xmlns:str="http://exslt.org/strings"
+    exclude-result-prefixes="set str">
+  <xsl:output method="text" encoding="UTF-8"/>
+
+  <xsl:template match="/doc">
+    <xsl:call-template name="blocks"/>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- the blocks of doc or quote, one per line; empty paragraphs are dropped -->
+  <xsl:template name="blocks">
+    <xsl:for-each select="*[not(self::para and not(node()))]
+                           [not(self::code and preceding-sibling::*[1]/self::code)]">
+      <xsl:if test="position() &gt; 1"><xsl:text>&#10;</xsl:text></xsl:if>
+      <xsl:apply-templates select="." mode="block"/>
+    </xsl:for-each>
+  </xsl:template>
+
+  <xsl:template name="escape">
+    <xsl:param name="text" select="."/>
+    <xsl:value-of select="str:replace(str:replace(str:replace(
+        $text, '&amp;', '&amp;amp;'), '&lt;', '&amp;lt;'), '&gt;', '&amp;gt;')"/>
+  </xsl:template>
+
+  <xsl:template name="attribute">
+    <xsl:param name="name" select="name()"/>
+    <xsl:text> </xsl:text><xsl:value-of select="$name"/><xsl:text>="</xsl:text>
+    <xsl:value-of select="str:replace(str:replace(str:replace(str:replace(
+        ., '&amp;', '&amp;amp;'), '&lt;', '&amp;lt;'), '&gt;', '&amp;gt;'), '&quot;', '&amp;quot;')"/>
+    <xsl:text>"</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="para" mode="block">
+    <xsl:if test="node()">&lt;p&gt;<xsl:apply-templates mode="inline"/>&lt;/p&gt;</xsl:if>
+  </xsl:template>
+
+  <!-- pandoc groups the top-level blocks into sections; a section of nothing but empty
+       paragraphs leaves an empty line before the next one -->
+  <xsl:template match="header" mode="block">
+    <xsl:text>&lt;h</xsl:text><xsl:value-of select="@level"/>&gt;<xsl:apply-templates mode="inline"/>
+    <xsl:text>&lt;/h</xsl:text><xsl:value-of select="@level"/>&gt;<xsl:if
+        test="parent::doc and following-sibling::*[1]/self::para[not(node())]">
+      <xsl:apply-templates select="following-sibling::*[1]" mode="section-end">
+        <xsl:with-param name="level" select="@level"/>
+      </xsl:apply-templates>
+    </xsl:if>
+  </xsl:template>
+
+  <!-- walk the empty paragraphs after a header up to the header closing its section -->
+  <xsl:template match="para[not(node())]" mode="section-end">
+    <xsl:param name="level"/>
+    <xsl:apply-templates select="following-sibling::*[1]" mode="section-end">
+      <xsl:with-param name="level" select="$level"/>
+    </xsl:apply-templates>
+  </xsl:template>
+
+  <xsl:template match="header" mode="section-end">
+    <xsl:param name="level"/>
+    <xsl:if test="@level &lt;= $level"><xsl:text>&#10;</xsl:text></xsl:if>
+  </xsl:template>
+
+  <xsl:template match="*" mode="section-end"/>
+
+  <xsl:template match="plain" mode="block">
+    <xsl:apply-templates mode="inline"/>
+  </xsl:template>
+
+  <xsl:template match="plain[@task]" mode="block">
+    <xsl:text>&lt;label&gt;&lt;input type="checkbox" </xsl:text>
+    <xsl:if test="@task = 'true'">checked="" </xsl:if>
+    <xsl:text>/&gt;</xsl:text>
+    <xsl:apply-templates mode="inline"/>
+    <xsl:text>&lt;/label&gt;</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="code" mode="block">
+    <xsl:text>&lt;pre&gt;&lt;code&gt;</xsl:text>
+    <xsl:call-template name="escape">
+      <xsl:with-param name="text"><xsl:call-template name="code-text"/></xsl:with-param>
+    </xsl:call-template>
+    <xsl:text>&lt;/code&gt;&lt;/pre&gt;</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="hr" mode="block">&lt;hr /&gt;</xsl:template>
+
+  <xsl:template match="quote" mode="block">
+    <xsl:text>&lt;blockquote&gt;&#10;</xsl:text>
+    <xsl:call-template name="blocks"/>
+    <xsl:text>&#10;&lt;/blockquote&gt;</xsl:text>
+  </xsl:template>
+
+  <xsl:template match="task | unordered | ordered" mode="block">
+    <xsl:choose>
+      <xsl:when test="self::ordered">&lt;ol type="1"&gt;</xsl:when>
+      <xsl:when test="*[not(self::plain[@task])]">&lt;ul&gt;</xsl:when>
+      <xsl:otherwise>&lt;ul class="task-list"&gt;</xsl:otherwise>
+    </xsl:choose>
+    <xsl:for-each select="*">
+      <xsl:text>&#10;&lt;li&gt;</xsl:text>
+      <xsl:apply-templates select="." mode="block"/>
+      <xsl:text>&lt;/li&gt;</xsl:text>
+    </xsl:for-each>
+    <xsl:choose>
+      <xsl:when test="self::ordered">&#10;&lt;/ol&gt;</xsl:when>
+      <xsl:otherwise>&#10;&lt;/ul&gt;</xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+<!-- code-run -->
+  <xsl:template match="str" mode="inline">
+    <xsl:call-template name="escape"/>
+  </xsl:template>
+
+  <xsl:template match="strong" mode="inline">
+    <xsl:text>&lt;strong&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/strong&gt;</xsl:template>
+
+  <xsl:template match="emph" mode="inline">
+    <xsl:text>&lt;em&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/em&gt;</xsl:template>
+
+  <xsl:template match="strike" mode="inline">
+    <xsl:text>&lt;del&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/del&gt;</xsl:template>
+
+  <xsl:template match="span" mode="inline">
+    <xsl:text>&lt;span</xsl:text>
+    <xsl:for-each select="@*"><xsl:call-template name="attribute"/></xsl:for-each>
+    <xsl:text>&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/span&gt;</xsl:template>
+
+  <xsl:template match="link" mode="inline">
+    <xsl:text>&lt;a</xsl:text>
+    <xsl:for-each select="@href"><xsl:call-template name="attribute"/></xsl:for-each>
+    <xsl:text>&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/a&gt;</xsl:template>
+
+  <!-- pandoc doesn't nest links -->
+  <xsl:template match="link//link" mode="inline">
+    <xsl:text>&lt;span&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/span&gt;</xsl:template>
+
+  <xsl:template match="icode" mode="inline">
+    <xsl:text>&lt;code&gt;</xsl:text><xsl:call-template name="escape"/>&lt;/code&gt;</xsl:template>
+</xsl:stylesheet>
+""".replace("<!-- code-run -->\n", _CODE_RUN_XSL)
+
+EXTENSIONS_NS = "urn:rdhyee_utils:bike:xslt"
+
+BLOCKS_TO_COMMONMARK_XSL = """\
+<xsl:stylesheet version="1.0"
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:exsl="http://exslt.org/common"
+    xmlns:set="http://exslt.org/sets"
+    xmlns:str="http://exslt.org/strings"
+    xmlns:bike="urn:rdhyee_utils:bike:xslt"
+    exclude-result-prefixes="exsl set str bike">
+  <xsl:output method="text" encoding="UTF-8"/>
+
+  <xsl:template match="/doc">
+    <xsl:call-template name="blocks"/>
+    <xsl:text>&#10;</xsl:text>
+  </xsl:template>
+
+  <!-- the blocks of doc or quote, separated by blank lines. Paragraphs rendering empty are
+       dropped, except at the start of a quote, where they leave an empty line; pandoc puts
+       a comment between a list and a list or code block that would otherwise continue it -->
+  <xsl:template name="blocks">
+    <xsl:param name="quote" select="false()"/>
+    <xsl:variable name="rendered">
+      <xsl:for-each select="*[not(self::code and preceding-sibling::*[1]/self::code)]">
+        <b>
+          <xsl:if test="(self::task or self::unordered or self::code)
+                          and preceding-sibling::*[1]/self::*[self::task or self::unordered]
+                        or (self::ordered or self::code)
+                          and preceding-sibling::*[1]/self::ordered">
+            <xsl:attribute name="comment">1</xsl:attribute>
+          </xsl:if>
+          <xsl:apply-templates select="." mode="block">
+            <xsl:with-param name="first" select="$quote and position() = 1"/>
+          </xsl:apply-templates>
+        </b>
+      </xsl:for-each>
+    </xsl:variable>
+    <xsl:variable name="blocks" select="exsl:node-set($rendered)/b"/>
+    <xsl:variable name="lead" select="$quote and $blocks[1] = ''"/>
+    <xsl:for-each select="$blocks[. != '']">
+      <xsl:if test="position() &gt; 1 or $lead"><xsl:text>&#10;&#10;</xsl:text></xsl:if>
+      <xsl:if test="@comment"><xsl:text>&lt;!-- --&gt;&#10;&#10;</xsl:text></xsl:if>
+      <xsl:value-of select="."/>
+    </xsl:for-each>
+  </xsl:template>
+
+  <xsl:template match="para | plain" mode="block">
+    <xsl:apply-templates mode="inline"/>
+  </xsl:template>
+
+  <xsl:template match="header" mode="block">
+    <xsl:value-of select="str:padding(@level, '#')"/>
+    <xsl:text> </xsl:text>
+    <xsl:apply-templates mode="inline"/>
+  </xsl:template>
+
+  <xsl:template match="plain[@task]" mode="block">
+    <xsl:variable name="text"><xsl:apply-templates mode="inline"/></xsl:variable>
+    <xsl:choose>
+      <xsl:when test="@task = 'true'">&#x2612;</xsl:when>
+      <xsl:otherwise>&#x2610;</xsl:otherwise>
+    </xsl:choose>
+    <xsl:if test="$text != ''"><xsl:text> </xsl:text><xsl:value-of select="$text"/></xsl:if>
+  </xsl:template>
+
+  <!-- indented; the first line of the first block in a quote or list item isn't -->
+  <xsl:template match="code" mode="block">
+    <xsl:param name="first" select="false()"/>
+    <xsl:variable name="text"><xsl:call-template name="code-text"/></xsl:variable>
+    <xsl:if test="$text = '' or starts-with($text, '&#10;')
+                  or substring($text, string-length($text)) = '&#10;'">
+      <xsl:message terminate="yes">code block with empty lines at either end</xsl:message>
+    </xsl:if>
+    <xsl:value-of select="bike:indent(string($text), substring('    ', 1 + 4 * $first), '    ')"/>
+  </xsl:template>
+
+  <!-- in a list item, pandoc starts the rule on a line of its own after an empty one -->
+  <xsl:template match="hr" mode="block">
+    <xsl:if test="parent::task or parent::unordered or parent::ordered">
+      <xsl:text>&#10;&#10;</xsl:text>
+    </xsl:if>
+    <xsl:value-of select="str:padding(72, '-')"/>
+  </xsl:template>
+
+  <xsl:template match="quote" mode="block">
+    <xsl:variable name="blocks">
+      <xsl:call-template name="blocks">
+        <xsl:with-param name="quote" select="true()"/>
+      </xsl:call-template>
+    </xsl:variable>
+    <xsl:value-of select="bike:indent(string($blocks), '&gt; ', '&gt; ')"/>
+  </xsl:template>
+
+  <!-- every block is an item -->
+  <xsl:template match="task | unordered | ordered" mode="block">
+    <xsl:variable name="loose"><xsl:apply-templates select="." mode="loose"/></xsl:variable>
+    <xsl:for-each select="*">
+      <xsl:if test="position() &gt; 1">
+        <xsl:text>&#10;</xsl:text>
+        <xsl:if test="$loose != ''"><xsl:text>&#10;</xsl:text></xsl:if>
+      </xsl:if>
+      <xsl:variable name="marker">
+        <xsl:choose>
+          <xsl:when test="parent::ordered">
+            <xsl:value-of select="position()"/>
+            <xsl:text>.</xsl:text>
+            <!-- padded to at least four characters -->
+            <xsl:value-of select="substring('  ', 1, 1 + (string-length(position()) = 1))"/>
+          </xsl:when>
+          <xsl:otherwise>- </xsl:otherwise>
+        </xsl:choose>
+      </xsl:variable>
+      <xsl:variable name="item">
+        <xsl:apply-templates select="." mode="block">
+          <xsl:with-param name="first" select="true()"/>
+        </xsl:apply-templates>
+      </xsl:variable>
+      <xsl:value-of select="bike:indent(string($item), string($marker),
+                                        str:padding(string-length($marker), ' '))"/>
+    </xsl:for-each>
+  </xsl:template>
+  <!-- non-empty if there's a blank line between the items: some item, or item of a
+       nested list, is more than plain text -->
+  <xsl:template match="task | unordered | ordered" mode="loose">
+    <xsl:choose>
+      <xsl:when test="*[not(self::plain or self::task or self::unordered or self::ordered)]">
+        <xsl:text>1</xsl:text>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:apply-templates select="task | unordered | ordered" mode="loose"/>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+<!-- code-run -->
+  <xsl:template match="str" mode="inline">
+    <xsl:variable name="first" select="not(preceding-sibling::node())
+                                       and (parent::para or parent::plain[not(@task)])"/>
+    <xsl:value-of select="bike:escape(string(.), $first, $first and not(following-sibling::node()))"/>
+  </xsl:template>
+
+  <xsl:template match="strong" mode="inline">
+    <xsl:if test="node()">**<xsl:apply-templates mode="inline"/>**</xsl:if>
+  </xsl:template>
+
+  <xsl:template match="emph" mode="inline">
+    <xsl:if test="node()">*<xsl:apply-templates mode="inline"/>*</xsl:if>
+  </xsl:template>
+
+  <!-- pandoc cancels emphasis that only wraps emphasis -->
+  <xsl:template match="emph[count(node()) = 1 and emph]" mode="inline">
+    <xsl:apply-templates select="emph/node()" mode="inline"/>
+  </xsl:template>
+
+  <xsl:template match="strike" mode="inline">
+    <xsl:if test="node()">&lt;s&gt;<xsl:apply-templates mode="inline"/>&lt;/s&gt;</xsl:if>
+  </xsl:template>
+
+  <xsl:template match="span" mode="inline">
+    <xsl:choose>
+      <xsl:when test="@*">
+        <xsl:text>&lt;span</xsl:text>
+        <xsl:for-each select="@*">
+          <xsl:value-of select="concat(' ', name(), '=&quot;', ., '&quot;')"/>
+        </xsl:for-each>
+        <xsl:text>&gt;</xsl:text><xsl:apply-templates mode="inline"/>&lt;/span&gt;</xsl:when>
+      <xsl:otherwise><xsl:apply-templates mode="inline"/></xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!-- a link whose text is its URL (without mailto:) becomes an autolink, if pandoc takes
+       the URL for one: it must have a known scheme and nothing to escape -->
+  <xsl:template match="link" mode="inline">
+    <xsl:variable name="url">
+      <xsl:choose>
+        <xsl:when test="starts-with(@href, 'mailto:')">
+          <xsl:value-of select="substring(@href, 8)"/>
+        </xsl:when>
+        <xsl:otherwise><xsl:value-of select="@href"/></xsl:otherwise>
+      </xsl:choose>
+    </xsl:variable>
+    <xsl:choose>
+      <xsl:when test="count(node()) = 1 and str = $url and contains(@href, ':')
+                      and translate($url, ' &lt;&gt;|&quot;{}[]^`', '') = $url">
+        <xsl:if test="not(starts-with(@href, 'http://') or starts-with(@href, 'https://')
+                          or starts-with(@href, 'mailto:'))
+                      or translate($url, 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~:/?#@!$&amp;()*+,;=', '') != ''">
+          <xsl:message terminate="yes">link that may or may not be an autolink</xsl:message>
+        </xsl:if>
+        <xsl:value-of select="concat('&lt;', $url, '&gt;')"/>
+      </xsl:when>
+      <xsl:otherwise>[<xsl:apply-templates mode="inline"/>](<xsl:value-of select="@href"/>)</xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <xsl:template match="icode" mode="inline">
+    <xsl:value-of select="bike:code(string(.))"/>
+  </xsl:template>
+</xsl:stylesheet>
+""".replace("<!-- code-run -->\n", _CODE_RUN_XSL)
+
+# pandoc escapes a Str that is an ordered list marker when it starts a paragraph
+_ROMAN = "M*(?:CM)?D?(?:CD)?C*(?:XC)?L?(?:XL)?X*(?:IX)?V?(?:IV)?I*"
+_LIST_MARKER = re.compile(
+    rf"[0-9]{{1,9}}|[a-zA-Z]|{_ROMAN}|{_ROMAN.lower()}|#|@(?:[^\W_]|[_-][^\W_])*"
+)
+_MARKER_ESCAPE = re.compile(r"([.()])")
+_BACKTICKS = re.compile("`+")
+
+
+def _is_list_marker(text: str) -> bool:
+    if text.endswith("."):
+        body = text[:-1]
+        # an uppercase letter with a period starts a list only when followed by two spaces
+        if len(body) == 1 and "A" <= body <= "Z":
+            return False
+    elif text.endswith(")"):
+        body = text[1:-1] if text.startswith("(") else text[:-1]
+    else:
+        return False
+    return body != "" and _LIST_MARKER.fullmatch(body) is not None
+
+
+def _escape(_context, text: str, first: bool, alone: bool) -> str:
+    """
+    a Str as pandoc's CommonMark writer writes it; first: whether it starts a paragraph,
+    alone: whether it's all of it
+    """
+    if "\\" in text or "\n" in text:
+        raise UnsupportedBikeContent("backslash or newline in text")
+    if alone and _is_list_marker(text):
+        return _MARKER_ESCAPE.sub(r"\\\1", text)
+    if first and text in ("-", "+"):
+        return "\\" + text
+    out = []
+    last = len(text) - 1
+    for i, c in enumerate(text):
+        if c in "*`<>]":
+            out.append("\\" + c)
+        elif c == "[":
+            if i and text[i - 1] == "!":
+                out[-1] = "\\!"
+                out.append(c)
+            else:
+                out.append("\\[")
+        elif c == "_":
+            intraword = 0 < i < last and text[i - 1].isalnum() and text[i + 1].isalnum()
+            out.append(c if intraword else "\\_")
+        elif c == "#" and i == 0:
+            out.append("\\#")
+        else:
+            out.append(c)
+    return "".join(out)
+
+
+def _code(_context, text: str) -> str:
+    """inline code, fenced with more backticks than it contains"""
+    if "\n" in text:
+        raise UnsupportedBikeContent("newline in inline code")
+    runs = _BACKTICKS.findall(text)
+    if not runs:
+        return f"`{text}`"
+    fence = "`" * (max(map(len, runs)) + 1)
+    return f"{fence} {text} {fence}"
+
+
+def _indent(_context, text: str, first_prefix: str, prefix: str) -> str:
+    """prefix the lines of text, as pandoc nests blocks; empty lines get no trailing space"""
+    lines = text.split("\n")
+    blank = prefix.rstrip(" ")
+    return "\n".join(
+        [first_prefix + lines[0]]
+        + [prefix + line if line else blank for line in lines[1:]]
+    )
+
+
+_EXTENSIONS = {
+    (EXTENSIONS_NS, "escape"): _escape,
+    (EXTENSIONS_NS, "code"): _code,
+    (EXTENSIONS_NS, "indent"): _indent,
+}
+
+STYLESHEETS = {
+    "blocks": BIKE_TO_BLOCKS_XSL,
+    "html": BLOCKS_TO_HTML_XSL,
+    "commonmark": BLOCKS_TO_COMMONMARK_XSL,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def stylesheet(name: str) -> ET.XSLT:
+    """
+    The compiled stylesheet "blocks", "html" or "commonmark" (compiled once per process).
+    """
+    return ET.XSLT(ET.XML(STYLESHEETS[name].encode("utf-8")), extensions=_EXTENSIONS)
+
+
+def xslt_convert(etree, to: str = "html", only_doc_children: bool = ONLY_DOC_CHILDREN) -> str:
+    """
+    Convert the Bike document etree to `to` ("html" or "commonmark") with the stylesheets,
+    giving what convert_text(etree_to_pandoc_json(etree), to_=to, from_="json") does.
+
+    :raises UnsupportedBikeContent: if the document, format or options are outside what
+        the stylesheets reproduce; convert through pandoc instead
+    """
+    if to not in XSLT_FORMATS:
+        raise UnsupportedBikeContent(f"no stylesheet for {to}")
+    if not only_doc_children:
+        raise UnsupportedBikeContent("only_doc_children=False")
+    if (
+        bikeformat.INLINE_HANDLERS != bikeformat._BUILTIN_INLINE_HANDLERS
+        or bikeformat.INLINE_CONTAINER_TAGS != bikeformat._BUILTIN_INLINE_CONTAINER_TAGS
+    ):
+        raise UnsupportedBikeContent("custom inline tags are registered")
+    try:
+        blocks = stylesheet("blocks")(etree)
+        return str(stylesheet(to)(blocks))
+    except ET.XSLTApplyError as e:
+        raise UnsupportedBikeContent(str(e)) from None
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import pypandoc
+
+
+class ConversionCache:
+    """
+    On-disk, content-addressed cache of pandoc conversions.
+
+    Entries are keyed by a hash of the source bytes, the formats, extra_args, filters
+    and the pandoc version, and evicted least-recently-used first once the cache
+    grows past max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_bytes: int = 256 * 2**20,
+        pandoc_version: Optional[str] = None,
+    ):
+        """
+        :param path: The directory to keep cached conversions in (created if needed).
+        :param max_bytes: The maximum total size of the cached conversions.
+        :param pandoc_version: The pandoc version to key on; defaults to the installed pandoc.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._pandoc_version = pandoc_version
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> size, least recently used first
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        entries = []
+        for f in self.path.glob("*/*"):
+            if f.is_file() and not f.name.startswith("."):
+                stat = f.stat()
+                entries.append((stat.st_mtime, f.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    @property
+    def pandoc_version(self) -> str:
+        if self._pandoc_version is None:
+            self._pandoc_version = pypandoc.get_pandoc_version()
+        return self._pandoc_version
+
+    def key(
+        self,
+        source: Union[str, bytes],
+        to: str,
+        from_: str,
+        extra_args: Iterable[str] = (),
+        filters: Optional[Union[str, Iterable[str]]] = None,
+        encoding: str = "UTF-8",
+        **options,
+    ) -> str:
+        """
+        Return the cache key of a conversion.
+
+        :param source: The text to convert.
+        :param to: The output format.
+        :param from_: The input format.
+        :param extra_args: Extra arguments passed to pandoc.
+        :param filters: Pandoc filters; the contents of filter files are hashed as well.
+        :param encoding: The encoding of source (or used to encode it, if it is a str).
+        :param options: Any other conversion options that affect the output (e.g. sandbox, cworkdir).
+        :return: A hex digest.
+        """
+        if isinstance(source, str):
+            source = source.encode(encoding)
+        if isinstance(filters, str):
+            filters = filters.split()
+
+        filter_hashes = []
+        for f in filters or ():
+            if os.path.isfile(f):
+                filter_hashes.append([f, hashlib.sha256(Path(f).read_bytes()).hexdigest()])
+            else:
+                filter_hashes.append([f, None])
+
+        params = json.dumps(
+            [
+                self.pandoc_version,
+                to,
+                from_,
+                list(extra_args or ()),
+                filter_hashes,
+                sorted((k, str(v)) for k, v in options.items()),
+            ]
+        ).encode("utf-8")
+
+        h = hashlib.sha256()
+        h.update(len(params).to_bytes(8, "big"))
+        h.update(params)
+        h.update(source)
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached conversion for key, or None on a miss.
+        """
+        if key in self._entries:
+            try:
+                value = self._entry_path(key).read_bytes().decode("utf-8")
+            except FileNotFoundError:
+                # removed behind our back (e.g. by another process sharing the cache)
+                self.total_bytes -= self._entries.pop(key)
+            else:
+                self._entries.move_to_end(key)
+                os.utime(self._entry_path(key))
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Store a conversion, evicting the least recently used ones to stay within max_bytes.
+        """
+        data = value.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(exist_ok=True)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=entry_path.parent, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, entry_path)
+
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)
+        self._entries[key] = len(data)
+        self.total_bytes += len(data)
+
+        while self.total_bytes > self.max_bytes:
+            old_key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                self._entry_path(old_key).unlink()
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Remove every cached conversion.
+        """
+        for key in self._entries:
+            try:
+                self._entry_path(key).unlink()
+            except FileNotFoundError:
+                pass
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: hit/miss/eviction counters along with the number and total size of entries.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -0,0 +1,362 @@
+import http.client
+import itertools
+import json
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from rdhyee_utils.pandoc.utils import run_cmd
+
+
+class PandocServerError(RuntimeError):
+    """
+    Raised when a conversion can't be done by a pandoc server.
+    """
+
+
+# command line options `pandoc server` accepts as JSON fields, and how to parse their values
+SERVER_OPTIONS = {
+    "wrap": str,
+    "columns": int,
+    "tab-stop": int,
+    "eol": str,
+    "dpi": int,
+    "toc-depth": int,
+    "shift-heading-level-by": int,
+    "html-math-method": str,
+    "top-level-division": str,
+    "reference-location": str,
+    "identifier-prefix": str,
+    "title-prefix": str,
+    "track-changes": str,
+    "cite-method": str,
+    "highlight-style": str,
+    "default-image-extension": str,
+}
+SERVER_FLAGS = {
+    "--standalone": "standalone",
+    "-s": "standalone",
+    "--toc": "toc",
+    "--table-of-contents": "toc",
+    "--number-sections": "number-sections",
+    "-N": "number-sections",
+    "--section-divs": "section-divs",
+    "--reference-links": "reference-links",
+    "--strip-empty-paragraphs": "strip-empty-paragraphs",
+    "--citeproc": "citeproc",
+    "-C": "citeproc",
+}
+
+
+def server_options(extra_args: Iterable[str] = ()) -> Optional[Dict[str, Union[str, int, bool]]]:
+    """
+    Translate pandoc command line arguments to `pandoc server` JSON options.
+
+    :param extra_args: Arguments as passed to the pandoc command line, e.g. ("--wrap=none",).
+    :return: The options, or None if some argument has no server equivalent.
+    """
+    options = {}
+    for arg in extra_args or ():
+        if arg in SERVER_FLAGS:
+            options[SERVER_FLAGS[arg]] = True
+            continue
+        name, sep, value = arg.partition("=")
+        option = name[2:] if name.startswith("--") else None
+        if not sep or option not in SERVER_OPTIONS:
+            return None
+        try:
+            options[option] = SERVER_OPTIONS[option](value)
+        except ValueError:
+            return None
+    return options
+
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class PandocServer:
+    """
+    A long-lived local `pandoc server` process that converts documents over HTTP.
+    """
+
+    def __init__(
+        self,
+        pandoc_path: str = "pandoc",
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        timeout: int = 30,
+        startup_timeout: float = 10.0,
+        start: bool = True,
+    ):
+        """
+        :param pandoc_path: The pandoc executable.
+        :param host: The interface to serve on.
+        :param port: The port to serve on; a free port is picked if None.
+        :param timeout: Seconds pandoc may spend on one conversion.
+        :param startup_timeout: Seconds to wait for the server to accept requests.
+        :param start: Whether to start the server right away.
+        """
+        self.pandoc_path = pandoc_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.process = None
+        # time.monotonic() of the last failed start
+        self.failed_at = None
+        self._local = threading.local()
+        if start:
+            self.start()
+
+    def __repr__(self):
+        return f"<PandocServer: {self.host}:{self.port}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        """
+        Start the pandoc server process and wait until it answers.
+        """
+        if self.alive:
+            return
+        try:
+            self._start()
+        except PandocServerError:
+            self.failed_at = time.monotonic()
+            self.stop()
+            raise
+        self.failed_at = None
+
+    def _start(self) -> None:
+        if self.port is None:
+            self.port = _free_port(self.host)
+        try:
+            self.process = subprocess.Popen(
+                [self.pandoc_path, "server", f"--port={self.port}", f"--timeout={self.timeout}"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            raise PandocServerError(f"can't start pandoc server: {e}")
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                raise PandocServerError(
+                    f"pandoc server exited with code {self.process.returncode}"
+                )
+            try:
+                self.request("GET", "/version")
+                return
+            except PandocServerError:
+                time.sleep(0.05)
+        raise PandocServerError(f"pandoc server didn't start within {self.startup_timeout}s")
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        # one keep-alive connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout + 5)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None) -> bytes:
+        """
+        Send one request to the server and return the body of a successful response.
+        """
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self._local.conn = None
+            raise PandocServerError(f"pandoc server unavailable: {e}")
+        if response.status != 200:
+            raise PandocServerError(data.decode("utf-8", errors="replace"))
+        return data
+
+    def convert(
+        self,
+        text: str,
+        to: str,
+        from_: str,
+        options: Optional[Dict[str, Union[str, int, bool]]] = None,
+    ) -> str:
+        """
+        Convert text with the server.
+
+        :param text: The document to convert.
+        :param to: The output format.
+        :param from_: The input format.
+        :param options: Extra `pandoc server` options (see server_options).
+        :return: The converted document, ending in a newline like pandoc's command line output.
+        """
+        params = dict(options or {}, text=text, to=to, **{"from": from_})
+        result = json.loads(self.request("POST", "/", json.dumps(params).encode("utf-8")))
+        return self._output(result)
+
+    @staticmethod
+    def _output(result) -> str:
+        if "error" in result:
+            raise PandocServerError(result["error"])
+        if result.get("base64"):
+            raise PandocServerError("binary output formats need an output file")
+        output = result["output"]
+        return output if output.endswith("\n") else output + "\n"
+
+    def convert_batch(self, conversions: List[Dict[str, Union[str, int, bool]]]) -> List[str]:
+        """
+        Convert several documents with one request.
+
+        :param conversions: `pandoc server` parameter objects, each with text, from and to.
+        :return: The converted documents, in order.
+        """
+        results = json.loads(self.request("POST", "/batch", json.dumps(conversions).encode("utf-8")))
+        return [self._output(result) for result in results]
+
+
+class PandocServerPool:
+    """
+    Several pandoc servers used round-robin, restarting any that die.
+
+    Servers that fail to start aren't retried for retry_after seconds; conversions
+    routed to them raise PandocServerError so callers can fall back to a subprocess.
+    """
+
+    def __init__(self, size: int = 2, retry_after: float = 60.0, **server_kwargs):
+        """
+        :param size: The number of pandoc server processes.
+        :param retry_after: Seconds to wait before restarting a server that failed to start.
+        :param server_kwargs: Passed on to each PandocServer (port is picked per server).
+        """
+        server_kwargs.pop("port", None)
+        server_kwargs["start"] = False
+        self.retry_after = retry_after
+        self.servers = [PandocServer(**server_kwargs) for _ in range(size)]
+        for server in self.servers:
+            try:
+                server.start()
+            except PandocServerError:
+                pass
+        self._next = itertools.cycle(range(size))
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.stop()
+
+    def server(self) -> PandocServer:
+        with self._lock:
+            server = self.servers[next(self._next)]
+            if not server.alive:
+                if (
+                    server.failed_at is not None
+                    and time.monotonic() - server.failed_at < self.retry_after
+                ):
+                    raise PandocServerError(f"{server!r} failed to start recently")
+                server.start()
+        return server
+
+    def convert(self, *args, **kwargs) -> str:
+        return self.server().convert(*args, **kwargs)
+
+    def convert_batch(self, *args, **kwargs) -> List[str]:
+        return self.server().convert_batch(*args, **kwargs)
+
+
+def try_server_convert(
+    server: Union[PandocServer, PandocServerPool, None],
+    source: Union[str, bytes],
+    to: str,
+    from_: str,
+    extra_args: Iterable[str] = (),
+    encoding: str = "utf-8",
+) -> Optional[str]:
+    """
+    Convert source with the pandoc server if it can handle the conversion.
+
+    :return: The converted document, or None if the caller should run pandoc itself
+        (no server, arguments the server doesn't understand, or a server failure).
+    """
+    if server is None:
+        return None
+    options = server_options(extra_args)
+    if options is None:
+        return None
+    if isinstance(source, bytes):
+        source = source.decode(encoding)
+    try:
+        return server.convert(source, to, from_, options)
+    except PandocServerError:
+        return None
+
+
+def convert_text(
+    source: Union[str, bytes],
+    to: str,
+    from_: str = "markdown",
+    extra_args: Iterable[str] = (),
+    server: Union[PandocServer, PandocServerPool, None] = None,
+    pandoc_path: str = "pandoc",
+    encoding: str = "utf-8",
+) -> str:
+    """
+    Convert source with the pandoc server when possible, otherwise with a pandoc subprocess.
+
+    :param source: The document to convert.
+    :param to: The output format.
+    :param from_: The input format.
+    :param extra_args: Extra pandoc command line arguments.
+    :param server: A PandocServer or PandocServerPool to try first.
+    :param pandoc_path: The pandoc executable used for the subprocess fallback.
+    :param encoding: The encoding of source if it is bytes.
+    :return: The converted document.
+    """
+    output = try_server_convert(server, source, to, from_, extra_args, encoding)
+    if output is not None:
+        return output
+
+    if isinstance(source, str):
+        source = source.encode(encoding)
+    r = run_cmd(
+        [pandoc_path, f"--from={from_}", f"--to={to}", *extra_args],
+        shell=False,
+        input=source,
+    )
+    if r.returncode != 0:
+        raise RuntimeError(f"pandoc failed: {r.stderr.decode('utf-8', errors='replace')}")
+    return r.stdout.decode("utf-8")
@@ -1,19 +1,23 @@
 import subprocess
 from pathlib import Path
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Union
 
 
 def run_cmd(
-    cmd: str, shell: bool = True, cwd: Optional[Path] = None
+    cmd: Union[str, List[str]],
+    shell: bool = True,
+    cwd: Optional[Path] = None,
+    input: Optional[bytes] = None,
 ) -> subprocess.CompletedProcess:
     """
     Run a shell command and return the result.
-    :param cmd: The shell command to run.
+    :param cmd: The shell command to run (or an argument list, with shell=False).
     :param shell: Whether to use shell=True for subprocess.
     :param cwd: The current working directory for the command.
+    :param input: Bytes to send to the command's stdin.
     :return: subprocess.CompletedProcess object.
     """
-    return subprocess.run(cmd, shell=shell, capture_output=True, cwd=cwd)
+    return subprocess.run(cmd, shell=shell, capture_output=True, cwd=cwd, input=input)
 
 
 def pandoc_formats() -> Dict[str, Set[str]]:
@@ -25,5 +25,7 @@ Some simple methods and classes Raymond Yee developed for his own work.""",
     ],
     entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      bike-convert = rdhyee_utils.bike.batch:main
       """,
 )
@@ -0,0 +1,11 @@
+"""
+paths of the sample outlines the bike tests share
+"""
+from pathlib import Path as P
+
+DATA_DIR = P(__file__).parent / "data"
+# rows of every data-type, top-level list rows included
+SAMPLE_PATH = DATA_DIR / "sample.bike"
+# the same rows with the top-level lists under a heading, so that it also converts with
+# only_doc_children=True
+OUTLINE_PATH = DATA_DIR / "outline.bike"
@@ -0,0 +1,50 @@
+"""
+fixtures shared by the bike tests
+"""
+import shutil
+
+import lxml.etree as ET
+import pypandoc
+import pytest
+
+from bike_samples import OUTLINE_PATH, SAMPLE_PATH
+
+
+def _have_pandoc() -> bool:
+    try:
+        pypandoc.get_pandoc_version()
+        return True
+    except OSError:
+        return False
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "requires_pandoc: skip the test when pandoc is missing")
+
+
+def pytest_collection_modifyitems(config, items):
+    marked = [item for item in items if item.get_closest_marker("requires_pandoc")]
+    if marked and not _have_pandoc():
+        skip = pytest.mark.skip(reason="pandoc not installed")
+        for item in marked:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def sample_etree():
+    return ET.parse(str(SAMPLE_PATH), ET.XMLParser(remove_blank_text=True)).getroot()
+
+
+@pytest.fixture
+def outline_etree():
+    return ET.parse(str(OUTLINE_PATH), ET.XMLParser(remove_blank_text=True)).getroot()
+
+
+@pytest.fixture
+def src_dir(tmp_path):
+    """a directory with two copies of outline.bike: a.bike and nested/b.bike"""
+    src = tmp_path / "src"
+    (src / "nested").mkdir(parents=True)
+    shutil.copy(OUTLINE_PATH, src / "a.bike")
+    shutil.copy(OUTLINE_PATH, src / "nested" / "b.bike")
+    return src
@@ -0,0 +1,295 @@
+"""
+A stand-in for appscript (and applescript) scripting Bike, for tests on any platform.
+
+FakeBike holds outlines loaded from .bike files and counts the Apple Events sent to it.
+As with appscript, building a reference (doc.rows, row.rows[0], doc.rows[its.id == x])
+sends nothing; calling one (ref(), ref.get(), ref.set(...), ref.move(to=...)) is one event.
+"""
+from pathlib import Path as P
+from typing import Callable, List, Optional, Tuple, Union
+
+from rdhyee_utils.bike.bikeformat import LI, NS, P_TAG, UL, load_bike, text_content
+
+
+class Keyword(object):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"k.{self.name}"
+
+    def __eq__(self, other):
+        return isinstance(other, Keyword) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class _Keywords(object):
+    def __getattr__(self, name):
+        return Keyword(name)
+
+
+k = _Keywords()
+
+
+class _ItsProperty(object):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, value):
+        return lambda row: _property(row, self.name) == value
+
+
+class _Its(object):
+    def __getattr__(self, name):
+        return _ItsProperty(name)
+
+
+its = _Its()
+
+
+class AppleScript(object):
+    """applescript.AppleScript, compiling nothing"""
+
+    def __init__(self, source: str = ""):
+        self.source = source
+
+
+class Row(object):
+    """a row of a fake outline; the root row has no parent"""
+
+    def __init__(self, id_: str, name: str = "", data_type: str = "body", parent=None):
+        self.id = id_
+        self.name = name
+        self.data_type = data_type
+        self.parent = parent
+        self.children: List["Row"] = []
+
+    def __repr__(self):
+        return f"<Row: {self.id}>"
+
+    @property
+    def level(self) -> int:
+        return 0 if self.parent is None else self.parent.level + 1
+
+    def descendants(self):
+        for child in self.children:
+            yield child
+            yield from child.descendants()
+
+
+def _property(row: Row, name: str):
+    if name == "type":
+        return Keyword(row.data_type)
+    if name == "text_content":
+        return row.name
+    return getattr(row, name)
+
+
+def _rows_from_ul(ul, parent: Row) -> None:
+    for li in ul.iterchildren(LI):
+        p = li.find(P_TAG)
+        row = Row(
+            li.get("id"),
+            "" if p is None else text_content(p, include_tail=False),
+            li.get("data-type", "body"),
+            parent,
+        )
+        parent.children.append(row)
+        child_ul = li.find(UL)
+        if child_ul is not None:
+            _rows_from_ul(child_ul, row)
+
+
+class _Location(object):
+    """an insertion location: resolves to (parent row, index among its children)"""
+
+    def __init__(self, resolve: Callable[[], Tuple[Row, int]]):
+        self._resolve = resolve
+
+
+class _Reference(object):
+    def __init__(self, bike: "FakeBike"):
+        self.bike = bike
+
+    def _event(self):
+        self.bike.events += 1
+
+
+class PropertyReference(_Reference):
+    def __init__(self, bike, get: Callable, set_: Optional[Callable] = None):
+        super().__init__(bike)
+        self._get = get
+        self._set = set_
+
+    def __call__(self):
+        self._event()
+        return self._get()
+
+    get = __call__
+
+    def set(self, value):
+        if self._set is None:
+            raise AttributeError("read-only property")
+        self._event()
+        self._set(value)
+
+
+class RowReference(_Reference):
+    """a row, resolved when an event is sent (by index references can change meaning)"""
+
+    def __init__(self, bike, resolve: Callable[[], Row]):
+        super().__init__(bike)
+        self._resolve = resolve
+
+    def __repr__(self):
+        return f"<RowReference: {self._resolve()!r}>"
+
+    def __call__(self):
+        self._event()
+        return self.bike._row_reference(self._resolve())
+
+    get = __call__
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def set_(value):
+            self._resolve().name = value
+
+        settable = name in ("name", "text_content")
+        return PropertyReference(
+            self.bike, lambda: _property(self._resolve(), name), set_ if settable else None
+        )
+
+    @property
+    def rows(self) -> "RowsReference":
+        return RowsReference(self.bike, lambda: self._resolve().children, self._resolve)
+
+    def _position(self, offset: int) -> Tuple[Row, int]:
+        row = self._resolve()
+        return row.parent, row.parent.children.index(row) + offset
+
+    @property
+    def before(self) -> _Location:
+        return _Location(lambda: self._position(0))
+
+    @property
+    def after(self) -> _Location:
+        return _Location(lambda: self._position(1))
+
+    def move(self, direct: Optional["RowReference"] = None, to: _Location = None):
+        """move this row (or the direct parameter, as in row.move(other, to=...)) to `to`"""
+        self._event()
+        row = (direct or self)._resolve()
+        row.parent.children.remove(row)
+        parent, index = to._resolve()
+        parent.children.insert(index, row)
+        row.parent = parent
+
+
+class RowsReference(_Reference):
+    """a collection of rows, e.g. doc.rows or row.rows[its.id == x]"""
+
+    def __init__(
+        self,
+        bike,
+        resolve: Callable[[], List[Row]],
+        parent: Optional[Callable[[], Row]] = None,
+    ):
+        super().__init__(bike)
+        self._resolve = resolve
+        self._parent = parent
+
+    def __call__(self):
+        self._event()
+        return [self.bike._row_reference(row) for row in self._resolve()]
+
+    get = __call__
+
+    def __getitem__(self, key):
+        if callable(key):
+            return RowsReference(self.bike, lambda: [r for r in self._resolve() if key(r)])
+        # 1-based, as in appscript; negative indexes count from the end
+        index = key - 1 if key > 0 else key
+        return RowReference(self.bike, lambda: self._resolve()[index])
+
+    def ID(self, id_: str) -> RowReference:
+        return RowReference(self.bike, lambda: next(r for r in self._resolve() if r.id == id_))
+
+    @property
+    def beginning(self) -> _Location:
+        return _Location(lambda: (self._parent(), 0))
+
+    @property
+    def end(self) -> _Location:
+        return _Location(lambda: (self._parent(), len(self._parent().children)))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return PropertyReference(
+            self.bike, lambda: [_property(row, name) for row in self._resolve()]
+        )
+
+
+class DocumentReference(_Reference):
+    def __init__(self, bike, name: str, root: Row):
+        super().__init__(bike)
+        self._name = name
+        self._root = root
+
+    def __repr__(self):
+        return f"<DocumentReference: {self._name}>"
+
+    @property
+    def name(self):
+        return PropertyReference(self.bike, lambda: self._name)
+
+    @property
+    def id(self):
+        return PropertyReference(self.bike, lambda: self._root.id)
+
+    @property
+    def root_row(self):
+        return PropertyReference(self.bike, lambda: self.bike._row_reference(self._root))
+
+    @property
+    def rows(self) -> RowsReference:
+        """every row of the document (but the root row), in document order"""
+        return RowsReference(self.bike, lambda: list(self._root.descendants()), lambda: self._root)
+
+
+class FakeBike(object):
+    """
+    The application object: use as rdhyee_utils.bike.app, e.g.
+    monkeypatch.setattr(rdhyee_utils.bike, "app", lambda name: fake_bike)
+    """
+
+    def __init__(self):
+        self.events = 0
+        self._documents: List[DocumentReference] = []
+
+    def _row_reference(self, row: Row) -> RowReference:
+        # like appscript's "row id ... of document ...": stable while rows move
+        return RowReference(self, lambda: row)
+
+    def load(self, path: Union[str, P]) -> DocumentReference:
+        """open a .bike file as a fake document (not an event)"""
+        path = P(path)
+        ul = load_bike(path).find(f"{NS}body/{UL}")
+        root = Row(ul.get("id"))
+        _rows_from_ul(ul, root)
+        doc = DocumentReference(self, path.name, root)
+        self._documents.append(doc)
+        return doc
+
+    @property
+    def name(self):
+        return PropertyReference(self, lambda: "Bike")
+
+    @property
+    def documents(self):
+        return PropertyReference(self, lambda: list(self._documents))
@@ -0,0 +1,118 @@
+"""
+test_bike_events.py
+
+BikeDocument and BikeRow against fake_appscript, counting Apple Events.
+"""
+import random
+
+import pytest
+
+import rdhyee_utils.bike
+from rdhyee_utils.bike import Bike, BikeDocument, RowSnapshot, _sorting_moves
+from rdhyee_utils.bike.bikeformat import LI, load_bike
+
+import fake_appscript
+from fake_appscript import FakeBike
+
+from bike_samples import OUTLINE_PATH
+
+
+@pytest.fixture
+def fake_bike(monkeypatch):
+    fake = FakeBike()
+    monkeypatch.setattr(rdhyee_utils.bike, "app", lambda app_name: fake)
+    monkeypatch.setattr(rdhyee_utils.bike, "applescript", fake_appscript)
+    return fake
+
+
+@pytest.fixture
+def doc(fake_bike):
+    return BikeDocument(Bike(), fake_bike.load(OUTLINE_PATH))
+
+
+def test_fake_bike(fake_bike, doc):
+    assert Bike().name == "Bike"
+    assert doc.name == "outline.bike"
+    assert fake_bike.events == 2
+    rows = doc.root_row.rows
+    assert [r.id for r in rows] == ["Kp", "h3", "b2"]
+    assert rows[0].level == 1
+    assert rows[0].rows[0].name == "Plain body with bold and emphasis text"
+
+
+def test_row_snapshot(fake_bike, doc):
+    etree = load_bike(OUTLINE_PATH)
+    expected_ids = [li.get("id") for li in etree.iter(LI)]
+
+    snapshot = doc.row_snapshot()
+    assert fake_bike.events == 4
+    assert [row.id for row in snapshot] == expected_ids
+    assert snapshot[0] == RowSnapshot("Kp", "Projects", 1, "heading")
+    assert snapshot[expected_ids.index("t3")].level == 3
+    assert snapshot[expected_ids.index("a1")].data_type == "body"
+
+    # the same properties row by row: one event per property and row
+    fake_bike.events = 0
+    by_row = [RowSnapshot(r.id, r.name, r.level, "") for r in doc.rows]
+    assert fake_bike.events == 1 + 3 * len(by_row)
+    assert [r[:3] for r in by_row] == [r[:3] for r in snapshot]
+
+
+def test_child_row_snapshot(fake_bike, doc):
+    root_row = doc.root_row
+    fake_bike.events = 0
+    assert [(r.id, r.data_type) for r in root_row.row_snapshot()] == [
+        ("Kp", "heading"),
+        ("h3", "heading"),
+        ("b2", "body"),
+    ]
+    assert fake_bike.events == 4
+
+
+def longest_increasing(values):
+    best = []
+    for i, v in enumerate(values):
+        best.append(1 + max([best[j] for j in range(i) if values[j] < v], default=0))
+    return max(best, default=0)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_sorting_moves(seed):
+    rng = random.Random(seed)
+    current = [f"r{i}" for i in range(rng.randint(0, 30))]
+    target = rng.sample(current, len(current))
+
+    moves = _sorting_moves(current, target)
+    order = list(current)
+    for id_, before in moves:
+        order.remove(id_)
+        order.insert(len(order) if before is None else order.index(before), id_)
+    assert order == target
+    ranks = [target.index(id_) for id_ in current]
+    assert len(moves) == len(current) - longest_increasing(ranks)
+
+
+def test_sort_rows(fake_bike, doc):
+    notes = doc.root_row.rows[0].rows[-1]
+    names = [r.name for r in notes.row_snapshot()]
+
+    fake_bike.events = 0
+    doc.sort_rows(notes)
+    assert [r.name for r in notes.row_snapshot()] == sorted(names)
+    moves = fake_bike.events - 8
+    assert moves == len(_sorting_moves(names, sorted(names)))
+    assert 0 < moves < len(names)
+
+    # already sorted: only the snapshot
+    fake_bike.events = 0
+    doc.sort_rows(notes)
+    assert fake_bike.events == 4
+
+    doc.sort_rows(doc.root_row, row_func=lambda r: r.id, reverse=True)
+    assert [r.id for r in doc.root_row.row_snapshot()] == ["h3", "b2", "Kp"]
+    # children move with their parent
+    assert [r.id for r in doc.root_row.rows[2].rows][:2] == ["a1", "t1"]
+
+    # row_func still gets rows, with what BikeRow has besides the snapshot
+    doc.sort_rows(doc.root_row, row_func=lambda r: (len(r.rows), r.text_content))
+    assert [r.id for r in doc.root_row.row_snapshot()] == ["b2", "h3", "Kp"]
@@ -0,0 +1,504 @@
+"""
+test_bikeformat.py
+"""
+import functools
+import io
+
+import lxml.etree as ET
+import panflute as pf
+import pytest
+
+from rdhyee_utils.bike.bikeformat import (
+    NS,
+    ID_CHARS,
+    IdAllocator,
+    RowChange,
+    OutlineIndex,
+    namespaces,
+    diff_bike_files,
+    diff_outlines,
+    etree_to_panflute,
+    generate_unique_id_attribute,
+    ids,
+    innerhtml,
+    panflute_to_bike_etree,
+    get_task_list_items,
+    iter_panflute_rows,
+    iter_rows,
+    iter_task_rows,
+    bike_parser,
+    load_bike,
+    query,
+    rich_text,
+    text_content,
+    write_bike_rows,
+    write_panflute_as_bike,
+)
+
+from bike_samples import OUTLINE_PATH, SAMPLE_PATH
+
+
+def deep_etree(depth):
+    """a chain of `depth` nested rows (built directly: libxml2 won't parse documents this deep)"""
+    html = ET.Element(f"{NS}html", nsmap={None: namespaces["ns"]})
+    ET.SubElement(html, f"{NS}head")
+    ul = ET.SubElement(ET.SubElement(html, f"{NS}body"), f"{NS}ul", id="root")
+    for i in range(depth):
+        li = ET.SubElement(ul, f"{NS}li", id=f"r{i}")
+        p = ET.SubElement(li, f"{NS}p")
+        p.text = "row "
+        ET.SubElement(p, f"{NS}em").text = str(i)
+        ul = ET.SubElement(li, f"{NS}ul")
+    return html
+
+
+def test_iter_rows_matches_tree(sample_etree):
+    lis = sample_etree.xpath("//ns:li", namespaces=namespaces)
+    rows = [
+        (r.id, r.level, r.data_type, r.data_done, text_content(r.p))
+        for r in iter_rows(SAMPLE_PATH)
+    ]
+    expected = [
+        (
+            li.attrib.get("id"),
+            len(li.xpath("ancestor::ns:li", namespaces=namespaces)) + 1,
+            li.attrib.get("data-type", "body"),
+            li.attrib.get("data-done"),
+            text_content(li.find("ns:p", namespaces=namespaces)),
+        )
+        for li in lis
+    ]
+    assert rows == expected
+
+
+def test_iter_rows_file_object():
+    with open(SAMPLE_PATH, "rb") as f:
+        from_file = [r.id for r in iter_rows(f)]
+    from_bytes = [r.id for r in iter_rows(io.BytesIO(SAMPLE_PATH.read_bytes()))]
+    assert from_file == from_bytes
+    assert from_file[0] == "Kp"
+
+
+def test_iter_rows_clears_processed_rows():
+    seen = []
+    for row in iter_rows(SAMPLE_PATH):
+        seen.append(row.p)
+    assert all(len(p) == 0 and not p.text for p in seen)
+
+
+def test_iter_task_rows(sample_etree):
+    assert [r.id for r in iter_task_rows(SAMPLE_PATH)] == [
+        li.attrib["id"] for li in get_task_list_items(sample_etree)
+    ]
+    assert [r.id for r in iter_task_rows(SAMPLE_PATH, done=True)] == ["t1"]
+    assert [r.id for r in iter_task_rows(SAMPLE_PATH, done=False)] == ["t2", "t3"]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1000, 1 << 20])
+def test_load_bike(outline_etree, tmp_path, chunk_size):
+    expected = ET.tostring(outline_etree)
+    assert ET.tostring(load_bike(OUTLINE_PATH, chunk_size)) == expected
+
+    broken = tmp_path / "broken.bike"
+    for content in (b"", OUTLINE_PATH.read_bytes()[:-200], b"<html><p>x</html>"):
+        broken.write_bytes(content)
+        with pytest.raises(ET.XMLSyntaxError):
+            load_bike(broken, chunk_size)
+        # the shared parser is fine for the next file
+        assert ET.tostring(load_bike(OUTLINE_PATH, chunk_size)) == expected
+    assert bike_parser() is bike_parser()
+
+
+def test_query(outline_etree):
+    from lxml.html import fromstring
+
+    html = fromstring(OUTLINE_PATH.read_bytes())
+    for tree in (outline_etree, html):
+        row_ids = lambda name, **kw: [li.get("id") for li in query(tree, name, **kw)]  # noqa: E731
+        assert row_ids("done_task_rows") == ["t1"]
+        assert row_ids("open_task_rows") == ["t2", "t3"]
+        assert row_ids("rows_of_type", data_type="code") == ["c1", "c2"]
+        assert row_ids("rows_of_type", data_type="body") == [
+            li.get("id") for li in query(tree, "rows") if li.get("data-type") is None
+        ]
+        assert row_ids("row_by_id", id="t3") == ["t3"]
+        assert row_ids("top_level_rows") == ["Kp", "h3", "b2"]
+    assert query(html, "ids") == ids(outline_etree)
+    assert ids(outline_etree)[0] == outline_etree.find(f"{NS}body/{NS}ul").get("id")
+
+
+@pytest.mark.parametrize("only_doc_children", [True, False])
+def test_engines_agree(outline_etree, only_doc_children):
+    recursive = etree_to_panflute(
+        outline_etree, only_doc_children=only_doc_children, engine="recursive"
+    )
+    iterative = etree_to_panflute(
+        outline_etree, only_doc_children=only_doc_children, engine="iterative"
+    )
+    assert iterative.to_json() == recursive.to_json()
+
+
+def test_engines_agree_on_top_level_lists(sample_etree):
+    # sample.bike has list rows at the top level
+    recursive = etree_to_panflute(sample_etree, only_doc_children=False, engine="recursive")
+    iterative = etree_to_panflute(sample_etree, only_doc_children=False, engine="iterative")
+    assert iterative.to_json() == recursive.to_json()
+
+
+@pytest.mark.xfail(
+    raises=TypeError, strict=True, reason="top-level list rows end up as ListItems in the Doc"
+)
+@pytest.mark.parametrize("engine", ["recursive", "iterative"])
+def test_top_level_lists_as_doc_children(sample_etree, engine):
+    etree_to_panflute(sample_etree, only_doc_children=True, engine=engine)
+
+
+def test_iterative_engine_deep_outline():
+    depth = 3000
+    pfd = etree_to_panflute(deep_etree(depth), engine="iterative")
+    assert len(pfd.content) == depth
+    with pytest.raises(RecursionError):
+        etree_to_panflute(deep_etree(depth), engine="recursive")
+
+
+def test_unknown_engine(outline_etree):
+    with pytest.raises(ValueError):
+        etree_to_panflute(outline_etree, engine="bogus")
+
+
+def test_text_content_and_rich_text_deep_markup():
+    depth = 5000
+    p = e = ET.Element(f"{NS}p")
+    for _ in range(depth):
+        e = ET.SubElement(e, f"{NS}em")
+        e.text, e.tail = "a", "b"
+    assert text_content(p) == "a" * depth + "b" * depth
+    (emph,) = rich_text(p)
+    assert emph.tag == "Emph"
+
+
+def test_text_content_strip():
+    e = ET.fromstring(f'<p xmlns="{namespaces["ns"]}">  a <em> b </em> c  </p>')
+    e.tail = "  tail "
+    assert text_content(e) == "  a  b  c    tail "
+    assert text_content(e, strip=True) == "a b  c  tail"
+    assert text_content(e, include_tail=False, strip=True) == "a b  c  "
+    assert text_content(e.find(f"{NS}em")) == " b  c  "
+
+
+def reference_text_content(element, include_tail=True, strip=False):
+    """the original recursive text_content, which the fast version must reproduce exactly"""
+    parts = []
+    if element.text:
+        parts.append(element.text.strip() if strip else element.text)
+    for child in element:
+        parts.append(reference_text_content(child))
+    if include_tail and element.tail is not None:
+        parts.append(element.tail.strip() if strip else element.tail)
+    return "".join(parts)
+
+
+@pytest.mark.parametrize(
+    "markup",
+    [
+        "<p></p>",
+        "<p>  </p>",
+        "<p> a <b/> <i></i>c </p>",
+        "<p> a <!-- note -->b<?pi data?> c <em> d <code>e</code></em> </p>",
+        "<p><!--only--></p>",
+        "<p><a href='x'> link </a> t <span class='c'>s<strong> n </strong></span></p>",
+    ],
+)
+def test_text_content_matches_reference(markup, outline_etree):
+    root = ET.fromstring(f'<ul xmlns="{namespaces["ns"]}">{markup}  tail </ul>')
+    for e in list(root.iter()) + list(outline_etree.iter()):
+        for include_tail in (True, False):
+            for strip in (True, False):
+                assert text_content(e, include_tail, strip) == reference_text_content(
+                    e, include_tail, strip
+                )
+
+
+def test_innerhtml():
+    p = ET.fromstring(
+        f'<p xmlns="{namespaces["ns"]}" xmlns:x="urn:x" title="a&gt;b">'
+        "a &lt; <strong>b</strong>t<x:y>c</x:y>d<br/></p>"
+    )
+    p.tail = "tail"
+    markup = innerhtml(p)
+    # each child as serialized on its own, tails once
+    assert markup == "a &lt; " + "t".join(
+        ET.tostring(e, encoding="unicode", with_tail=False) for e in p[:2]
+    ) + "d" + ET.tostring(p[2], encoding="unicode", with_tail=False)
+    assert f'<strong xmlns="{namespaces["ns"]}"' in markup
+    # and the result parses
+    wrapped = ET.fromstring(f"<wrap>{markup}</wrap>")
+    assert [e.tag for e in wrapped] == [f"{NS}strong", "{urn:x}y", f"{NS}br"]
+    assert "".join(wrapped.itertext()) == "a < btcd"
+
+    assert innerhtml(ET.fromstring("<p>a<em>b</em>c<em>d</em>e</p>")) == "a<em>b</em>c<em>d</em>e"
+    assert innerhtml(ET.fromstring("<p/>")) == ""
+    assert innerhtml(ET.fromstring("<p></p>")) == ""
+
+
+def test_convert_text_cache(tmp_path, monkeypatch):
+    import pypandoc
+    from rdhyee_utils.bike import bikeformat
+    from rdhyee_utils.pandoc.cache import ConversionCache
+
+    calls = []
+
+    def fake_convert_text(source, **kwargs):
+        calls.append(source)
+        return f"<p>{source}</p>"
+
+    monkeypatch.setattr(pypandoc, "convert_text", fake_convert_text)
+    cache = ConversionCache(tmp_path, pandoc_version="3.1")
+
+    assert bikeformat.convert_text("a", to_="html", cache=cache) == "<p>a</p>"
+    assert bikeformat.convert_text("a", to_="html", cache=cache) == "<p>a</p>"
+    assert bikeformat.convert_text("b", to_="html", cache=cache) == "<p>b</p>"
+    assert bikeformat.convert_text("a", to_="html") == "<p>a</p>"
+    assert calls == ["a", "b", "a"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_convert_text_server(monkeypatch):
+    import pypandoc
+    from rdhyee_utils.bike import bikeformat
+    from rdhyee_utils.pandoc.server import PandocServerError
+
+    monkeypatch.setattr(pypandoc, "convert_text", lambda source, **kwargs: "subprocess\n")
+
+    class Server:
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.calls = []
+
+        def convert(self, text, to, from_, options=None):
+            self.calls.append((text, to, from_, options))
+            if self.fail:
+                raise PandocServerError("unavailable")
+            return "server\n"
+
+    server = Server()
+    convert = functools.partial(bikeformat.convert_text, "a", to_="html", sandbox=True)
+    assert convert(server=server) == "server\n"
+    assert server.calls == [("a", "html", "markdown", {"wrap": "none"})]
+    assert convert(server=server, filters=["f"]) == "subprocess\n"
+    assert convert(server=Server(fail=True)) == "subprocess\n"
+    # the server can't run unsandboxed or in another working directory
+    assert convert(server=server, sandbox=False) == "subprocess\n"
+    assert convert(server=server, cworkdir="/tmp") == "subprocess\n"
+    assert len(server.calls) == 1
+
+
+def test_id_allocator_unique_and_reproducible(outline_etree):
+    allocator = IdAllocator.from_etree(outline_etree, seed=1)
+    existing = set(ids(outline_etree))
+    assert len(allocator) == len(existing)
+
+    new_ids = [allocator.allocate() for _ in range(10_000)]
+    assert len(set(new_ids)) == len(new_ids)
+    assert not existing & set(new_ids)
+    assert all(len(i) == 8 and i[0].isalpha() and set(i) <= set(ID_CHARS) for i in new_ids)
+
+    again = IdAllocator.from_etree(outline_etree, seed=1)
+    assert [again.allocate() for _ in range(10_000)] == new_ids
+
+
+def test_id_allocator_grows_under_collisions():
+    allocator = IdAllocator(length=1, seed=0)
+    new_ids = [allocator.allocate() for _ in range(200)]
+    assert len(set(new_ids)) == 200
+    assert allocator.length > 1
+
+    with pytest.raises(ValueError):
+        allocator.add(new_ids[0])
+    assert allocator.add("fresh") == "fresh" and "fresh" in allocator
+
+
+def test_generate_unique_id_attribute_gives_up_loudly():
+    every_one_char_id = set(ID_CHARS)
+    with pytest.raises(ValueError):
+        generate_unique_id_attribute(1, every_one_char_id, max_tries=5)
+
+
+def test_panflute_to_bike_etree_uses_allocator():
+    allocator = IdAllocator(seed=3)
+    etree = panflute_to_bike_etree(pf.Doc(pf.Para(pf.Str("a"))), id_allocator=allocator)
+    assert sorted(ids(etree)) == sorted(allocator.ids)
+
+
+def reverse_sample_doc():
+    return pf.Doc(
+        pf.Header(pf.Str("Top"), level=1),
+        pf.Para(pf.Str("plain"), pf.Space, pf.Strong(pf.Str("bold")), pf.Str("!")),
+        pf.BulletList(
+            pf.ListItem(pf.Plain(pf.Str("\u2612"), pf.Space, pf.Str("done"))),
+            pf.ListItem(
+                pf.Plain(pf.Str("\u2610"), pf.Space, pf.Str("todo")),
+                pf.BulletList(pf.ListItem(pf.Plain(pf.Str("sub")))),
+            ),
+        ),
+        pf.Header(pf.Str("Second"), level=2),
+        pf.BlockQuote(pf.Para(pf.Str("q1")), pf.Para(pf.Str("q2"))),
+        pf.CodeBlock("line 1\nline 2"),
+        pf.HorizontalRule(),
+        pf.Para(pf.Str("see"), pf.Note(pf.Para(pf.Str("footnote")))),
+        pf.Header(pf.Str("Back"), level=1),
+        pf.OrderedList(pf.ListItem(pf.Plain(pf.Link(pf.Str("one"), url="http://x")))),
+    )
+
+
+def test_iter_panflute_rows():
+    rows = list(iter_panflute_rows(reverse_sample_doc(), done_timestamp="2024-01-01T00:00:00Z"))
+    assert [(r.level, r.data_type, r.data_done, text_content(r.p)) for r in rows] == [
+        (1, "heading", None, "Top"),
+        (2, "body", None, "plain bold!"),
+        (2, "task", "2024-01-01T00:00:00Z", "done"),
+        (2, "task", None, "todo"),
+        (3, "unordered", None, "sub"),
+        (2, "heading", None, "Second"),
+        (3, "quote", None, "q1"),
+        (3, "quote", None, "q2"),
+        (3, "code", None, "line 1"),
+        (3, "code", None, "line 2"),
+        (3, "hr", None, ""),
+        (3, "body", None, "see"),
+        (4, "note", None, "footnote"),
+        (1, "heading", None, "Back"),
+        (2, "ordered", None, "one"),
+    ]
+    p = rows[1].p
+    assert (p.text, [(e.tag, e.text, e.tail) for e in p]) == ("plain ", [(f"{NS}strong", "bold", "!")])
+    assert rows[-1].p[0].get("href") == "http://x"
+
+
+def test_panflute_to_bike_round_trip():
+    doc = reverse_sample_doc()
+    etree = panflute_to_bike_etree(doc, id_allocator=IdAllocator(seed=1))
+    assert etree.tag == f"{NS}html"
+    assert len(set(ids(etree))) == len(ids(etree)) == 16
+
+    back = etree_to_panflute(etree)
+    headers = [(h.level, pf.stringify(h)) for h in back.content if isinstance(h, pf.Header)]
+    assert headers == [(1, "Top"), (2, "Second"), (1, "Back")]
+    code_blocks = [b.text for b in back.content if isinstance(b, pf.CodeBlock)]
+    assert code_blocks == ["line 1\nline 2"]
+
+
+def test_write_panflute_as_bike_streams_namespaced_xhtml(tmp_path):
+    out = io.BytesIO()
+    write_panflute_as_bike(reverse_sample_doc(), out, IdAllocator(seed=1), "2024-01-01T00:00:00Z")
+    data = out.getvalue()
+    # namespace declared once, on the root
+    assert data.count(b"xmlns=") == 1
+    assert ET.fromstring(data).tag == f"{NS}html"
+
+    path = tmp_path / "out.bike"
+    write_panflute_as_bike(reverse_sample_doc(), path, IdAllocator(seed=1), "2024-01-01T00:00:00Z")
+    assert path.read_bytes() == data
+
+
+def test_write_bike_rows_copies_iter_rows(outline_etree):
+    out = io.BytesIO()
+    write_bike_rows(iter_rows(OUTLINE_PATH), out)
+    copy = ET.fromstring(out.getvalue())
+    li_ids = lambda e: [li.get("id") for li in e.iter(f"{NS}li")]  # noqa: E731
+    assert li_ids(copy) == li_ids(outline_etree)
+    assert [text_content(p) for p in copy.iter(f"{NS}p")] == [
+        text_content(p) for p in outline_etree.iter(f"{NS}p")
+    ]
+
+
+def test_outline_index(outline_etree):
+    index = OutlineIndex(outline_etree)
+    rows = list(outline_etree.iter(f"{NS}li"))
+    assert index.rows == rows
+    assert index.ids == [li.get("id") for li in rows]
+    assert len(index) == len(rows) and "t3" in index and "nope" not in index
+
+    assert index.row("t3").get("id") == "t3"
+    assert index.level("Kp") == 1 and index.level("t3") == 3
+    assert index.parent("t3").get("id") == "t2"
+    assert index.parent("Kp") is None
+    assert [li.get("id") for li in index.children()] == ["Kp", "h3", "b2"]
+    assert [li.get("id") for li in index.children("h3")] == ["o1", "o2"]
+    assert [li.get("id") for li in index.subtree("o2")] == ["o2", "u1", "u2"]
+    assert index.subtree("b2") == [index.row("b2")]
+
+    assert index.task_rows() == get_task_list_items(outline_etree)
+    assert [li.get("id") for li in index.task_rows(done=True)] == ["t1"]
+    assert [li.get("id") for li in index.task_rows(done=False)] == ["t2", "t3"]
+    assert [li.get("id") for li in index.rows_of_type("code")] == ["c1", "c2"]
+    assert index.rows_of_type("missing") == []
+
+
+def test_outline_index_html_tree():
+    from lxml.html import fromstring
+
+    html = fromstring(OUTLINE_PATH.read_bytes())
+    index = OutlineIndex(html)
+    assert index.ids == OutlineIndex(ET.parse(str(OUTLINE_PATH)).getroot()).ids
+    assert index.task_rows() == get_task_list_items(html)
+
+
+def test_diff_outlines(outline_etree, tmp_path):
+    import copy
+
+    new = copy.deepcopy(outline_etree)
+    row = lambda id_: new.find(f".//{NS}li[@id='{id_}']")  # noqa: E731
+
+    assert diff_outlines(outline_etree, new) == []
+
+    # move c1 to the front of its siblings, t3 under Kp, delete q2 and add a row under h3
+    h2_ul = row("h2").find(f"{NS}ul")
+    h2_ul.insert(0, row("c1"))
+    row("Kp").find(f"{NS}ul").append(row("t3"))
+    row("t2").remove(row("t2").find(f"{NS}ul"))
+    h2_ul.remove(row("q2"))
+    added = ET.SubElement(row("h3").find(f"{NS}ul"), f"{NS}li", id="new")
+    ET.SubElement(added, f"{NS}p").text = "added"
+    # edit text, markup, type and done state
+    row("a1").find(f"{NS}p").text = "Edited body with "
+    row("b2").find(f"{NS}p").append(ET.Element(f"{NS}em"))
+    row("o1").set("data-type", "unordered")
+    row("t1").attrib.pop("data-done")
+    row("t2").set("data-done", "2024-01-01T00:00:00Z")
+
+    assert diff_outlines(outline_etree, new) == [
+        RowChange(
+            "text",
+            "a1",
+            "Plain body with bold and emphasis text",
+            "Edited body with bold and emphasis text",
+        ),
+        RowChange("done", "t1", "2023-08-01T22:39:45Z", None),
+        RowChange("done", "t2", None, "2024-01-01T00:00:00Z"),
+        RowChange("move", "c1", 3, 0),
+        RowChange("reparent", "t3", "t2", "Kp"),
+        RowChange("type", "o1", "ordered", "unordered"),
+        RowChange("insert", "new", None, "h3"),
+        RowChange("text", "b2", "Closing thoughts nested here.", "Closing thoughts nested here."),
+        RowChange("delete", "q2", "h2", None),
+    ]
+
+    old_path, new_path = tmp_path / "old.bike", tmp_path / "new.bike"
+    old_path.write_bytes(ET.tostring(outline_etree))
+    new_path.write_bytes(ET.tostring(new))
+    assert diff_bike_files(old_path, new_path) == diff_outlines(outline_etree, new)
+
+
+def test_diff_outlines_reports_fewest_moves():
+    def outline(order):
+        return ET.fromstring(
+            f'<html xmlns="{namespaces["ns"]}"><body><ul id="root">'
+            + "".join(f'<li id="{id_}"><p>{id_}</p></li>' for id_ in order)
+            + "</ul></body></html>"
+        )
+
+    changes = diff_outlines(outline("abcdef"), outline("bcdefa"))
+    assert changes == [RowChange("move", "a", 0, 5)]
+    changes = diff_outlines(outline("abcdef"), outline("fedcba"))
+    assert len(changes) == 5 and {c.kind for c in changes} == {"move"}
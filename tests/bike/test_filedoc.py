@@ -0,0 +1,103 @@
+"""
+test_filedoc.py
+"""
+import shutil
+
+import lxml.etree as ET
+import pytest
+
+from rdhyee_utils.bike import k
+from rdhyee_utils.bike.bikeformat import LI, NS
+from rdhyee_utils.bike.filedoc import FileBikeDocument
+
+from bike_samples import OUTLINE_PATH
+
+
+@pytest.fixture
+def doc(tmp_path):
+    path = tmp_path / "sample.bike"
+    shutil.copy(OUTLINE_PATH, path)
+    return FileBikeDocument(path)
+
+
+def names(row):
+    return [r.name for r in row.rows]
+
+
+def test_rows_and_ids(doc):
+    assert doc.ids[0] == doc.id == doc.root_row.id
+    assert [r.id for r in doc.rows] == doc.ids[1:]
+    assert [r.id for r in doc.root_row.rows] == ["Kp", "h3", "b2"]
+    assert doc.root_row.level == 0
+    assert doc.row("t3").level == 3
+    assert doc.row("t1").data_type == "task"
+    assert doc.row("a1").data_type == "body"
+    assert doc.row("missing") is None
+    assert doc.row("t3") == doc.row("t2").rows[0]
+
+
+def test_name(doc):
+    assert doc.row("Kp").name == "Projects"
+    assert doc.row("a1").name == "Plain body with bold and emphasis text"
+    assert not doc.modified
+    doc.row("a1").name = "Renamed"
+    assert doc.row("a1").text_content == "Renamed"
+    assert doc.modified
+    with pytest.raises(AttributeError):
+        doc.root_row.name = "root"
+
+
+def test_sort_rows(doc):
+    projects = doc.row("Kp")
+    doc.sort_rows(projects)
+    assert names(projects) == sorted(names(projects))
+    doc.sort_rows(projects, row_func=lambda r: len(r.rows), reverse=True)
+    assert [r.id for r in projects.rows][:2] == ["h2", "t2"]
+    # descendants move with their rows
+    assert [r.id for r in doc.row("t2").rows] == ["t3"]
+    assert doc.modified
+
+
+def test_swap_rows(doc):
+    projects = doc.row("Kp")
+    doc.swap_rows(projects, 0, 1)
+    assert [r.id for r in projects.rows] == ["t1", "a1", "t2", "h2"]
+    doc.swap_rows(projects, 3, 0)
+    assert [r.id for r in projects.rows] == ["h2", "a1", "t2", "t1"]
+    doc.swap_rows(projects, 2, 2)
+    assert [r.id for r in projects.rows] == ["h2", "a1", "t2", "t1"]
+
+
+def test_export(doc):
+    text = doc.export()
+    assert text.splitlines()[:2] == ["Projects", "\tPlain body with bold and emphasis text"]
+    assert "\t\tSubtask x = 1 inline" in text.splitlines()
+
+    opml = ET.fromstring(doc.export(as_=k.OPML_format).encode("utf-8"))
+    assert [o.get("text") for o in opml.find("body")] == ["Projects", "Lists", names(doc.root_row)[2]]
+
+    subset = doc.export(from_=[doc.row("t2")], all=False)
+    assert subset == "Open task with a link\n"
+
+    bike = ET.fromstring(doc.export(as_=k.bike_format, from_=[doc.row("t2")]).encode("utf-8"))
+    assert [li.get("id") for li in bike.iter(LI)] == ["t2", "t3"]
+    # exports are copies
+    doc.lxml_etree().find(f"{NS}body").clear()
+    assert len(doc.rows) == len(doc.ids) - 1
+
+
+def test_save(doc, tmp_path):
+    doc.swap_rows(doc.root_row, 0, 2)
+    doc.row("b2").name = "First"
+    doc.save()
+    assert not doc.modified
+
+    reloaded = FileBikeDocument(doc.path)
+    assert [r.id for r in reloaded.root_row.rows] == ["b2", "h3", "Kp"]
+    assert reloaded.row("b2").name == "First"
+    assert reloaded.ids == doc.ids
+
+    out = tmp_path / "sample.txt"
+    doc.save(in_=out, as_=k.plain_text_format)
+    assert out.read_text() == doc.export()
+    assert doc.path.name == "sample.bike"
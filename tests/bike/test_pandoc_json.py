@@ -0,0 +1,233 @@
+"""
+test_pandoc_json.py -- parity of the direct Pandoc JSON emitter with etree_to_panflute
+"""
+import copy
+import io
+import json
+
+import lxml.etree as ET
+import panflute as pf
+import pytest
+
+from rdhyee_utils.bike import bikeformat
+from rdhyee_utils.bike.bikeformat import (
+    NS,
+    SubtreeCache,
+    balanced_chunks,
+    namespaces,
+    convert_text,
+    etree_to_panflute,
+    etree_to_pandoc_json,
+    register_inline_tag,
+    rich_text,
+    rich_text_json,
+    write_pandoc_json,
+)
+
+from bike_samples import OUTLINE_PATH
+
+
+def bike_etree(rows: str):
+    xml = (
+        f'<html xmlns="{namespaces["ns"]}"><head><meta charset="utf-8"/></head>'
+        f'<body><ul id="root">{rows}</ul></body></html>'
+    )
+    return ET.fromstring(xml.encode("utf-8"), ET.XMLParser(remove_blank_text=True))
+
+
+def panflute_json(etree, only_doc_children=True):
+    """the JSON AST of the panflute conversion, as pandoc would receive it"""
+    pfd = etree_to_panflute(etree, only_doc_children=only_doc_children)
+    return json.loads(json.dumps(pfd.to_json()))
+
+
+PARITY_CASES = {
+    "sample": ET.parse(str(OUTLINE_PATH), ET.XMLParser(remove_blank_text=True)).getroot(),
+    "code runs": bike_etree(
+        '<li id="c1" data-type="code"><p>a</p><ul><li id="c2" data-type="code"><p>b</p></li></ul></li>'
+        '<li id="c3" data-type="code"><p>c</p></li>'
+        '<li id="b1"><p>between</p></li>'
+        '<li id="h1" data-type="heading"><p>h</p><ul>'
+        '<li id="u1" data-type="unordered"><p>u</p><ul>'
+        '<li id="c4" data-type="code"><p>d</p></li><li id="c5" data-type="code"><p>e</p></li>'
+        "</ul></li></ul></li>"
+    ),
+    "headings": bike_etree(
+        "".join(f'<li id="h{i}" data-type="heading"><p>level {i}</p><ul>' for i in range(8))
+        + '<li id="b"><p>deep</p></li>'
+        + "</ul></li>" * 8
+    ),
+    "inline": bike_etree(
+        '<li id="i1"><p>"quotes" \\ <a href="u?a=1&amp;b=2">l <em>e</em></a> tail'
+        '<span class="c" data-x="1">s</span><code>c <em>x</em></code> after<sub>z</sub>y</p></li>'
+        '<li id="i2"><p/></li>'
+        '<li id="i3" data-type="note"><p>n <strong>b</strong></p></li>'
+    ),
+    # runs of top-level rows that chunk boundaries fall into
+    "top-level runs": bike_etree(
+        "".join(f'<li id="c{i}" data-type="code"><p>code {i}</p></li>' for i in range(5))
+        + "".join(f'<li id="q{i}" data-type="quote"><p>quote {i}</p></li>' for i in range(5))
+        + '<li id="h1" data-type="heading"><p>h</p><ul>'
+        + "".join(f'<li id="t{i}" data-type="task"><p>task {i}</p></li>' for i in range(3))
+        + '</ul></li><li id="c5" data-type="code"><p>last</p></li>'
+    ),
+}
+
+
+@pytest.mark.parametrize("only_doc_children", [True, False])
+@pytest.mark.parametrize("case", sorted(PARITY_CASES))
+def test_parity_with_panflute(case, only_doc_children):
+    etree = PARITY_CASES[case]
+    expected = panflute_json(etree, only_doc_children)
+    assert json.loads(etree_to_pandoc_json(etree, only_doc_children)) == expected
+
+
+def test_write_pandoc_json_streams_to_file(tmp_path):
+    etree = PARITY_CASES["sample"]
+    path = tmp_path / "sample.json"
+    with open(path, "wb") as f:
+        write_pandoc_json(etree, f)
+    assert path.read_bytes() == etree_to_pandoc_json(etree)
+
+    out = io.BytesIO()
+    write_pandoc_json(etree, out, only_doc_children=False)
+    assert out.getvalue() == etree_to_pandoc_json(etree, only_doc_children=False)
+
+
+def test_top_level_list_rows_rejected():
+    etree = bike_etree('<li id="t1" data-type="task"><p>t</p></li>')
+    with pytest.raises(TypeError):
+        etree_to_panflute(etree)
+    with pytest.raises(TypeError):
+        etree_to_pandoc_json(etree)
+    # as part of the full document they are wrapped in a list
+    assert json.loads(etree_to_pandoc_json(etree, only_doc_children=False)) == (
+        panflute_json(etree, only_doc_children=False)
+    )
+
+
+@pytest.mark.requires_pandoc
+def test_convert_from_json():
+    etree = PARITY_CASES["sample"]
+    from_emitter = convert_text(etree_to_pandoc_json(etree), to_="markdown", from_="json")
+    from_panflute = convert_text(
+        json.dumps(etree_to_panflute(etree).to_json()), to_="markdown", from_="json"
+    )
+    assert from_emitter == from_panflute
+    assert "# Projects" in from_emitter
+
+
+@pytest.mark.parametrize("only_doc_children", [True, False])
+@pytest.mark.parametrize("case", sorted(PARITY_CASES))
+def test_cached_conversion_matches(case, only_doc_children):
+    etree = PARITY_CASES[case]
+    expected = etree_to_pandoc_json(etree, only_doc_children)
+    cache = SubtreeCache()
+    assert etree_to_pandoc_json(etree, only_doc_children, cache=cache) == expected
+    misses = cache.misses
+    assert etree_to_pandoc_json(etree, only_doc_children, cache=cache) == expected
+    # second run: only the top level rows are looked up, and all are hits
+    assert cache.misses == misses
+    assert cache.hits == len(etree.findall(f"{NS}body/{NS}ul/{NS}li"))
+
+
+def test_cached_conversion_after_edits():
+    etree = copy.deepcopy(PARITY_CASES["sample"])
+    cache = SubtreeCache()
+    etree_to_pandoc_json(etree, cache=cache)
+
+    def check():
+        cache.hits = cache.misses = 0
+        assert etree_to_pandoc_json(etree, cache=cache) == etree_to_pandoc_json(etree)
+
+    # edit one row: only the rows on the path to it are converted again
+    etree.find(f".//{NS}li[@id='t3']/{NS}p").text = "Edited "
+    check()
+    assert cache.misses == 3  # Kp, t2, t3
+
+    # done state, data-type changes and moves
+    etree.find(f".//{NS}li[@id='t2']").set("data-done", "2024-01-01T00:00:00Z")
+    check()
+    etree.find(f".//{NS}li[@id='a1']").set("data-type", "code")
+    check()
+    h2 = etree.find(f".//{NS}li[@id='h2']")
+    h3_ul = etree.find(f".//{NS}li[@id='h3']/{NS}ul")
+    h3_ul.insert(0, h2)
+    check()
+
+    cache.max_bytes = 0
+    cache.put("k", next(iter(cache._entries.values())))
+    assert "k" not in cache
+
+
+def test_code_blocks_merged_while_converting():
+    etree = PARITY_CASES["code runs"]
+    pfd = etree_to_panflute(etree)
+    blocks = [type(e).__name__ for e in pfd.content]
+    assert blocks == ["CodeBlock", "Para", "Header", "BulletList"]
+    assert pfd.content[0].text == "a\nb\nc"
+    # the filter, kept for other documents, finds nothing left to merge
+    before = pfd.to_json()
+    pf.run_filter(bikeformat.merge_consecutive_codeblocks, doc=pfd)
+    assert pfd.to_json() == before
+
+
+def test_balanced_chunks():
+    assert balanced_chunks([1] * 10, 3) == [range(0, 4), range(4, 7), range(7, 10)]
+    assert balanced_chunks([8, 1, 1, 1, 1], 2) == [range(0, 1), range(1, 5)]
+    assert balanced_chunks([1, 1], 4) == [range(0, 1), range(1, 2)]
+    assert balanced_chunks([], 4) == []
+
+
+@pytest.mark.parametrize("only_doc_children", [True, False])
+@pytest.mark.parametrize("case", sorted(PARITY_CASES))
+def test_parallel_conversion_matches(case, only_doc_children):
+    etree = PARITY_CASES[case]
+    expected = etree_to_pandoc_json(etree, only_doc_children)
+    for max_workers in (2, 3):
+        assert etree_to_pandoc_json(etree, only_doc_children, max_workers=max_workers) == expected
+
+
+def test_parallel_panflute():
+    etree = PARITY_CASES["top-level runs"]
+    pfd = etree_to_panflute(etree, max_workers=2)
+    assert isinstance(pfd, pf.Doc)
+    assert pfd.to_json() == etree_to_panflute(etree).to_json()
+
+    with pytest.raises(ValueError):
+        etree_to_pandoc_json(etree, cache=SubtreeCache(), max_workers=2)
+    with pytest.raises(ValueError):
+        etree_to_pandoc_json(bike_etree('<li id="t1"><p>t</p></li><p>stray</p>'), max_workers=2)
+
+
+@pytest.fixture
+def inline_tables(monkeypatch):
+    """let tests register inline tags without leaking them"""
+    for name in ("INLINE_HANDLERS", "INLINE_JSON_HANDLERS", "INLINE_CONTAINER_TAGS"):
+        monkeypatch.setattr(bikeformat, name, copy.copy(getattr(bikeformat, name)))
+
+
+@pytest.mark.parametrize("with_json", [True, False])
+def test_register_inline_tag(inline_tables, with_json):
+
+    p = ET.fromstring(f'<p xmlns="{namespaces["ns"]}">x<sup>2 <em>e</em></sup> y<kbd>K<b>b</b></kbd>!</p>')
+    # unknown tags are flattened
+    assert [type(e).__name__ for e in rich_text(p)] == ["Str", "Str", "Str"]
+
+    to_json = None
+    if with_json:
+        def to_json(xhtml, parts):
+            return ['{"t":"Superscript","c":[' + ",".join(parts) + "]}"]
+
+    register_inline_tag("sup", lambda xhtml, parts: [pf.Superscript(*parts)], to_json)
+    register_inline_tag(
+        f"{NS}kbd", lambda xhtml, parts: [pf.Code(bikeformat.text_content(xhtml))], container=False
+    )
+    inlines = rich_text(p)
+    assert [type(e).__name__ for e in inlines] == ["Str", "Superscript", "Code"]
+    assert pf.stringify(inlines[1]) == "2 e y"
+    # like code, a flattened element carries its tail
+    assert inlines[2].text == "Kb!"
+
+    expected = json.loads(json.dumps([e.to_json() for e in inlines]))
+    assert json.loads("[" + rich_text_json(p) + "]") == expected
@@ -0,0 +1,52 @@
+"""
+test_search.py
+"""
+import os
+
+from rdhyee_utils.bike.search import SearchIndex, fts_query
+
+
+def test_fts_query():
+    assert fts_query('open "task" OR x*') == '"open" AND "task" AND "OR" AND "x"'
+    assert fts_query("  ") == ""
+
+
+def test_search(src_dir, tmp_path):
+    with SearchIndex(tmp_path / "search.db") as index:
+        assert index.refresh([src_dir]) == {"indexed": 2, "unchanged": 0, "removed": 0}
+
+        hits = index.search("subtask", file=src_dir / "a.bike")
+        assert [(h.id, h.data_type, h.text) for h in hits] == [
+            ("t3", "task", "Subtask x = 1 inline")
+        ]
+        assert hits[0].file == str((src_dir / "a.bike").resolve())
+        assert hits[0].breadcrumbs == ("Projects", "Open task with a link")
+
+        # rows whose own text matches rank above rows matching only through breadcrumbs
+        hits = index.search("link")
+        assert [h.id for h in hits] == ["t2", "t2", "t3", "t3"]
+        assert hits[0].score < hits[2].score
+
+        assert [h.id for h in index.search("task", data_type="task", limit=2)] == ["t1", "t1"]
+        hits = index.search("done OR subtask", raw=True, file=src_dir / "a.bike")
+        assert [h.id for h in hits] == ["t1", "t3"]
+        assert index.search("") == []
+
+
+def test_refresh_incremental(src_dir, tmp_path):
+    db = tmp_path / "search.db"
+    with SearchIndex(db) as index:
+        index.refresh([src_dir])
+
+    with SearchIndex(db) as index:
+        # touched but identical content: not reindexed
+        os.utime(src_dir / "a.bike", ns=(0, 1))
+        assert index.refresh([src_dir]) == {"indexed": 0, "unchanged": 2, "removed": 0}
+
+        b = src_dir / "nested" / "b.bike"
+        b.write_text(b.read_text().replace("Subtask", "Errand"))
+        (src_dir / "a.bike").unlink()
+        assert index.refresh([src_dir]) == {"indexed": 1, "unchanged": 0, "removed": 1}
+        assert index.files() == [str(b.resolve())]
+        assert index.search("subtask") == []
+        assert [h.id for h in index.search("errand")] == ["t3"]
@@ -0,0 +1,56 @@
+"""
+test_taskindex.py
+"""
+import datetime
+import os
+
+from rdhyee_utils.bike.taskindex import TaskIndex
+
+
+def test_task_queries(src_dir, tmp_path):
+    with TaskIndex(tmp_path / "tasks.db") as index:
+        assert index.refresh([src_dir]) == {"indexed": 2, "unchanged": 0, "removed": 0}
+
+        a = str((src_dir / "a.bike").resolve())
+        tasks = index.tasks(file=src_dir / "a.bike")
+        assert [(t.id, t.text, t.done) for t in tasks] == [
+            ("t1", "Done task", "2023-08-01T22:39:45Z"),
+            ("t2", "Open task with a link", None),
+            ("t3", "Subtask x = 1 inline", None),
+        ]
+        assert tasks[0].file == a
+        assert tasks[2].ancestors == ("Projects", "Open task with a link")
+
+        assert [t.id for t in index.tasks(done=False)] == ["t2", "t3", "t2", "t3"]
+        assert [t.id for t in index.tasks(done=True, file=a)] == ["t1"]
+        assert len(index.tasks(done_since=datetime.date(2023, 8, 1))) == 2
+        assert index.tasks(done_since=datetime.datetime(2023, 8, 2)) == []
+        assert len(index.tasks(done_before="2023-08-02T00:00:00Z")) == 2
+        assert len(index.tasks(under="Projects")) == 6
+        assert index.tasks(under="Open task with a link") == []
+        assert [t.id for t in index.tasks(under="Open task with a link", under_type=None)] == [
+            "t3",
+            "t3",
+        ]
+        assert [t.id for t in index.tasks(text="SUBTASK", file=a)] == ["t3"]
+        assert index.tasks(text="%") == []
+
+
+def test_refresh_only_changed_files(src_dir, tmp_path):
+    db = tmp_path / "tasks.db"
+    with TaskIndex(db) as index:
+        index.refresh([src_dir])
+
+    # the index persists across connections
+    with TaskIndex(db) as index:
+        assert index.refresh([src_dir]) == {"indexed": 0, "unchanged": 2, "removed": 0}
+
+        b = src_dir / "nested" / "b.bike"
+        done = 'data-type="task" data-done="2024-01-01T00:00:00Z">'
+        b.write_text(b.read_text().replace('data-type="task">', done))
+        os.utime(b, ns=(0, 1))
+        (src_dir / "a.bike").unlink()
+        assert index.refresh([src_dir]) == {"indexed": 1, "unchanged": 0, "removed": 1}
+        assert index.files() == [str(b.resolve())]
+        assert index.tasks(done=False) == []
+        assert len(index.tasks(done=True)) == 3
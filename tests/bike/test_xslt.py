@@ -0,0 +1,129 @@
+"""
+test_xslt.py -- the XSLT fast path must write what pandoc writes
+"""
+import copy
+
+import lxml.etree as ET
+import pytest
+
+from rdhyee_utils.bike import batch, bikeformat
+from rdhyee_utils.bike.bikeformat import convert_text, etree_to_pandoc_json, namespaces
+from rdhyee_utils.bike.xslt import UnsupportedBikeContent, xslt_convert
+
+from bike_samples import OUTLINE_PATH
+
+
+def bike_etree(rows: str):
+    xml = (
+        f'<html xmlns="{namespaces["ns"]}"><head><meta charset="utf-8"/></head>'
+        f'<body><ul id="root">{rows}</ul></body></html>'
+    )
+    return ET.fromstring(xml.encode("utf-8"), ET.XMLParser(remove_blank_text=True))
+
+
+def sample_without_notes():
+    """outline.bike with its note row (a footnote, left to pandoc) made a plain row"""
+    etree = ET.parse(str(OUTLINE_PATH), ET.XMLParser(remove_blank_text=True)).getroot()
+    for li in etree.iterfind(".//{*}li[@data-type='note']"):
+        del li.attrib["data-type"]
+    return etree
+
+
+def rows(data_type, n, children=""):
+    return "".join(
+        f'<li id="{data_type}{i}" data-type="{data_type}"><p>{data_type} {i}</p>{children}</li>'
+        for i in range(n)
+    )
+
+
+CASES = {
+    "sample": sample_without_notes(),
+    "lists": bike_etree(
+        '<li id="h1" data-type="heading"><p>Lists</p><ul>'
+        + rows("task", 2)
+        + rows("unordered", 2, f"<ul>{rows('ordered', 12)}</ul>")
+        + rows("code", 2)
+        + rows("ordered", 3)
+        + '<li id="hr" data-type="hr"><p/></li>'
+        + rows("quote", 2, f"<ul>{rows('code', 1)}{rows('body', 1)}</ul>")
+        + "</ul></li>"
+        '<li id="e1"><p/></li><li id="h2" data-type="heading"><p>Next</p></li>'
+    ),
+    # runs longer than the stylesheets walk per template call
+    "long runs": bike_etree(
+        f'<li id="h1" data-type="heading"><p>h</p><ul>{rows("task", 70)}{rows("ordered", 65)}</ul></li>'
+        + rows("code", 70)
+    ),
+    "inline": bike_etree(
+        '<li id="i1"><p>1. *a* <a href="https://example.com/?a=1&amp;b=2">l <em>e</em></a> '
+        '<a href="https://example.com">https://example.com</a> x_y _z [n] #t &lt;b&gt;'
+        '<span class="c" data-x="1">s</span><code>c `x`</code> <mark>m</mark><s>gone</s></p></li>'
+        '<li id="i2"><p>-</p></li>'
+        '<li id="i3" data-type="heading"><p>n <strong>b</strong></p></li>'
+    ),
+}
+
+
+@pytest.mark.requires_pandoc
+@pytest.mark.parametrize("to", ["html", "commonmark"])
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_parity_with_pandoc(case, to):
+    """against the pandoc installed, which should be xslt.PANDOC_VERSION"""
+    etree = CASES[case]
+    expected = convert_text(etree_to_pandoc_json(etree), to_=to, from_="json")
+    assert xslt_convert(etree, to=to) == expected
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        '<li id="t1" data-type="task"><p>top-level list row</p></li>',
+        '<li id="c1"><p>a <!-- comment --></p></li>',
+        '<li id="n1" data-type="note"><p>footnote</p></li>',
+        '<li id="c1" data-type="code"><p></p></li>',
+        '<li id="l1"><p><a>no href</a></p></li>',
+    ],
+)
+def test_unsupported_content(rows):
+    with pytest.raises(UnsupportedBikeContent):
+        xslt_convert(bike_etree(rows), to="commonmark")
+
+
+def test_unsupported_options(monkeypatch):
+    import panflute as pf
+
+    etree = CASES["lists"]
+    with pytest.raises(UnsupportedBikeContent):
+        xslt_convert(etree, to="markdown")
+    with pytest.raises(UnsupportedBikeContent):
+        xslt_convert(etree, only_doc_children=False)
+    for name in ("INLINE_HANDLERS", "INLINE_JSON_HANDLERS", "INLINE_CONTAINER_TAGS"):
+        monkeypatch.setattr(bikeformat, name, copy.copy(getattr(bikeformat, name)))
+    bikeformat.register_inline_tag("sup", lambda xhtml, parts: [pf.Superscript(*parts)])
+    with pytest.raises(UnsupportedBikeContent):
+        xslt_convert(etree)
+
+
+def test_xslt_engine_without_pandoc(tmp_path, monkeypatch):
+    def no_pandoc(*args, **kwargs):
+        raise OSError("No pandoc was found")
+
+    monkeypatch.setattr(batch.pypandoc, "get_pandoc_version", no_pandoc)
+    monkeypatch.setattr(batch, "convert_text", no_pandoc)
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "notes.bike").write_bytes(OUTLINE_PATH.read_bytes())
+    (src / "plain.bike").write_text(OUTLINE_PATH.read_text().replace('data-type="note"', ""))
+
+    for expected in ("converted", "skipped"):
+        results = batch.convert_directory(
+            src, tmp_path / "out", to="html", engine="xslt", max_workers=1
+        )
+        # the note row needs pandoc
+        assert [(r.path.name, r.status) for r in results] == [
+            ("notes.bike", "failed"),
+            ("plain.bike", expected),
+        ]
+    assert "<h1" in (tmp_path / "out" / "plain.html").read_text()
+    with pytest.raises(OSError):
+        batch.convert_directory(src, tmp_path / "out", to="html", max_workers=1)
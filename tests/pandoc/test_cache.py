@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from rdhyee_utils.pandoc.cache import ConversionCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ConversionCache(tmp_path / "cache", max_bytes=100, pandoc_version="3.1")
+
+
+def test_key_depends_on_every_input(cache):
+    base = cache.key("# hi", "html", "markdown", extra_args=("--wrap=none",))
+    assert base == cache.key(b"# hi", "html", "markdown", extra_args=["--wrap=none"])
+    assert base != cache.key("# hi!", "html", "markdown", extra_args=("--wrap=none",))
+    assert base != cache.key("# hi", "latex", "markdown", extra_args=("--wrap=none",))
+    assert base != cache.key("# hi", "html", "commonmark", extra_args=("--wrap=none",))
+    assert base != cache.key("# hi", "html", "markdown")
+    assert base != cache.key(
+        "# hi", "html", "markdown", extra_args=("--wrap=none",), filters=["f.lua"]
+    )
+    other_pandoc = ConversionCache(cache.path, pandoc_version="3.2")
+    assert base != other_pandoc.key("# hi", "html", "markdown", extra_args=("--wrap=none",))
+
+
+def test_key_hashes_filter_contents(cache, tmp_path):
+    lua = tmp_path / "f.lua"
+    lua.write_text("return {}")
+    before = cache.key("x", "html", "markdown", filters=str(lua))
+    lua.write_text("return {{}}")
+    assert before != cache.key("x", "html", "markdown", filters=str(lua))
+
+
+def test_hits_and_misses(cache):
+    key = cache.key("a", "html", "markdown")
+    assert cache.get(key) is None
+    cache.put(key, "<p>a</p>")
+    assert cache.get(key) == "<p>a</p>"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1, "bytes": 8}
+
+
+def test_lru_eviction(cache):
+    keys = [cache.key(str(i), "html", "markdown") for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, "x" * 30)
+    cache.get(keys[0])  # keys[1] is now the least recently used
+    cache.put(keys[3], "x" * 30)
+    assert keys[1] not in cache
+    assert all(k in cache for k in (keys[0], keys[2], keys[3]))
+    assert cache.evictions == 1
+    assert cache.total_bytes == 90
+
+    # too big to ever fit
+    cache.put(cache.key("big", "html", "markdown"), "x" * 101)
+    assert len(cache) == 3
+
+
+def test_reopen_keeps_entries_and_order(cache):
+    keys = [cache.key(str(i), "html", "markdown") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, "x" * 30)
+        os.utime(cache._entry_path(key), (1000 + i, 1000 + i))
+
+    reopened = ConversionCache(cache.path, max_bytes=100, pandoc_version="3.1")
+    assert reopened.get(keys[0]) == "x" * 30
+    reopened.put(reopened.key("new", "html", "markdown"), "x" * 30)
+    assert keys[1] not in reopened
+    assert keys[0] in reopened
+
+    reopened.clear()
+    assert len(reopened) == 0
+    assert not list(reopened.path.glob("*/*"))
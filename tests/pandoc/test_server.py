@@ -0,0 +1,129 @@
+import stat
+import sys
+
+import pytest
+
+from rdhyee_utils.pandoc.server import (
+    PandocServer,
+    PandocServerError,
+    PandocServerPool,
+    convert_text,
+    server_options,
+    try_server_convert,
+)
+
+# stands in for pandoc: `fake_pandoc server --port=N` serves the pandoc server API,
+# `fake_pandoc --from=F --to=T` converts stdin; a "conversion" is just "T:F:text"
+FAKE_PANDOC = f"""#!{sys.executable}
+import json, sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def convert(params):
+    if params["from"] == "bogus":
+        return {{"error": "Unknown input format bogus"}}
+    opts = ",".join(f"{{k}}={{v}}" for k, v in sorted(params.items()) if k not in ("text", "from", "to"))
+    return {{"output": f"{{params['to']}}:{{params['from']}}:{{opts}}:{{params['text']}}", "base64": False, "messages": []}}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply("3.1")
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/batch":
+            self.reply([convert(p) for p in params])
+        else:
+            self.reply(convert(params))
+
+    def log_message(self, *args):
+        pass
+
+args = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+if sys.argv[1] == "server":
+    ThreadingHTTPServer(("127.0.0.1", int(args["port"])), Handler).serve_forever()
+else:
+    flags = {{a: v for a, v in args.items() if a not in ("from", "to")}}
+    opts = ",".join(f"{{k}}={{v}}" for k, v in sorted(flags.items()))
+    sys.stdout.write(f"{{args['to']}}:{{args['from']}}:{{opts}}:{{sys.stdin.read()}}\\n")
+"""
+
+
+@pytest.fixture
+def fake_pandoc(tmp_path):
+    path = tmp_path / "pandoc"
+    path.write_text(FAKE_PANDOC)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.fixture
+def server(fake_pandoc):
+    with PandocServer(pandoc_path=fake_pandoc) as server:
+        yield server
+
+
+def test_server_options():
+    assert server_options(("--wrap=none", "--columns=72", "-s")) == {
+        "wrap": "none",
+        "columns": 72,
+        "standalone": True,
+    }
+    assert server_options(()) == {}
+    assert server_options(("--filter=pandoc-citeproc",)) is None
+    assert server_options(("--columns=wide",)) is None
+    assert server_options(("--wrap", "none")) is None
+
+
+def test_server_convert(server):
+    assert server.alive
+    assert server.convert("# hi", "html", "markdown", {"wrap": "none"}) == "html:markdown:wrap=none:# hi\n"
+    assert server.convert_batch(
+        [{"text": "a", "from": "markdown", "to": "html"}, {"text": "b", "from": "rst", "to": "latex"}]
+    ) == ["html:markdown::a\n", "latex:rst::b\n"]
+    with pytest.raises(PandocServerError):
+        server.convert("a", "html", "bogus")
+
+
+def test_convert_text_matches_subprocess(server, fake_pandoc):
+    for extra_args in [(), ("--wrap=none",)]:
+        via_server = convert_text("a", "html", extra_args=extra_args, server=server)
+        via_subprocess = convert_text("a", "html", extra_args=extra_args, pandoc_path=fake_pandoc)
+        assert via_server == via_subprocess
+
+
+def test_fallback_to_subprocess(server, fake_pandoc):
+    # the server can't run filters
+    assert try_server_convert(server, "a", "html", "markdown", ("--filter=f",)) is None
+    assert convert_text(
+        "a", "html", extra_args=("--filter=f",), server=server, pandoc_path=fake_pandoc
+    ) == "html:markdown:filter=f:a\n"
+
+    server.stop()
+    assert try_server_convert(server, "a", "html", "markdown") is None
+    assert convert_text("a", "html", server=server, pandoc_path=fake_pandoc) == "html:markdown::a\n"
+
+
+def test_pool_restarts_dead_servers(fake_pandoc):
+    with PandocServerPool(size=2, pandoc_path=fake_pandoc) as pool:
+        assert all(s.alive for s in pool.servers)
+        pool.servers[0].process.kill()
+        pool.servers[0].process.wait()
+        assert [pool.convert("a", "html", "markdown") for _ in range(4)] == ["html:markdown::a\n"] * 4
+        assert all(s.alive for s in pool.servers)
+
+
+def test_pool_that_cannot_start(tmp_path, fake_pandoc):
+    pool = PandocServerPool(size=1, pandoc_path=str(tmp_path / "missing"))
+    assert not pool.servers[0].alive
+    with pytest.raises(PandocServerError):
+        pool.convert("a", "html", "markdown")
+    assert convert_text("a", "html", server=pool, pandoc_path=fake_pandoc) == "html:markdown::a\n"